@@ -19,12 +19,68 @@ File containing all the basic functions
 '''
 
 import re
+from copy import deepcopy
 
 from merger_settings import DEFAULT_PRIORITY_LIST, FIELDS_PRIORITY_LIST, \
-        MARC_TO_FIELD, PRIORITIES, ORIGIN_SUBFIELD
-from merger_errors import OriginNotFound, OriginValueNotFound
+        MARC_TO_FIELD, PRIORITIES, ORIGIN_SUBFIELD, ORIGIN_IMPORTANCE_CACHE_SIZE
+from merger_errors import OriginNotFound, OriginValueNotFound, GenericError
 import invenio.bibrecord as bibrecord
 
+class SubfieldList(list):
+    """List of the subfields of a field that indexes lazily their values by code.
+    It is still a list, so the fields containing it are normal bibrecord fields,
+    and it is pickled as a plain list (bibupload doesn't know this class)."""
+
+    __slots__ = ('values_by_code',)
+
+    def __init__(self, subfields=()):
+        list.__init__(self, subfields)
+        #dictionary code -> tuple of values (None until the first lookup)
+        self.values_by_code = None
+
+    def get_values(self, code):
+        """returns the tuple of values of the subfields with a code"""
+        if self.values_by_code is None:
+            values_by_code = {}
+            for subfield_code, value in self:
+                values_by_code[subfield_code] = values_by_code.get(subfield_code, ()) + (value,)
+            self.values_by_code = values_by_code
+        return self.values_by_code.get(code, ())
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+    def __copy__(self):
+        return SubfieldList(self)
+
+    def __deepcopy__(self, memo):
+        return SubfieldList(deepcopy(subfield, memo) for subfield in self)
+
+def _reset_values_by_code(method):
+    """Decorator for the methods modifying a SubfieldList: the index is built again at the next lookup"""
+    def modifying_method(self, *args, **kwargs):
+        self.values_by_code = None
+        return method(self, *args, **kwargs)
+    modifying_method.__name__ = method.__name__
+    return modifying_method
+
+for _method_name in ('append', 'extend', 'insert', 'remove', 'pop', 'sort', 'reverse', '__setitem__', 
+                     '__delitem__', '__setslice__', '__delslice__', '__iadd__', '__imul__'):
+    setattr(SubfieldList, _method_name, _reset_values_by_code(getattr(list, _method_name)))
+del _method_name
+
+def get_subfield_values(field, code):
+    """function that returns the values of the subfields with a code:
+    if the field has a SubfieldList the values are taken from its index 
+    (as a tuple) without scanning the subfields"""
+    subfields = field[0]
+    if type(subfields) is SubfieldList:
+        values_by_code = subfields.values_by_code
+        if values_by_code is not None:
+            return values_by_code.get(code, ())
+        return subfields.get_values(code)
+    return bibrecord.field_get_subfield_values(field, code)
+
 def is_unicode(s):
     """function that checks if a string contains unicode or not"""
     try:
@@ -55,7 +111,7 @@ def get_origin(fields):
     """function that extracts the origin of a field"""
     origins = set()
     for field in fields:
-        origins.update(bibrecord.field_get_subfield_values(field, ORIGIN_SUBFIELD))
+        origins.update(get_subfield_values(field, ORIGIN_SUBFIELD))
 
     if not origins:
         raise OriginNotFound(fields)
@@ -68,53 +124,96 @@ def get_origin(fields):
 
     return origin
 
+def get_priority_lists():
+    """Function that resolves once the priority list of every marc tag:
+    it returns a dictionary marc tag -> dictionary origin -> importance"""
+    priority_lists = {}
+    for tag, field_name in MARC_TO_FIELD.items():
+        #if there is no specific list I use the default one
+        priority_lists[tag] = PRIORITIES[FIELDS_PRIORITY_LIST.get(field_name, DEFAULT_PRIORITY_LIST)]
+    return priority_lists
+
+#priority list per tag
+PRIORITY_LISTS = get_priority_lists()
+
+#cache of the importance of the origin strings: (tag, origins) -> importance
+ORIGIN_IMPORTANCE_CACHE = {}
+#hits and misses of the cache
+ORIGIN_IMPORTANCE_CACHE_STATS = {'hits': 0, 'misses': 0}
+
 def get_origin_importance(tag, origins):
     """function that returns the value of the importance of an origin
     if multiple origin are present, the one with the highest value is returned"""
-    # Split the string in a list of origins
-    origin_list = origins.split(';')
+    try:
+        value = ORIGIN_IMPORTANCE_CACHE[(tag, origins)]
+    except KeyError:
+        pass
+    else:
+        ORIGIN_IMPORTANCE_CACHE_STATS['hits'] += 1
+        return value
+    ORIGIN_IMPORTANCE_CACHE_STATS['misses'] += 1
+    value = _compute_origin_importance(tag, origins)
+    #the cache is emptied when it is full (there are only a few combinations of origins)
+    if len(ORIGIN_IMPORTANCE_CACHE) >= ORIGIN_IMPORTANCE_CACHE_SIZE:
+        ORIGIN_IMPORTANCE_CACHE.clear()
+    ORIGIN_IMPORTANCE_CACHE[(tag, origins)] = value
+    return value
+
+def _compute_origin_importance(tag, origins):
+    """function that computes the importance of an origin string without the cache"""
+    priority_list = PRIORITY_LISTS.get(tag)
+    if priority_list is None:
+        priority_list = PRIORITIES[DEFAULT_PRIORITY_LIST]
     #default value
     value = 0
-
-    for origin in origin_list:
+    # Split the string in a list of origins
+    for origin in origins.split(';'):
         origin = origin.strip().upper()
-        #first of all I try to see if there is a specific list
-        #otherwise I use the default one
         try:
-            priority_list_name = FIELDS_PRIORITY_LIST[MARC_TO_FIELD[tag]]
-        except KeyError:
-            priority_list_name = DEFAULT_PRIORITY_LIST
-        
-        priority_list = PRIORITIES[priority_list_name]
-
-        if origin in priority_list:
             cur_value = priority_list[origin]
-        else:
+        except KeyError:
             raise OriginValueNotFound('Priority value not found for origin "%s"' % origin)
-
         if cur_value > value:
             value = cur_value
     return value
 
-def compare_fields_exclude_subfiels(field1, field2, strict=True, exclude_subfields=[]):
-    """
-    Works exactly like bibrecord._compare_fields with the only difference that 
-    if strict is False, I can exclude a list of subfields from the comparison
-    """
-    if strict:
-        # Return a simple equal test on the field minus the position.
-        return field1[:4] == field2[:4]
-    else:
-        if field1[1:4] != field2[1:4]:
-            # Different indicators or controlfield value.
-            return False
-        else:
-            # Compare subfields in a loose way.
-            return set([subfield for subfield in field1[0] if subfield[0] not in exclude_subfields ]) \
-                == set([subfield for subfield in field2[0] if subfield[0] not in exclude_subfields ])
-                
-def record_delete_subfield(rec, tag, subfield_code):
-    """Deletes all subfields with subfield_code in the record.
-    without considering the indicators"""
-    for field in rec.get(tag, []):
-        field[0][:] = [subfield for subfield in field[0] if subfield_code != subfield[0]]
+def get_origin_importance_cache_info():
+    """function that returns the hits, the misses and the size of the cache of the origin importance"""
+    return dict(ORIGIN_IMPORTANCE_CACHE_STATS, size=len(ORIGIN_IMPORTANCE_CACHE), max_size=ORIGIN_IMPORTANCE_CACHE_SIZE)
+
+def clear_origin_importance_cache():
+    """function that empties the cache of the origin importance and resets its counters"""
+    ORIGIN_IMPORTANCE_CACHE.clear()
+    ORIGIN_IMPORTANCE_CACHE_STATS['hits'] = 0
+    ORIGIN_IMPORTANCE_CACHE_STATS['misses'] = 0
+
+def record_without_subfields(rec, subfield_codes):
+    """Returns a copy of the record without the subfields with the given codes.
+    Only the fields that contain these subfields (and the lists of fields
+    of their tags) are copied: all the others are shared with the original record."""
+    new_rec = {}
+    for tag, fields in rec.iteritems():
+        new_fields = None
+        for index, field in enumerate(fields):
+            for subfield in field[0]:
+                if subfield[0] in subfield_codes:
+                    break
+            else:
+                continue
+            if new_fields is None:
+                new_fields = list(fields)
+            new_fields[index] = ([subfield for subfield in field[0] if subfield[0] not in subfield_codes], ) + field[1:]
+        new_rec[tag] = fields if new_fields is None else new_fields
+    return new_rec
+
+def resolve_function(function_name, modules):
+    """Function that returns the function with a name like "module.function" 
+    from a dictionary of modules: it raises an error if the function doesn't exist"""
+    try:
+        module_name, name = function_name.rsplit('.', 1)
+        function = getattr(modules[module_name], name)
+    except (ValueError, KeyError, AttributeError):
+        raise GenericError('Unknown merging function "%s"' % function_name)
+    if not callable(function):
+        raise GenericError('"%s" is not a function' % function_name)
+    return function
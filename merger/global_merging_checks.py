@@ -18,17 +18,15 @@
 
 Global checks on the entire record.
 '''
-import logging
 
-from invenio import bibrecord
-
-from merger_settings import FIELD_TO_MARC, \
+from merger_settings import MERGER_SILENT_MODE, FIELD_TO_MARC, \
                     SYSTEM_NUMBER_SUBFIELD, PUBL_DATE_SUBFIELD, \
                     PUBL_DATE_TYPE_SUBFIELD, PUBL_DATE_TYPE_VAL_SUBFIELD,\
                     AUTHOR_NAME_SUBFIELD
-from pipeline_log_functions import manage_check_error
+from basic_functions import get_subfield_values
+from pipeline_log_functions import manage_check_error, get_logger
 import pipeline_settings
-logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
+logger = get_logger(pipeline_settings.LOGGING_WORKER_NAME, MERGER_SILENT_MODE)
 
 def check_pub_year_consistency(merged_record, type_check):
     """Function that checks if the publication year is consistent 
@@ -50,7 +48,7 @@ def check_pub_year_consistency(merged_record, type_check):
     if len(system_number_fields) > 1:
         manage_check_error('There are more than one System Numbers!', type_check, logger)
         return None
-    system_number = bibrecord.field_get_subfield_values(system_number_fields[0], SYSTEM_NUMBER_SUBFIELD)[0]
+    system_number = get_subfield_values(system_number_fields[0], SYSTEM_NUMBER_SUBFIELD)[0]
     num_dates_checked = 0
     for date_type_string in PUBL_DATE_TYPE_VAL_SUBFIELD:
         #I don't want to check the preprint date
@@ -59,8 +57,8 @@ def check_pub_year_consistency(merged_record, type_check):
         #then I have to extract the right date (there can be different in the same field)
         pubdate = ''
         for field in pub_dates_fields:
-            if bibrecord.field_get_subfield_values(field, PUBL_DATE_TYPE_SUBFIELD)[0] == date_type_string:
-                pubdate =  bibrecord.field_get_subfield_values(field, PUBL_DATE_SUBFIELD)[0]
+            if get_subfield_values(field, PUBL_DATE_TYPE_SUBFIELD)[0] == date_type_string:
+                pubdate =  get_subfield_values(field, PUBL_DATE_SUBFIELD)[0]
                 break
         if len(pubdate) != 0:
             num_dates_checked +=1
@@ -96,8 +94,8 @@ def first_author_bibcode_consistency(merged_record, type_check):
     if len(first_author_fields) > 1:
         manage_check_error('There are more than one First Author!', type_check, logger)
         return None
-    system_number = bibrecord.field_get_subfield_values(system_number_fields[0], SYSTEM_NUMBER_SUBFIELD)[0]
-    first_author = bibrecord.field_get_subfield_values(first_author_fields[0], AUTHOR_NAME_SUBFIELD)[0]
+    system_number = get_subfield_values(system_number_fields[0], SYSTEM_NUMBER_SUBFIELD)[0]
+    first_author = get_subfield_values(first_author_fields[0], AUTHOR_NAME_SUBFIELD)[0]
     #If the bibcode has a bibstem to skip, I don't do anything
     for elem in bibstems_to_skip_from_check:
         if system_number[4:4+len(elem)] == elem:
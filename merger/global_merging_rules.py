@@ -23,34 +23,43 @@ The solution is taking all the fields that cannot be merged during
 a simple merging function and normalize the necessary fields.
 '''
 
-from copy import deepcopy
-import logging
 
-from invenio import bibrecord
-
-from merger_settings import ORIGIN_SUBFIELD, FIELD_TO_MARC, CREATION_DATE_SUBFIELD, \
+from merger_settings import MERGER_SILENT_MODE, ORIGIN_SUBFIELD, FIELD_TO_MARC, CREATION_DATE_SUBFIELD, \
                         MODIFICATION_DATE_SUBFIELD, GLOBAL_MERGING_CHECKS, TEMP_SUBFIELDS_LIST
-from basic_functions import get_origin_importance, record_delete_subfield
+from functools import partial
+
+from basic_functions import get_origin_importance, record_without_subfields, resolve_function, get_subfield_values
 from merger_errors import GenericError
 import pipeline_settings
+from pipeline_log_functions import get_logger
 import global_merging_checks
 
-logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
+logger = get_logger(pipeline_settings.LOGGING_WORKER_NAME, MERGER_SILENT_MODE)
+
+def get_global_merging_checks():
+    """Function that resolves once the checks of GLOBAL_MERGING_CHECKS:
+    it returns a tuple of checks to call with the merged record"""
+    checks = []
+    for type_check, func_ck_list in GLOBAL_MERGING_CHECKS.items():
+        for func_ck_str in func_ck_list:
+            func_ck = resolve_function(func_ck_str, {'global_merging_checks': global_merging_checks})
+            checks.append(partial(func_ck, type_check=type_check))
+    return tuple(checks)
+
+#checks to apply after any global merging rule
+GLOBAL_CHECKS = get_global_merging_checks()
 
 def run_global_checks(func):
-    """Decorator that retrieves and runs the functions 
+    """Decorator that runs the functions 
     to apply to any merging rule"""
     def checks_wrapper(merged_record):
         #I get the result of the wrapped function
         final_result =  func(merged_record)
-        if len(GLOBAL_MERGING_CHECKS) == 0:
-            return final_result
-        #for each warning and error I pass the final_result and all the parameters to the function
-        for type_check, func_ck_list in GLOBAL_MERGING_CHECKS.items():
-            for func_ck_str in func_ck_list:
-                func_ck = eval(func_ck_str)
-                func_ck(final_result, type_check)
+        #then I pass the final_result to all the checks
+        for check in GLOBAL_CHECKS:
+            check(final_result)
         return final_result
+    checks_wrapper.__name__ = func.__name__
     return checks_wrapper
 
 @run_global_checks       
@@ -58,8 +67,8 @@ def merge_creation_modification_dates(merged_record):
     """Function that grabs all the origins in the merged record 
     and creates a merged version of the creation and modification date 
     based only on the found origins"""
-    #I create a local copy to avoid problems
-    record = deepcopy(merged_record)
+    #I create a local copy of the record: only the creation and modification date field is replaced
+    record = dict(merged_record)
     #I extract all the creation and modification dates
     try:
         creat_mod = record[FIELD_TO_MARC['creation and modification date']]
@@ -72,7 +81,7 @@ def merge_creation_modification_dates(merged_record):
         if field_code != FIELD_TO_MARC['creation and modification date']:
             for field in record[field_code]:
                 try:
-                    origin = bibrecord.field_get_subfield_values(field, ORIGIN_SUBFIELD)[0]
+                    origin = get_subfield_values(field, ORIGIN_SUBFIELD)[0]
                     if origin !='':
                         origins.append(origin)
                 #if there is origin this is a problem, but I don't have to manage it here
@@ -85,7 +94,7 @@ def merge_creation_modification_dates(merged_record):
     new_creation_modification_date = {}
     for field in creat_mod:
         try:
-            origin = bibrecord.field_get_subfield_values(field, ORIGIN_SUBFIELD)[0]
+            origin = get_subfield_values(field, ORIGIN_SUBFIELD)[0]
         except IndexError:
             origin = ''
         
@@ -93,16 +102,16 @@ def merge_creation_modification_dates(merged_record):
             #I have to put or update the creation and modification date
             if len(new_creation_modification_date) == 0:
                 #if there is no creation or modification date I simply insert the field
-                new_creation_modification_date[CREATION_DATE_SUBFIELD] = bibrecord.field_get_subfield_values(field, CREATION_DATE_SUBFIELD)[0]
-                new_creation_modification_date[MODIFICATION_DATE_SUBFIELD] = bibrecord.field_get_subfield_values(field, MODIFICATION_DATE_SUBFIELD)[0]
+                new_creation_modification_date[CREATION_DATE_SUBFIELD] = get_subfield_values(field, CREATION_DATE_SUBFIELD)[0]
+                new_creation_modification_date[MODIFICATION_DATE_SUBFIELD] = get_subfield_values(field, MODIFICATION_DATE_SUBFIELD)[0]
                 new_creation_modification_date[ORIGIN_SUBFIELD] = origin
                 new_creation_modification_date['origin_importance'] = get_origin_importance(FIELD_TO_MARC['creation and modification date'], origin)
             else:
                 #otherwise I have to check which one is the oldest for creation and newest for modification
                 old_creation = new_creation_modification_date[CREATION_DATE_SUBFIELD]
                 old_modification = new_creation_modification_date[CREATION_DATE_SUBFIELD]
-                new_creation = bibrecord.field_get_subfield_values(field, CREATION_DATE_SUBFIELD)[0]
-                new_modification = bibrecord.field_get_subfield_values(field, MODIFICATION_DATE_SUBFIELD)[0]
+                new_creation = get_subfield_values(field, CREATION_DATE_SUBFIELD)[0]
+                new_modification = get_subfield_values(field, MODIFICATION_DATE_SUBFIELD)[0]
                 
                 new_creation_modification_date[CREATION_DATE_SUBFIELD] = old_creation if old_creation <= new_creation else new_creation
                 new_creation_modification_date[CREATION_DATE_SUBFIELD] = old_modification if old_modification >= new_modification else new_modification
@@ -121,14 +130,10 @@ def merge_creation_modification_dates(merged_record):
 
 def merge_remove_temp_subfields(merged_record):
     """Function that removes the temporary subfields from the final record"""
-    #I create a local copy to avoid problems
-    record = deepcopy(merged_record)
+    #I remove the temporary subfields copying only the fields that contain them
+    record = record_without_subfields(merged_record, TEMP_SUBFIELDS_LIST)
     #I extract all the field codes
     field_keys = record.keys()
-    #I remove the temporary subfields
-    for tmp_subfield in TEMP_SUBFIELDS_LIST:
-        for field_key in field_keys:
-            record_delete_subfield(record, field_key, tmp_subfield)
     #then I check if there are still some subfields having a two character code (not allowed by marc and used only for temporary subfields)
     for field_key in field_keys:
         for field in record[field_key]:
@@ -20,53 +20,88 @@ the combined element.
 '''
 import re
 import sys
-import logging
 
-from invenio import bibrecord
-
-from merger_settings import MERGING_RULES, \
+from merger_settings import MERGER_SILENT_MODE, MERGING_RULES, \
                 GLOBAL_MERGING_RULES, MARC_TO_FIELD, FIELD_TO_MARC, \
                 SYSTEM_NUMBER_SUBFIELD, ORIGIN_SUBFIELD
 import pipeline_settings
+from pipeline_log_functions import get_logger
 #from merger_errors import ErrorsInBibrecord, OriginValueNotFound
 
-from misclibs.xml_transformer import create_record_from_libxml_obj 
+from misclibs.xml_transformer import iter_records_from_libxml_obj
+from basic_functions import resolve_function, get_origin_importance_cache_info, get_subfield_values
 
 
-logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
+logger = get_logger(pipeline_settings.LOGGING_WORKER_NAME, MERGER_SILENT_MODE)
 
-# Not directly used but needed for evaluation the merging functions.
 import merging_rules
 import global_merging_rules
 
+MERGING_MODULES = {
+    'merging_rules': merging_rules,
+    'global_merging_rules': global_merging_rules,
+}
+
+def get_merging_dispatch():
+    """Function that resolves once the merging rules of the settings:
+    it returns a dictionary marc tag -> (merging function, checks to run on its result,
+    function merging all the versions at once or None)"""
+    dispatch = {}
+    for tag, field_name in MARC_TO_FIELD.items():
+        merging_func = resolve_function(MERGING_RULES[field_name], MERGING_MODULES)
+        multiple_merging_func = getattr(merging_func, 'multiple_merging_rule', None)
+        #the rules decorated with run_checks are called without the decorator
+        merging_func = getattr(merging_func, 'merging_rule', merging_func)
+        dispatch[tag] = (merging_func, merging_rules.MERGING_CHECKS.get(tag, ()), multiple_merging_func)
+    return dispatch
+
+#merging function and checks per tag
+MERGING_DISPATCH = get_merging_dispatch()
+#global merging functions to apply to the merged record
+GLOBAL_MERGING_FUNCTIONS = [(func, resolve_function(func, MERGING_MODULES)) for func in GLOBAL_MERGING_RULES]
+
 def merge_records_xml(marcxml_obj):
     """Function that takes in input a marcxml string and returns containing 
     multiple records identified by the tag "collection" and for each one calls the 
     function to merge the different flavors of the same record 
     (identified by the tag "record"). """
-    logger.info(' Merger started.')
-    #I get the bibrecord object from libxml2 one
-    all_records = create_record_from_libxml_obj(marcxml_obj, logger)
-    merged_records = []
     records_with_merging_probl = []
-    for records in all_records:
+    merged_records = list(iter_merge_records(marcxml_obj, records_with_merging_probl))
+    return merged_records, records_with_merging_probl
+
+def iter_merge_records(marcxml_obj, records_with_merging_probl, free_nodes=False):
+    """Generator that parses one record (tag "collection") of the marcxml object at a time,
+    merges its versions and yields the merged record, so only the versions of one record
+    are in memory. The records that can't be merged are appended as (bibcode, error) 
+    to records_with_merging_probl. If free_nodes is True the parsed records are freed 
+    from the marcxml object (see iter_records_from_libxml_obj)."""
+    #I get the bibrecord object from libxml2 one, one record at a time
+    return iter_merge_bibrecords(iter_records_from_libxml_obj(marcxml_obj, logger, free_nodes), records_with_merging_probl)
+
+def iter_merge_bibrecords(bibrecords, records_with_merging_probl):
+    """Generator like iter_merge_records, but for an iterable of records already
+    converted to bibrecord (each one as the list of its versions)."""
+    logger.info(' Merger started.')
+    for records in bibrecords:
         #I try to get the bibcode of the record I'm merging
         try:
             system_number_fields = records[0][FIELD_TO_MARC['system number']]
-            bibcode = bibrecord.field_get_subfield_values(system_number_fields[0], SYSTEM_NUMBER_SUBFIELD)[0]
+            bibcode = get_subfield_values(system_number_fields[0], SYSTEM_NUMBER_SUBFIELD)[0]
         except:
             bibcode = 'Unknown'
-        logger.warn(' Merging bibcode "%s".' % bibcode)
+        logger.warn(' Merging bibcode "%s".', bibcode)
         # Get the merged record
         try:
-            merged_records.append(merge_multiple_records(records))
+            merged_record = merge_multiple_records(records)
         except Exception, error:
             exc_type, exc_obj, exc_tb = sys.exc_info()
             str_error_to_print = exc_type.__name__ + '\t' + str(error) + ' (Merger error)'
-            logger.error(' Impossible to merge the record "%s" \t %s' % (bibcode, str_error_to_print))
+            logger.error(' Impossible to merge the record "%s" \t %s', bibcode, str_error_to_print)
             records_with_merging_probl.append((bibcode, str_error_to_print))
+            continue
+        yield merged_record
+    logger.info(' Origin importance cache: %(hits)d hits, %(misses)d misses, %(size)d entries.', get_origin_importance_cache_info())
     logger.info(' Merger ended... returning results!')
-    return merged_records, records_with_merging_probl
 
 
 def merge_multiple_records(records):
@@ -76,32 +111,67 @@ def merge_multiple_records(records):
 
     if not records:
         return {}
-    elif len(records) == 1:
-        return merge_two_records(records[0], {}, None)
-    
-    record1 = records.pop(0)
-    record2 = records.pop(0)
-    logger.info('  Merge #1')
-    
-    merged_record = merge_two_records(record1, record2)
-    merge_number = 2
-    while records:
-        new_record= records.pop(0)
-        logger.info('  Merge #%d' % merge_number)
-        merge_number += 1
-        merged_record = merge_two_records(merged_record, new_record)
+
+    logger.info('  Merge of %d versions', len(records))
+    merged_record = merge_records_by_tag(records)
     
     #global merging functions
     logger.info('  Global merging functions')
-    for func in GLOBAL_MERGING_RULES:
-        func_to_run = eval(func)
-        logger.info('    Merging with function %s' % func)
+    for func, func_to_run in GLOBAL_MERGING_FUNCTIONS:
+        logger.info('    Merging with function %s', func)
         merged_record = func_to_run(merged_record)
 
     record_reorder(merged_record)
 
     return merged_record
 
+def merge_records_by_tag(records):
+    """
+    Merges all the versions of a record in one pass: the fields are grouped
+    by tag once and each merging rule gets the fields of all the versions.
+    The result is the same of merging the versions two at a time, except for
+    the references: they are merged from the lists of the versions instead of
+    the ones already merged (see merging_rules.references_merger_multiple).
+    """
+    fields_per_tag = {}
+    for index, record in enumerate(records):
+        for tag, fields in record.iteritems():
+            if tag not in fields_per_tag:
+                fields_per_tag[tag] = [[] for _ in records]
+            fields_per_tag[tag][index] = fields
+
+    merged_record = {}
+    for tag in sorted(fields_per_tag):
+        fields_lists = fields_per_tag[tag]
+        #a single version is merged with an empty one
+        if len(fields_lists) == 1:
+            fields_lists.append([])
+        merged_fields = merge_multiple_fields(tag, fields_lists)
+        if merged_fields:
+            merged_record[tag] = merged_fields
+
+    return merged_record
+
+def merge_multiple_fields(tag, fields_lists):
+    """
+    Merges the sets of fields with the same tag of all the versions of a
+    record and returns a merged set of fields. If the merging rule can't merge
+    all the sets at once, they are merged two at a time.
+    """
+    logger.info('    Tag %s:', tag)
+    merging_func, checks, multiple_merging_func = MERGING_DISPATCH[tag]
+    if multiple_merging_func is not None:
+        logger.info('      Merging with function %s.', multiple_merging_func.__name__)
+        return multiple_merging_func(fields_lists, tag, checks)
+    logger.info('      Merging with function %s.', merging_func.__name__)
+    merged_fields = fields_lists[0]
+    for fields in fields_lists[1:]:
+        new_merged_fields = merging_func(merged_fields, fields, tag)
+        for check in checks:
+            check(merged_fields, fields, new_merged_fields)
+        merged_fields = new_merged_fields
+    return merged_fields
+
 def merge_two_records(record1, record2):
     """
     Merges two records and returns a merged record.
@@ -125,10 +195,13 @@ def merge_two_fields(tag, fields1, fields2):
     """
     ## If one of the two fields does not exist, the merging is trivial.
     #merged_fields = []
-    logger.info('    Tag %s:' % tag)
-    merging_func = eval(MERGING_RULES[MARC_TO_FIELD[tag]])
-    logger.info('      Merging with function %s.' % (MERGING_RULES[MARC_TO_FIELD[tag]], ))
-    return merging_func(fields1, fields2, tag)
+    logger.info('    Tag %s:', tag)
+    merging_func, checks = MERGING_DISPATCH[tag][:2]
+    logger.info('      Merging with function %s.', merging_func.__name__)
+    merged_fields = merging_func(fields1, fields2, tag)
+    for check in checks:
+        check(fields1, fields2, merged_fields)
+    return merged_fields
 
 def record_reorder(record):
     """
@@ -137,7 +210,9 @@ def record_reorder(record):
     """
     current_position = 1
     for tag in sorted(record.keys()):
-        for index, field in enumerate(record[tag]):
-            record[tag][index] = (field[0], field[1], field[2], field[3], current_position)
-            current_position += 1
+        #the list of fields is replaced, so the lists shared with other records are not modified
+        fields = record[tag]
+        record[tag] = [(field[0], field[1], field[2], field[3], position) 
+                       for position, field in enumerate(fields, current_position)]
+        current_position += len(fields)
 
@@ -51,6 +51,9 @@ PRIMARY_METADATA_SUBFIELD = '99'
 TEMP_SUBFIELDS_LIST = [PRIMARY_METADATA_SUBFIELD, CREATION_DATE_TMP_SUBFIELD, MODIFICATION_DATE_TMP_SUBFIELD]
 
 
+#if True the merger doesn't log anything per record and per field (only the warnings and the errors)
+MERGER_SILENT_MODE = False
+
 #########################
 
 #mapping between the marc field and the name of the field
@@ -214,6 +217,9 @@ FIELDS_PRIORITY_LIST = {
 #name of the default_priority_list
 DEFAULT_PRIORITY_LIST = 'standard_priority_list'
 
+#maximum number of (tag, origin string) whose importance is kept in memory
+ORIGIN_IMPORTANCE_CACHE_SIZE = 10000
+
 #priority lists
 __PRIORITIES = {
     10: ['ADS METADATA',],
@@ -20,13 +20,12 @@ All this functions are necessary to create warnings and errors based on the resu
 '''
 import logging
 
-from invenio import bibrecord
-
-from merger_settings import AUTHOR_NORM_NAME_SUBFIELD, KEYWORD_STRING_SUBFIELD, KEYWORD_ORIGIN_SUBFIELD
-from pipeline_log_functions import manage_check_error
+from merger_settings import MERGER_SILENT_MODE, AUTHOR_NORM_NAME_SUBFIELD, KEYWORD_STRING_SUBFIELD, KEYWORD_ORIGIN_SUBFIELD
+from basic_functions import get_subfield_values
+from pipeline_log_functions import manage_check_error, get_logger
 import pipeline_settings
 
-logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
+logger = get_logger(pipeline_settings.LOGGING_WORKER_NAME, MERGER_SILENT_MODE)
 
 def check_string_with_unicode_not_selected(fields1, fields2, final_result, type_check, subfield_list, tag):
     """ Function that checks if a string without unicode has been selected instead of one containing unicode.
@@ -234,7 +233,7 @@ def check_one_date_per_type(fields1, fields2, final_result, type_check, subfield
     #I extract all the dates grouped by date type
     date_types = {}
     for field in final_result:
-        date_types.setdefault(bibrecord.field_get_subfield_values(field, subfield_list[0][1])[0], []).append(bibrecord.field_get_subfield_values(field, subfield_list[0][0])[0])
+        date_types.setdefault(get_subfield_values(field, subfield_list[0][1])[0], []).append(get_subfield_values(field, subfield_list[0][0])[0])
     #then I check that these dates are unique per type
     for datet in date_types:
         if len(set(date_types[datet])) > 1:
@@ -250,7 +249,7 @@ def check_duplicate_normalized_author_names(fields1, fields2, final_result, type
 
     author_names = set()
     for field in final_result:
-        author = bibrecord.field_get_subfield_values(field, AUTHOR_NORM_NAME_SUBFIELD)[0]
+        author = get_subfield_values(field, AUTHOR_NORM_NAME_SUBFIELD)[0]
         if author in author_names:
             #I don't raise an error if I have duplicated normalized author names,
             #I simply return the trusted list
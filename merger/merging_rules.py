@@ -18,13 +18,15 @@
 File containing all the functions to merge
 '''
 
-from copy import deepcopy
-import logging
 
 import invenio.bibrecord as bibrecord
 
-from basic_functions import get_origin, get_origin_importance, compare_fields_exclude_subfiels
-from merger_settings import ORIGIN_SUBFIELD, AUTHOR_NORM_NAME_SUBFIELD,  \
+from functools import partial
+from itertools import izip
+
+from basic_functions import get_origin, get_origin_importance, resolve_function, \
+    get_subfield_values
+from merger_settings import MERGER_SILENT_MODE, ORIGIN_SUBFIELD, AUTHOR_NORM_NAME_SUBFIELD,  \
     MARC_TO_FIELD, MERGING_RULES_CHECKS_ERRORS, REFERENCES_MERGING_TAKE_ALL_ORIGINS, \
     REFERENCE_RESOLVED_KEY, REFERENCE_STRING, REFERENCE_EXTENSION,\
     PUBL_DATE_TYPE_VAL_SUBFIELD, PUBL_DATE_SUBFIELD, PUBL_DATE_TYPE_SUBFIELD,\
@@ -32,30 +34,43 @@ from merger_settings import ORIGIN_SUBFIELD, AUTHOR_NORM_NAME_SUBFIELD,  \
     TEMP_SUBFIELDS_LIST
 from merger_errors import GenericError, OriginValueNotFound, EqualOrigins, EqualFields
 import pipeline_settings
+from pipeline_log_functions import get_logger
 
-logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
+logger = get_logger(pipeline_settings.LOGGING_WORKER_NAME, MERGER_SILENT_MODE)
 
-#this import is not explicitly called, but is needed for the import through the settings
 import merging_checks
 
+def get_merging_checks():
+    """Function that resolves once the checks of MERGING_RULES_CHECKS_ERRORS:
+    it returns a dictionary marc tag -> tuple of checks to call with (fields1, fields2, final_result)"""
+    checks_per_tag = {}
+    for tag, field_name in MARC_TO_FIELD.items():
+        if field_name not in MERGING_RULES_CHECKS_ERRORS:
+            continue
+        checks = []
+        for type_check, functions_check in MERGING_RULES_CHECKS_ERRORS[field_name].items():
+            for func_ck_str, subfield_list in functions_check.items():
+                func_ck = resolve_function(func_ck_str, {'merging_checks': merging_checks})
+                checks.append(partial(func_ck, type_check=type_check, subfield_list=subfield_list, tag=tag))
+        checks_per_tag[tag] = tuple(checks)
+    return checks_per_tag
+
+#checks to apply after any merging rule
+MERGING_CHECKS = get_merging_checks()
+
 def run_checks(func):
-    """Decorator that retrieves and runs the functions 
+    """Decorator that runs the functions 
     to apply to any merging rule"""
     def checks_wrapper(fields1, fields2, tag):
-        #I retrieve the groups of functions to run for this field
-        try:
-            list_checks = MERGING_RULES_CHECKS_ERRORS[MARC_TO_FIELD[tag]]
-        except KeyError:
-            #If there are no checks I return directly the result of the wrapped function
-            return func(fields1, fields2, tag)
-        #then I get the result of the wrapped function
+        #I get the result of the wrapped function
         final_result =  func(fields1, fields2, tag)
-        #for each warning and error I pass the final_result and all the parameters to the function
-        for type_check, functions_check in list_checks.items():
-            for func_ck_str, subfield_list in functions_check.items():
-                func_ck = eval(func_ck_str)
-                func_ck(fields1, fields2, final_result, type_check, subfield_list, tag)
+        #then I pass the final_result and all the parameters to the checks of this field
+        for check in MERGING_CHECKS.get(tag, ()):
+            check(fields1, fields2, final_result)
         return final_result
+    #the merger calls the rule and the checks separately
+    checks_wrapper.merging_rule = func
+    checks_wrapper.__name__ = func.__name__
     return checks_wrapper
 
 @run_checks
@@ -63,7 +78,7 @@ def priority_based_merger(fields1, fields2, tag):
     """basic function that merges based on priority"""
     #if one of the two lists is empty, I don't have to do anything
     if len(fields1) == 0 or len(fields2) == 0:
-        logger.info('        Only one field for "%s".' % tag)
+        logger.info('        Only one field for "%s".', tag)
         return fields1+fields2
     try:
         trusted, untrusted = get_trusted_and_untrusted_fields(fields1, fields2, tag)
@@ -72,44 +87,122 @@ def priority_based_merger(fields1, fields2, tag):
         trusted, untrusted = _get_best_fields(fields1, fields2, tag)
     return trusted
 
+def priority_based_merger_multiple(fields_lists, tag, checks=()):
+    """version of the priority_based_merger that selects at once the most trusted of the lists of fields
+    of all the versions of a record (the same list selected by the merge of the versions two at a time).
+    The checks run once, with all the fields of the versions as candidates"""
+    trusted = _select_trusted_fields(fields_lists, tag)
+    _run_checks_once(checks, [field for fields in fields_lists for field in fields], trusted)
+    return trusted
+
+#the merger uses these versions when there are more than two versions of a record
+priority_based_merger.multiple_merging_rule = priority_based_merger_multiple
+
+def _run_checks_once(checks, fields, merged_fields):
+    """runs the checks of a rule that merged all the versions of a record at once:
+    the merged fields are compared with the fields given (passed as the first list of fields)"""
+    for check in checks:
+        check(fields, [], merged_fields)
+
 def take_all_no_checks(fields1, fields2, tag):
     """function that takes all the different fields
     and returns an unique list"""
-    all_fields = []
-    for field1 in fields1 + fields2:
-        for field2 in all_fields:
-            #I check if the fields are the same without considering the origin
-            if compare_fields_exclude_subfiels(field1, field2, strict=False, exclude_subfields=[ORIGIN_SUBFIELD]+TEMP_SUBFIELDS_LIST):
-                #then I check if with the origin the subfield are the same
-                #if so I already have the value in the list
-                if bibrecord._compare_fields(field1, field2, strict=False):
-                    break
-                #otherwise I have to compare the two fields and take the one with the most trusted origin
-                else:
-                    try:
-                        trusted, untrusted = get_trusted_and_untrusted_fields([field1], [field2], tag)
-                    except EqualOrigins:
-                        try:
-                            trusted, untrusted = _get_best_fields([field1], [field2], tag)
-                        except EqualFields:
-                            break
-                    #if the trusted one is already in the list I don't do anything
-                    if trusted[0] == field2:
-                        break
-                    #otherwise I remove the value in the list and I insert the trusted one
-                    else:
-                        del(all_fields[all_fields.index(field2)])
-                        all_fields.append(field1)
-                        break
-        else:
-            all_fields.append(field1)
-    return all_fields
+    all_fields = UniqueFields(tag)
+    all_fields.add_fields(fields1 + fields2)
+    return all_fields.get_fields()
+
+#subfields not considered when looking for the same field with another origin
+TAKE_ALL_EXCLUDED_SUBFIELDS = frozenset([ORIGIN_SUBFIELD] + TEMP_SUBFIELDS_LIST)
+TEMP_SUBFIELDS_SET = frozenset(TEMP_SUBFIELDS_LIST)
+ORIGIN_SUBFIELDS = frozenset([ORIGIN_SUBFIELD])
+#subfields still compared when only the creation and modification dates are excluded
+TEMP_SUBFIELDS_KEPT_WITHOUT_DATES = frozenset([ORIGIN_SUBFIELD] + TEMP_SUBFIELDS_LIST) - frozenset([CREATION_DATE_TMP_SUBFIELD, MODIFICATION_DATE_TMP_SUBFIELD])
+
+class UniqueFields(object):
+    """List of different fields (the result of a take_all).
+    Two fields are the same if they have the same indicators, controlfield value 
+    and set of subfields without considering the origin and the temporary subfields:
+    the position of each field is indexed by this signature, so adding a field
+    doesn't need to compare it with all the others."""
+
+    __slots__ = ('tag', 'fields', 'positions', 'removed')
+
+    def __init__(self, tag):
+        self.tag = tag
+        #list of fields in output order (None for the fields replaced by a more trusted one)
+        self.fields = []
+        #signature -> position in the list of fields
+        self.positions = {}
+        self.removed = 0
+
+    @staticmethod
+    def signature(field):
+        """returns the key used to find the same field with another origin"""
+        #the sorted tuple of the different subfields takes less memory than a frozenset
+        return (field[1], field[2], field[3], 
+                tuple(sorted(set([subfield for subfield in field[0] if subfield[0] not in TAKE_ALL_EXCLUDED_SUBFIELDS]))))
+
+    def add_fields(self, new_fields):
+        """adds the new fields not already in the list"""
+        for field1 in new_fields:
+            signature = self.signature(field1)
+            position = self.positions.get(signature)
+            if position is None:
+                self.positions[signature] = len(self.fields)
+                self.fields.append(field1)
+                continue
+            field2 = self.fields[position]
+            #if with the origin the subfields are the same I already have the value in the list
+            if set(field1[0]) == set(field2[0]):
+                continue
+            #otherwise I have to compare the two fields and take the one with the most trusted origin
+            try:
+                trusted, untrusted = get_trusted_and_untrusted_fields([field1], [field2], self.tag)
+            except EqualOrigins:
+                try:
+                    trusted, untrusted = _get_best_fields([field1], [field2], self.tag)
+                except EqualFields:
+                    continue
+            #if the trusted one is already in the list I don't do anything
+            #otherwise I remove the value in the list and I append the trusted one
+            if trusted[0] != field2:
+                self.fields[position] = None
+                self.removed += 1
+                self.positions[signature] = len(self.fields)
+                self.fields.append(field1)
+
+    def get_fields(self):
+        """returns the list of fields"""
+        if self.removed:
+            self.fields = [field for field in self.fields if field is not None]
+            self.positions = dict((self.signature(field), position) for position, field in enumerate(self.fields))
+            self.removed = 0
+        return list(self.fields)
 
 @run_checks
 def take_all(fields1, fields2, tag):
     """version of the take_all with decorator for checks"""
     return take_all_no_checks(fields1, fields2, tag)
 
+def take_all_multiple(fields_lists, tag, checks=()):
+    """version of the take_all that merges the fields of all the versions of a record in one pass.
+    The result and the arguments passed to the checks are the same of a take_all
+    applied to the versions two at a time"""
+    all_fields = UniqueFields(tag)
+    all_fields.add_fields(fields_lists[0])
+    merged_fields = fields_lists[0]
+    for fields in fields_lists[1:]:
+        all_fields.add_fields(fields)
+        if checks:
+            new_merged_fields = all_fields.get_fields()
+            for check in checks:
+                check(merged_fields, fields, new_merged_fields)
+            merged_fields = new_merged_fields
+    return all_fields.get_fields()
+
+#the merger uses this version when there are more than two versions of a record
+take_all.multiple_merging_rule = take_all_multiple
+
 @run_checks
 def pub_date_merger(fields1, fields2, tag):
     """function to merge dates. the peculiarity of this merge is that 
@@ -118,7 +211,7 @@ def pub_date_merger(fields1, fields2, tag):
     if len(all_dates) > 0:
         #removing the main-date if present
         for date in all_dates:
-            if bibrecord.field_get_subfield_values(date, PUBL_DATE_TYPE_SUBFIELD)[0] == 'main-date':
+            if get_subfield_values(date, PUBL_DATE_TYPE_SUBFIELD)[0] == 'main-date':
                 logger.info('        Main date already available: trying to re-create it')
                 del(all_dates[all_dates.index(date)])
                 break
@@ -131,8 +224,8 @@ def pub_date_merger(fields1, fields2, tag):
             if done:
                 break
             for date in all_dates:
-                if bibrecord.field_get_subfield_values(date, PUBL_DATE_TYPE_SUBFIELD)[0] == date_type and bibrecord.field_get_subfield_values(date, PRIMARY_METADATA_SUBFIELD)[0] == 'True':
-                    main_pub_date = bibrecord.field_get_subfield_values(date, PUBL_DATE_SUBFIELD)[0]
+                if get_subfield_values(date, PUBL_DATE_TYPE_SUBFIELD)[0] == date_type and get_subfield_values(date, PRIMARY_METADATA_SUBFIELD)[0] == 'True':
+                    main_pub_date = get_subfield_values(date, PUBL_DATE_SUBFIELD)[0]
                     main_pub_date_primary = 'True'
                     done = True
                     break
@@ -143,8 +236,8 @@ def pub_date_merger(fields1, fields2, tag):
                 if done:
                     break
                 for date in all_dates:
-                    if bibrecord.field_get_subfield_values(date, PUBL_DATE_TYPE_SUBFIELD)[0] == date_type:
-                        main_pub_date = bibrecord.field_get_subfield_values(date, PUBL_DATE_SUBFIELD)[0]
+                    if get_subfield_values(date, PUBL_DATE_TYPE_SUBFIELD)[0] == date_type:
+                        main_pub_date = get_subfield_values(date, PUBL_DATE_SUBFIELD)[0]
                         done = True
                         break
         #if I still don't have a main date it means that I have a date that is not in the list of expected dates
@@ -152,7 +245,7 @@ def pub_date_merger(fields1, fields2, tag):
         #P.S. I should never get a this point
         if main_pub_date == None:
             logger.info('        All the dates available are not recognized as good for a main date: picking the first available')
-            main_pub_date = bibrecord.field_get_subfield_values(all_dates[0], PUBL_DATE_SUBFIELD)[0]
+            main_pub_date = get_subfield_values(all_dates[0], PUBL_DATE_SUBFIELD)[0]
 
         #finally I append the main date to the list of dates
         all_dates.append(([(PUBL_DATE_SUBFIELD, main_pub_date), (PUBL_DATE_TYPE_SUBFIELD, 'main-date'), (ORIGIN_SUBFIELD, 'ADS metadata'), 
@@ -167,11 +260,8 @@ def author_merger(fields1, fields2, tag):
     all the other authors"""
     #if one of the two lists is empty, I don't have to do anything
     if len(fields1) == 0 or len(fields2) == 0:
-        logger.info('        Only one field for "%s".' % tag)
+        logger.info('        Only one field for "%s".', tag)
         return fields1+fields2
-    #I need to copy locally the lists of records because I'm going to modify them
-    fields1 = deepcopy(fields1)
-    fields2 = deepcopy(fields2)
     try:
         trusted, untrusted = get_trusted_and_untrusted_fields(fields1, fields2, tag)
     except EqualOrigins:
@@ -184,54 +274,156 @@ def author_merger(fields1, fields2, tag):
     # Sanity check: we have a problem if we have identical normalized author
     # names in the trusted list or if we have identical author names in the
     # untrusted list that is present in the trusted list of authors.
-    trusted_authors = set()
-    for field in trusted:
-        author = bibrecord.field_get_subfield_values(field, AUTHOR_NORM_NAME_SUBFIELD)[0]
-        if author in trusted_authors:
-            #I don't raise an error if I have duplicated normalized author names,
-            #I simply return the trusted list
-            logger.info('      Duplicated normalized author name. Skipping author subfield merging.')
-            return trusted
-            #raise DuplicateNormalizedAuthorError(author)
-        else:
-            trusted_authors.add(author)
-
-    #I extract all the authors in the untrusted list in case I need to merge some subfields
-    untrusted_authors = {}
-    for field in untrusted:
-        author = bibrecord.field_get_subfield_values(field, AUTHOR_NORM_NAME_SUBFIELD)[0]
-        if author in trusted_authors:
-            untrusted_authors[author] = field
+    #the normalized names are extracted once and used as keys for all the alignment
+    trusted_keys = [get_subfield_values(field, AUTHOR_NORM_NAME_SUBFIELD)[0] for field in trusted]
+    trusted_authors = set(trusted_keys)
+    if len(trusted_authors) != len(trusted_keys):
+        #I don't raise an error if I have duplicated normalized author names,
+        #I simply return the trusted list
+        logger.info('      Duplicated normalized author name. Skipping author subfield merging.')
+        return trusted
+        #raise DuplicateNormalizedAuthorError(author)
+    untrusted_keys = [get_subfield_values(field, AUTHOR_NORM_NAME_SUBFIELD)[0] for field in untrusted]
 
     # Now add information from the least trusted list of authors to the most
     # trusted list of authors.
-    for index, field in enumerate(trusted):
-        author = bibrecord.field_get_subfield_values(field, AUTHOR_NORM_NAME_SUBFIELD)[0]
-        if author in untrusted_authors:
-            trusted_subfield_codes = bibrecord.field_get_subfield_codes(field)
-            untrusted_field = untrusted_authors[author]
-            untrusted_subfield_codes = bibrecord.field_get_subfield_codes(untrusted_field)
-
-            trusted_subfields = bibrecord.field_get_subfield_instances(field)
-            additional_subfield_codes = set(untrusted_subfield_codes) - set(trusted_subfield_codes)
-            for code in additional_subfield_codes:
-                logger.info('      Subfield "%s" to add to author "%s".' % (code, author))
-                additional_subfields = bibrecord.field_get_subfield_values(untrusted_field, code)
-                for additional_subfield in additional_subfields:
-                    trusted_subfields.append((code, additional_subfield))
-            else:
-                # Replace the subfields with the new subfields.
-                field = (trusted_subfields, field[1], field[2], field[3], field[4])
+    # The fields of the input lists are not modified: only the enriched authors are copied.
+    trusted = list(trusted)
+    for index, untrusted_field in enumerate(_align_authors(trusted_keys, trusted_authors, untrusted, untrusted_keys)):
+        if untrusted_field is None:
+            continue
+        field = trusted[index]
+        #I take in one pass all the subfields of the untrusted author with a code missing in the trusted one
+        trusted_subfield_codes = set([subfield[0] for subfield in field[0]])
+        additional_subfields = [subfield for subfield in untrusted_field[0] if subfield[0] not in trusted_subfield_codes]
+        if additional_subfields:
+            logger.info('      Subfields "%s" to add to author "%s".', ', '.join(sorted(set([subfield[0] for subfield in additional_subfields]))), trusted_keys[index])
+            # Replace the subfields with the new subfields.
+            trusted[index] = (list(field[0]) + additional_subfields, field[1], field[2], field[3], field[4])
 
     return trusted
 
+def author_merger_multiple(fields_lists, tag, checks=()):
+    """version of the author_merger that merges the author lists of all the versions of a record at once,
+    with the same result of the merge of the versions two at a time: the origin and the normalized names
+    of each list are extracted only once and the enriched authors are built only at the end.
+    The checks run once, with the longest list of authors as the one to compare with"""
+    fields_lists = [fields for fields in fields_lists if fields]
+    #with two lists there is nothing to save: they are merged as usual
+    if len(fields_lists) == 2:
+        merged_fields = author_merger.merging_rule(fields_lists[0], fields_lists[1], tag)
+        for check in checks:
+            check(fields_lists[0], fields_lists[1], merged_fields)
+        return merged_fields
+    merged = None
+    for fields in fields_lists:
+        authors = AuthorList(fields, tag)
+        if merged is None:
+            merged = authors
+        else:
+            merged = merged.merge(authors)
+    merged_fields = merged.get_fields() if merged is not None else []
+    _run_checks_once(checks, max(fields_lists or [[]], key=len), merged_fields)
+    return merged_fields
+
+#the merger uses this version when there are more than two versions of a record
+author_merger.multiple_merging_rule = author_merger_multiple
+
+class AuthorList(object):
+    """List of authors of a version (or of the merge of some versions) for author_merger_multiple:
+    the subfields taken from the less trusted lists are kept apart and the fields are rebuilt only when needed"""
+
+    __slots__ = ('fields', 'tag', 'origin', 'keys', 'authors', 'additional_subfields', 'subfield_codes', 'merged_fields')
+
+    def __init__(self, fields, tag):
+        self.fields = fields
+        self.tag = tag
+        self.origin = self.keys = self.authors = None
+        #position of an author -> subfields added to it and set of its subfield codes
+        self.additional_subfields = {}
+        self.subfield_codes = {}
+        #fields with the additional subfields (None if they have to be rebuilt)
+        self.merged_fields = fields
+
+    def get_origin(self):
+        """returns the origin of the list and its importance"""
+        if self.origin is None:
+            self.origin = _get_origin_and_importance(self.get_fields(), self.tag)
+        return self.origin
+
+    def get_keys(self):
+        """returns the normalized names of the authors and their set"""
+        if self.keys is None:
+            self.keys = [get_subfield_values(field, AUTHOR_NORM_NAME_SUBFIELD)[0] for field in self.fields]
+            self.authors = set(self.keys)
+        return self.keys, self.authors
+
+    def get_fields(self):
+        """returns the fields with the additional subfields"""
+        if self.merged_fields is None:
+            additional_subfields = self.additional_subfields
+            self.merged_fields = [(list(field[0]) + additional_subfields[index], field[1], field[2], field[3], field[4])
+                                  if index in additional_subfields else field
+                                  for index, field in enumerate(self.fields)]
+        return self.merged_fields
+
+    def merge(self, other):
+        """merges a less or more trusted list of authors and returns the list that author_merger
+        would return for the fields of the two lists"""
+        origin1, origin_val1 = self.get_origin()
+        origin2, origin_val2 = other.get_origin()
+        if origin_val1 > origin_val2:
+            logger.info('      Selected fields from record 1 (%s over %s).', origin1, origin2)
+            trusted, untrusted = self, other
+        elif origin_val1 < origin_val2:
+            logger.info('      Selected fields from record 2 (%s over %s).', origin2, origin1)
+            trusted, untrusted = other, self
+        else:
+            #the two sets of fields are too similar to enrich the trusted one
+            trusted_fields = _get_best_fields(self.get_fields(), other.fields, self.tag)[0]
+            return self if trusted_fields is self.get_fields() else other
+        trusted_keys, trusted_authors = trusted.get_keys()
+        if len(trusted_authors) != len(trusted_keys):
+            logger.info('      Duplicated normalized author name. Skipping author subfield merging.')
+            return trusted
+        untrusted_keys = untrusted.get_keys()[0]
+        for index, untrusted_field in enumerate(_align_authors(trusted_keys, trusted_authors, untrusted.get_fields(), untrusted_keys)):
+            if untrusted_field is not None:
+                trusted.add_subfields(index, untrusted_field[0])
+        return trusted
+
+    def add_subfields(self, index, subfields):
+        """adds to an author the subfields with a code it doesn't have"""
+        codes = self.subfield_codes.get(index)
+        if codes is None:
+            codes = self.subfield_codes[index] = set([subfield[0] for subfield in self.fields[index][0]])
+        additional_subfields = [subfield for subfield in subfields if subfield[0] not in codes]
+        if additional_subfields:
+            logger.info('      Subfields "%s" to add to author "%s".', ', '.join(sorted(set([subfield[0] for subfield in additional_subfields]))), self.keys[index])
+            self.additional_subfields.setdefault(index, []).extend(additional_subfields)
+            codes.update([subfield[0] for subfield in additional_subfields])
+            self.merged_fields = None
+            #an author without origin takes the one of the other list
+            if ORIGIN_SUBFIELD in [subfield[0] for subfield in additional_subfields]:
+                self.origin = None
+
+def _align_authors(trusted_keys, trusted_authors, untrusted, untrusted_keys):
+    """function that returns for each trusted author the untrusted author with the same normalized name (or None).
+    If the untrusted list has the same authors in the same order (the usual case) they are aligned by position,
+    otherwise by name (with duplicated names the last untrusted author is taken)"""
+    length = len(trusted_keys)
+    if untrusted_keys[:length] == trusted_keys and trusted_authors.isdisjoint(untrusted_keys[length:]):
+        return untrusted[:length]
+    untrusted_authors = dict(izip(untrusted_keys, untrusted))
+    return [untrusted_authors.get(author) for author in trusted_keys]
+
 @run_checks
 def title_merger(fields1, fields2, tag):
     """function that chooses the titles and returns the main title or
     the list of alternate titles"""
     #if one of the two lists is empty, I don't have to do anything
     if len(fields1) == 0 or len(fields2) == 0:
-        logger.info('        Only one field for "%s".' % tag)
+        logger.info('        Only one field for "%s".', tag)
         return fields1+fields2
     try:
         trusted, untrusted = get_trusted_and_untrusted_fields(fields1, fields2, tag)
@@ -240,12 +432,14 @@ def title_merger(fields1, fields2, tag):
         trusted, untrusted = _get_best_fields(fields1, fields2, tag)
     return trusted
 
+title_merger.multiple_merging_rule = priority_based_merger_multiple
+
 @run_checks
 def abstract_merger(fields1, fields2, tag):
     """function that chooses the abstracts based on the languages and priority"""
     #if one of the two lists is empty, I don't have to do anything
     if len(fields1) == 0 or len(fields2) == 0:
-        logger.info('        Only one field for "%s".' % tag)
+        logger.info('        Only one field for "%s".', tag)
         return fields1+fields2
     try:
         trusted, untrusted = get_trusted_and_untrusted_fields(fields1, fields2, tag)
@@ -254,119 +448,162 @@ def abstract_merger(fields1, fields2, tag):
         trusted, untrusted = _get_best_fields(fields1, fields2, tag)
     return trusted
 
+abstract_merger.multiple_merging_rule = priority_based_merger_multiple
+
+class Reference(object):
+    """Reference field parsed once for the merge of the references:
+    the subfields used by the merge are extracted in a single pass 
+    and the field is rebuilt only if another reference is merged into it"""
+
+    __slots__ = ('field', 'key', 'string', 'extension', 'origin', 'importance', 'subfields')
+
+    def __init__(self, field):
+        self.field = field
+        self.key = self.string = self.extension = self.origin = None
+        #the importance of the origin is computed only if needed
+        self.importance = None
+        #dictionary of the subfields during a merge (the merged field is kept in self.field)
+        self.subfields = None
+        for code, value in field[0]:
+            if code == REFERENCE_RESOLVED_KEY:
+                if self.key is None:
+                    self.key = value
+            elif code == REFERENCE_STRING:
+                if self.string is None:
+                    self.string = value
+            elif code == REFERENCE_EXTENSION:
+                if self.extension is None:
+                    self.extension = value
+            elif code == ORIGIN_SUBFIELD:
+                if self.origin is None:
+                    self.origin = value
+
+    def get_importance(self, tag):
+        """returns the importance of the origin of the reference"""
+        if self.importance is None:
+            self.importance = get_origin_importance(tag, self.origin)
+        return self.importance
+
+    def set_origin(self, origin, importance):
+        """replaces the origin of the reference"""
+        #first I print the message because I need the old origin
+        logger.info('      Reference origin "%s" replaced by the more trusted "%s".', self.origin, origin)
+        self.origin = self.subfields[ORIGIN_SUBFIELD] = origin
+        self.importance = importance
+
+    def set_string(self, other):
+        """takes the reference string (and the related extension) of another reference"""
+        self.string = self.subfields[REFERENCE_STRING] = other.string
+        #if there was an extension for this string I copy also that one
+        if other.extension is not None:
+            self.extension = self.subfields[REFERENCE_EXTENSION] = other.extension
+            logger.info('      Reference extension replaced by the one with value "%s" for reference %s".', other.extension, self.key)
+
+    def merge(self, other, tag):
+        """merges another reference with the same resolved key into this one:
+        the reference string (and the related extension handler) is taken from the most trusted origin or 
+        from the other if the most trusted origin has an empty reference string or one with only the bibcode"""
+        self.subfields = dict(self.field[0])
+        #the reference string is the one kept in the dictionary
+        self.string = self.subfields.get(REFERENCE_STRING)
+        importance_in = self.get_importance(tag)
+        importance_out = other.get_importance(tag)
+        for code, value in other.field[0]:
+            #if I don't have a subfield at all I insert it unless it is a Extension field
+            if code not in self.subfields:
+                if code != REFERENCE_EXTENSION:
+                    logger.info('      Subfield "%s" added to reference "%s".', code, self.key)
+                    self.subfields[code] = value
+                    if code == REFERENCE_STRING:
+                        self.string = value
+            #otherwise if it is a reference string
+            elif code == REFERENCE_STRING:
+                #if the one already in the list is the bibcode and the other one not I take the other one and I set the origin to the most trusted one
+                if (self.string == self.key or len(self.string) == 0) and len(value) != 0:
+                    self.set_string(other)
+                    logger.info('      Reference string (bibcode only or empty) replaced by the one with origin "%s" for reference %s".', other.origin, self.key)
+                    if importance_out > importance_in:
+                        self.set_origin(other.origin, importance_out)
+                        importance_in = importance_out
+                #otherwise if the string already in is not a bibcode or empty I have to check the importance
+                elif importance_out > importance_in:
+                    self.set_string(other)
+                    logger.info('      Reference string replaced by the one with origin "%s" for reference %s".', other.origin, self.key)
+                    self.set_origin(other.origin, importance_out)
+                    importance_in = importance_out
+        #only the merged field is kept, not the dictionary
+        self.field = (self.subfields.items(), ) + self.field[1:]
+        self.subfields = None
+
+    def get_field(self):
+        """returns the bibrecord field of the reference"""
+        return self.field
+
 @run_checks
 def references_merger(fields1, fields2, tag):
     """Merging function for references"""
-    #if one of the two lists is empty, I don't have to do anything
-    if len(fields1) == 0 or len(fields2) == 0:
-        logger.info('        Only one field for "%s".' % tag)
-        return fields1+fields2
+    return _merge_references([fields1, fields2], tag)
+
+def references_merger_multiple(fields_lists, tag, checks=()):
+    """version of the references_merger that merges the references of all the versions of a record at once:
+    the references to take from all the origins and the ones of the most trusted of the other origins
+    are uniqued together and every reference is parsed once, instead of merging again the references
+    already merged for each version. The result can differ from the merge of the versions two at a time
+    (besides the order): there the merged references can take the origin of a reference of the other group
+    and the lists with the same importance are compared after the removal of their duplicates.
+    The checks run once, with all the references of the versions as candidates"""
+    merged_fields = _merge_references(fields_lists, tag)
+    _run_checks_once(checks, [field for fields in fields_lists for field in fields], merged_fields)
+    return merged_fields
+
+#the merger uses this version when there are more than two versions of a record
+references_merger.multiple_merging_rule = references_merger_multiple
+
+def _merge_references(fields_lists, tag):
+    """merges the lists of references of some versions of a record"""
+    #if only one of the lists is not empty, I don't have to do anything
+    if len([fields for fields in fields_lists if fields]) < 2:
+        logger.info('        Only one field for "%s".', tag)
+        return [field for fields in fields_lists for field in fields]
     #first I split the references in two groups: the ones that should be merged and the one that have to taken over the others
-    ref_by_merging_type_fields1 = {'take_all':[], 'priority':[]}
-    ref_by_merging_type_fields2 = {'take_all':[], 'priority':[]}
-        
-    #I split the fields1
-    for field in fields1:
-        if bibrecord.field_get_subfield_values(field, ORIGIN_SUBFIELD)[0] in REFERENCES_MERGING_TAKE_ALL_ORIGINS:
-            ref_by_merging_type_fields1['take_all'].append(field)
-        else:
-            ref_by_merging_type_fields1['priority'].append(field)
-    #and the fields2 (this in theory should be always of the same origin type)
-    for field in fields2:
-        if bibrecord.field_get_subfield_values(field, ORIGIN_SUBFIELD)[0] in REFERENCES_MERGING_TAKE_ALL_ORIGINS:
-            ref_by_merging_type_fields2['take_all'].append(field)
-        else:
-            ref_by_merging_type_fields2['priority'].append(field)
-    
-    global_list = take_all(take_all(ref_by_merging_type_fields1['take_all'], ref_by_merging_type_fields2['take_all'], tag), 
-                           priority_based_merger(ref_by_merging_type_fields1['priority'], ref_by_merging_type_fields2['priority'], tag),
-                           tag)
-    
-    #finally I unique the resolved references
-    #taking the reference string (and the related extension handler) from the most trusted origin or 
-    #from the other if the most trusted origin has an empty reference string
-    #or one with only the bibcode
+    take_all_fields = []
+    priority_fields_lists = []
+    for fields in fields_lists:
+        priority_fields = []
+        for field in fields:
+            if get_subfield_values(field, ORIGIN_SUBFIELD)[0] in REFERENCES_MERGING_TAKE_ALL_ORIGINS:
+                take_all_fields.append(field)
+            else:
+                priority_fields.append(field)
+        priority_fields_lists.append(priority_fields)
+
+    #all the fields to take and the ones of the most trusted origin are uniqued together
+    global_list = UniqueFields(tag)
+    global_list.add_fields(take_all_fields)
+    global_list.add_fields(_select_trusted_fields(priority_fields_lists, tag))
+    #the index of the unique fields is released before parsing the references
+    fields = global_list.get_fields()
+    del global_list
+
+    #finally I unique the resolved references parsing every field only once
     unique_references_dict = {}
+    unique_references = []
     unresolved_references = []
-    for field in global_list:
-        fieldcp = deepcopy(field)
-        try:
-            bibcode_res = bibrecord.field_get_subfield_values(fieldcp, REFERENCE_RESOLVED_KEY)[0]
-        except IndexError:
-            bibcode_res = None
-        if bibcode_res:
+    for field in fields:
+        reference = Reference(field)
+        if reference.key:
             #first record found
-            if bibcode_res not in unique_references_dict:
-                unique_references_dict[bibcode_res] = fieldcp
+            if reference.key not in unique_references_dict:
+                unique_references_dict[reference.key] = reference
+                unique_references.append(reference)
             #merging of subfields
             else:
-                #I put in local variable the two list of subfields
-                inlist = unique_references_dict[bibcode_res][0]
-                outlist = fieldcp[0]
-                #I create a new dictionary where to merge the results with the subfields of the first list
-                new_subfields = {}
-                for subfield in inlist:
-                    new_subfields[subfield[0]] = subfield[1]
-                origin_imp_inlist = get_origin_importance(tag, new_subfields[ORIGIN_SUBFIELD])
-                #then I compare these entries with the values from the second list
-                #first I retrieve the origin of the second list and its importance
-                for subfield in outlist:
-                    if subfield[0] == ORIGIN_SUBFIELD:
-                        origin_outlist = subfield[1]
-                        origin_imp_outlist = get_origin_importance(tag, subfield[1])
-                        break
-                #and I retrieve the reference extension if it exists
-                extension_outlist = None
-                for subfield in outlist:
-                    if subfield[0] == REFERENCE_EXTENSION:
-                        extension_outlist = subfield[1]
-                        break
-                #then I merge
-                for subfield in outlist:
-                    #if I don't have a subfield at all I insert it unless it is a Extension field
-                    if subfield[0] not in new_subfields and subfield[0] != REFERENCE_EXTENSION:
-                        logger.info('      Subfield "%s" added to reference "%s".' % (subfield[0], bibcode_res))
-                        new_subfields[subfield[0]] = subfield[1]
-                    #otherwise if it is a reference string
-                    elif subfield[0] in new_subfields and subfield[0] == REFERENCE_STRING:
-                        #I extract both reference strings
-                        refstring_out = subfield[1]
-                        refstring_in = new_subfields[REFERENCE_STRING]
-                        #if the one already in the list is the bibcode and the other one not I take the other one and I set the origin to the most trusted one
-                        if (refstring_in == bibcode_res or len(refstring_in) == 0) and len(refstring_out) != 0:
-                            new_subfields[REFERENCE_STRING] = refstring_out
-                            logger.info('      Reference string (bibcode only or empty) replaced by the one with origin "%s" for reference %s".' % (origin_outlist, bibcode_res))
-                            #if there was an extension for this string I copy also that one
-                            if extension_outlist != None:
-                                new_subfields[REFERENCE_EXTENSION] = extension_outlist
-                                logger.info('      Reference extension replaced by the one with value "%s" for reference %s".' % (extension_outlist, bibcode_res))
-                            #I update the origin if the new one is better
-                            if origin_imp_outlist > origin_imp_inlist:
-                                #first I print the message because I need the old origin
-                                logger.info('      Reference origin "%s" replaced by the more trusted "%s".' % (new_subfields[ORIGIN_SUBFIELD], origin_outlist))
-                                #then I replace it
-                                new_subfields[ORIGIN_SUBFIELD] = origin_outlist
-                                
-                        #otherwise if the string already in is not a bibcode or empty I have to check the importance
-                        else:
-                            if origin_imp_outlist > origin_imp_inlist:
-                                new_subfields[REFERENCE_STRING] = refstring_out
-                                logger.info('      Reference string replaced by the one with origin "%s" for reference %s".' % (origin_outlist, bibcode_res))
-                                if extension_outlist != None:
-                                    new_subfields[REFERENCE_EXTENSION] = extension_outlist
-                                    logger.info('      Reference extension replaced by the one with value "%s" for reference %s".' % (extension_outlist, bibcode_res))
-                                #first I print the message because I need the old origin
-                                logger.info('      Reference origin "%s" replaced by the more trusted "%s".' % (new_subfields[ORIGIN_SUBFIELD], origin_outlist))
-                                new_subfields[ORIGIN_SUBFIELD] = origin_outlist
-                    
-                #finally I replace the global field
-                newrecord = (new_subfields.items(), ) + unique_references_dict[bibcode_res][1:]
-                unique_references_dict[bibcode_res] = newrecord
+                unique_references_dict[reference.key].merge(reference, tag)
         else:
-            unresolved_references.append(fieldcp)
+            unresolved_references.append(field)
     #and I return the union of the two lists of resolved and unresolved references
-    return unique_references_dict.values() + unresolved_references
-    
+    return [reference.get_field() for reference in unique_references] + unresolved_references
+
 
 def get_trusted_and_untrusted_fields(fields1, fields2, tag):
     """
@@ -386,15 +623,64 @@ def get_trusted_and_untrusted_fields(fields1, fields2, tag):
         raise
 
     if origin_val1 > origin_val2:
-        logger.info('      Selected fields from record 1 (%s over %s).' % (origin1, origin2))
+        logger.info('      Selected fields from record 1 (%s over %s).', origin1, origin2)
         return fields1, fields2
     elif origin_val1 < origin_val2:
-        logger.info('      Selected fields from record 2 (%s over %s).' % (origin2, origin1))
+        logger.info('      Selected fields from record 2 (%s over %s).', origin2, origin1)
         return fields2, fields1
     else:
         raise EqualOrigins(str(origin1) + ' - ' + str(origin2))
     
 
+def _get_origin_and_importance(fields, tag):
+    """returns the origin of a list of fields and its importance"""
+    try:
+        origin = get_origin(fields)
+        return origin, get_origin_importance(tag, origin)
+    except OriginValueNotFound, error:
+        logger.critical(error)
+        raise
+
+def _select_trusted_fields(fields_lists, tag):
+    """returns the list of fields that the priority based merge of the lists two at a time would select,
+    looking up the origin of each list only once"""
+    trusted = []
+    trusted_origin = None
+    for fields in fields_lists:
+        if not fields:
+            continue
+        if not trusted:
+            trusted = fields
+            continue
+        if trusted_origin is None:
+            trusted_origin = _get_origin_and_importance(trusted, tag)
+        origin = _get_origin_and_importance(fields, tag)
+        if origin[1] > trusted_origin[1]:
+            logger.info('      Selected fields from record 2 (%s over %s).', origin[0], trusted_origin[0])
+            trusted, trusted_origin = fields, origin
+        elif origin[1] < trusted_origin[1]:
+            logger.info('      Selected fields from record 1 (%s over %s).', trusted_origin[0], origin[0])
+        elif _get_best_fields(trusted, fields, tag)[0] is fields:
+            trusted, trusted_origin = fields, origin
+    return trusted
+
+def _get_excluded_subfields(field, codes):
+    """function that returns the set of the subfields excluded from the signature of a field having one of the codes"""
+    return frozenset([subfield for subfield in field[0] if subfield[0] in codes])
+
+def _get_primary(fields):
+    """function that returns 'True' if the majority of the fields has primary = True,
+    'False' if not and None if some field has no primary subfield"""
+    primary_occurrences = []
+    for field in fields:
+        try:
+            primary_occurrences.append(get_subfield_values(field, PRIMARY_METADATA_SUBFIELD)[0])
+        except IndexError:
+            return None
+    if primary_occurrences.count('True') > primary_occurrences.count('False'):
+        return 'True'
+    return 'False'
+
 def _get_best_fields(fields1, fields2, tag):
     """
     Function that should be called ONLY if "get_trusted_and_untrusted_fields" raises an "EqualOrigins" exception.
@@ -404,28 +690,26 @@ def _get_best_fields(fields1, fields2, tag):
     if len(fields1) == len(fields2) and all(bibrecord._compare_fields(field1, field2, strict=True) for field1, field2 in zip(fields1, fields2)):
         logger.info('      The two set of fields are exactly the same: picking the first one.')
         return (fields1, fields2)
-    #second check alfa: are the two sets the same excluding the temporary fields? if so I pick the one with primary=True or if there is anything the first one
-    if len(fields1) == len(fields2) and all(compare_fields_exclude_subfiels(field1, field2, strict=False, exclude_subfields=TEMP_SUBFIELDS_LIST) for field1, field2 in zip(fields1, fields2)):
-        logger.info('      The two set of fields are the same (temporary fields excluded): proceeding with primary check')
-        #if the two list are exactly the same even with the primary subfield, then I simply return one of the two
-        if len(fields1) == len(fields2) and all(compare_fields_exclude_subfiels(field1, field2, strict=False, exclude_subfields=[CREATION_DATE_TMP_SUBFIELD, MODIFICATION_DATE_TMP_SUBFIELD]) for field1, field2 in zip(fields1, fields2)):
-            logger.info('        The two set of fields are the same (extraction and modification date excluded: picking the first one')
-            return (fields1, fields2)
-        else:
-            #otherwise I have to check if there is a set of fields with a primary and return this one
-            try:
-                #I count the occorrences of fields with primary true or false
-                primary_occurrences_field1 = [bibrecord.field_get_subfield_values(field, PRIMARY_METADATA_SUBFIELD)[0] for field in fields1]
-                primary_occurrences_field2 = [bibrecord.field_get_subfield_values(field, PRIMARY_METADATA_SUBFIELD)[0] for field in fields2]
-                #then I consider primary = true only if the majority of fields is true
-                if primary_occurrences_field1.count('True') > primary_occurrences_field1.count('False'):
-                    primary_field1 = 'True'
-                else:
-                    primary_field1 = 'False'
-                if primary_occurrences_field2.count('True') > primary_occurrences_field2.count('False'):
-                    primary_field2 = 'True'
-                else:
-                    primary_field2 = 'False'
+    #third check: which one has more fields? If there is one I return this one
+    #(all the other checks compare sets of fields with the same length)
+    if len(fields1) != len(fields2):
+        logger.info('      The two set of fields have different length: picking the longest one.')
+        return (fields1, fields2) if len(fields1) > len(fields2) else (fields2, fields1)
+    #the fields are compared through their signature (without origin and temporary subfields) computed once per field:
+    #the sets excluding only some of these subfields are the same only if also the signatures are the same
+    if [UniqueFields.signature(field) for field in fields1] == [UniqueFields.signature(field) for field in fields2]:
+        #second check alfa: are the two sets the same excluding the temporary fields? if so I pick the one with primary=True or if there is anything the first one
+        if [_get_excluded_subfields(field, ORIGIN_SUBFIELDS) for field in fields1] == [_get_excluded_subfields(field, ORIGIN_SUBFIELDS) for field in fields2]:
+            logger.info('      The two set of fields are the same (temporary fields excluded): proceeding with primary check')
+            #if the two list are exactly the same even with the primary subfield, then I simply return one of the two
+            if [_get_excluded_subfields(field, TEMP_SUBFIELDS_KEPT_WITHOUT_DATES) for field in fields1] == \
+                    [_get_excluded_subfields(field, TEMP_SUBFIELDS_KEPT_WITHOUT_DATES) for field in fields2]:
+                logger.info('        The two set of fields are the same (extraction and modification date excluded: picking the first one')
+                return (fields1, fields2)
+            else:
+                #otherwise I have to check if there is a set of fields with a primary and return this one
+                primary_field1 = _get_primary(fields1)
+                primary_field2 = _get_primary(fields2)
                 #if one of the the two has priority true and the other has false I return the one with true
                 if primary_field1 == 'True' and primary_field2 == 'False':
                     logger.info('        One set of fields has priority set to True: returning this one')
@@ -433,66 +717,35 @@ def _get_best_fields(fields1, fields2, tag):
                 if primary_field1 == 'False' and primary_field2 == 'True':
                     logger.info('        One set of fields has priority set to True: returning this one')
                     return (fields2, fields1)
-            except IndexError:
-                pass
-        
-    #second check: are them the same not considering the origin? If so I take the first one
-    if len(fields1) == len(fields2) and all(compare_fields_exclude_subfiels(field1, field2, strict=False, exclude_subfields=[ORIGIN_SUBFIELD]+TEMP_SUBFIELDS_LIST) for field1, field2 in zip(fields1, fields2)):
+        #second check: are them the same not considering the origin? If so I take the first one
         logger.info('      The two set of fields are the same (origin excluded): picking the first one.')
         return (fields1, fields2)
-    #third check: which one has more fields? If there is one I return this one
-    if len(fields1) != len(fields2):
-        logger.info('      The two set of fields have different length: picking the longest one.')
-        return (fields1, fields2) if len(fields1) > len(fields2) else (fields2, fields1)
     #fourth check: which one has more subfields? If there is one I return this one
-    subfields1 = subfields2 = 0
-    for field in fields1:
-        subfields1 += len(field[0])
-    for field in fields2:
-        subfields2 += len(field[0]) 
+    subfields1 = sum([len(field[0]) for field in fields1])
+    subfields2 = sum([len(field[0]) for field in fields2])
     if subfields1 != subfields2:
         logger.info('      The two set of fields have different number of subfields: picking the set with more subfields.')
         return (fields1, fields2) if subfields1 > subfields2 else (fields2, fields1)
     #fifth check: the sum of all the length of all the strings in the subfields
-    subfields_strlen1 = subfields_strlen2 = 0
-    for field in fields1:
-        for subfield in field[0]:
-            if subfield[0] not in TEMP_SUBFIELDS_LIST:
-                subfields_strlen1 += len(subfield[1])
-    for field in fields2:
-        for subfield in field[0]:
-            if subfield[0] not in TEMP_SUBFIELDS_LIST:
-                subfields_strlen2 += len(subfield[1])
+    subfields_strlen1 = sum([len(subfield[1]) for field in fields1 for subfield in field[0] if subfield[0] not in TEMP_SUBFIELDS_SET])
+    subfields_strlen2 = sum([len(subfield[1]) for field in fields2 for subfield in field[0] if subfield[0] not in TEMP_SUBFIELDS_SET])
     if subfields_strlen1 != subfields_strlen2:
         logger.info('      The two set of fields have subfields with different length: picking the set with longer subfields.')
         return (fields1, fields2) if subfields_strlen1 > subfields_strlen2 else (fields2, fields1)
     #sixth check: if there is one set of field that has the subfield primary = true I take that one
-    try:
-        #I count the occorrences of fields with primary true or false
-        primary_occurrences_field1 = [bibrecord.field_get_subfield_values(field, PRIMARY_METADATA_SUBFIELD)[0] for field in fields1]
-        primary_occurrences_field2 = [bibrecord.field_get_subfield_values(field, PRIMARY_METADATA_SUBFIELD)[0] for field in fields2]
-        #then I consider primary = true only if the majority of fields is true
-        if primary_occurrences_field1.count('True') > primary_occurrences_field1.count('False'):
-            primary_field1 = 'True'
-        else:
-            primary_field1 = 'False'
-        if primary_occurrences_field2.count('True') > primary_occurrences_field2.count('False'):
-            primary_field2 = 'True'
-        else:
-            primary_field2 = 'False'
-        #if one of the the two has priority true and the other has false I return the one with true
-        if primary_field1 == 'True' and primary_field2 == 'False':
-            logger.info('      One set of fields has priority set to True: returning this one')
-            return (fields1, fields2)
-        if primary_field1 == 'False' and primary_field2 == 'True':
-            logger.info('      One set of fields has priority set to True: returning this one')
-            return (fields2, fields1)
-    except IndexError:
-        pass
+    primary_field1 = _get_primary(fields1)
+    primary_field2 = _get_primary(fields2)
+    #if one of the the two has priority true and the other has false I return the one with true
+    if primary_field1 == 'True' and primary_field2 == 'False':
+        logger.info('      One set of fields has priority set to True: returning this one')
+        return (fields1, fields2)
+    if primary_field1 == 'False' and primary_field2 == 'True':
+        logger.info('      One set of fields has priority set to True: returning this one')
+        return (fields2, fields1)
     try:
         #seventh check: which is the newest file?
-        all_dates1 = [bibrecord.field_get_subfield_values(field, CREATION_DATE_TMP_SUBFIELD)[0] for field in fields1] + [bibrecord.field_get_subfield_values(field, MODIFICATION_DATE_TMP_SUBFIELD)[0] for field in fields1]
-        all_dates2 = [bibrecord.field_get_subfield_values(field, CREATION_DATE_TMP_SUBFIELD)[0] for field in fields2] + [bibrecord.field_get_subfield_values(field, MODIFICATION_DATE_TMP_SUBFIELD)[0] for field in fields2]
+        all_dates1 = [get_subfield_values(field, CREATION_DATE_TMP_SUBFIELD)[0] for field in fields1] + [get_subfield_values(field, MODIFICATION_DATE_TMP_SUBFIELD)[0] for field in fields1]
+        all_dates2 = [get_subfield_values(field, CREATION_DATE_TMP_SUBFIELD)[0] for field in fields2] + [get_subfield_values(field, MODIFICATION_DATE_TMP_SUBFIELD)[0] for field in fields2]
         if max(all_dates1) > max(all_dates2):
             logger.info('      One set of fields is coming from a more recent file: returning this one')
             return (fields1, fields2)
@@ -0,0 +1,338 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Direct conversion of the ADS XML to bibrecord objects
+
+The conversion follows the same mappings of the stylesheet AdsXML2MarcXML_v2.xsl,
+but the records are built in one pass over the ADS XML, without creating
+the MarcXML document and parsing it again.
+"""
+
+import re
+import string
+
+#libraries to walk the xml
+import libxml2mod
+
+from merger.basic_functions import SubfieldList
+
+#value of the origin for the bibcode fields
+ADS_METADATA = 'ADS metadata'
+#names of the databases in the collection fields
+DATABASES = {'AST': 'ASTRONOMY', 'PHY': 'PHYSICS', 'GEN': 'GENERAL'}
+#elements of the metadata that, with value '1' (or '0'), define a collection
+COLLECTION_FLAGS = (('collection', '1', 'COLLECTION'),
+                    ('nonarticle', '1', 'NONARTICLE'),
+                    ('ocrabstract', '1', 'OCRABSTRACT'),
+                    ('openaccess', '1', 'OPENACCESS'),
+                    ('private', '1', 'PRIVATE'),
+                    ('refereed', '1', 'REFEREED'),
+                    ('refereed', '0', 'NOT REFEREED'),
+                    ('ads_scan', '1', 'ADS_SCAN'),
+                    ('toc', '1', 'TOC'),
+                    ('pub_openaccess', '1', 'PUB_OPENACCESS'))
+#translation of the pubtype to upper case (only the ascii letters, like the translate of the stylesheet)
+UPPERCASE = string.maketrans(string.ascii_lowercase, string.ascii_uppercase)
+#a number for XPath (used to compare the number of the author)
+XPATH_NUMBER = re.compile(r'^[ \t\r\n]*(-?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+))[ \t\r\n]*$')
+
+def create_records_from_ads_xml(domdoc, logger):
+    """Creates the records from the ADS XML document (of type libxml2)."""
+    all_bibrecords = list(iter_records_from_ads_xml(domdoc, logger))
+    #If I haven't found any record I return an empty bibrecord
+    if len(all_bibrecords) == 0:
+        return {}
+    return all_bibrecords
+
+def iter_records_from_ads_xml(domdoc, logger, free_nodes=False):
+    """Generator that yields the versions of one record of the ADS XML document at a time
+    (a version for each metadata of the record), with the same fields that the stylesheet produces.
+    If free_nodes is True the node of each record is removed from the document
+    and freed once converted."""
+    root = domdoc.getRootElement()
+    if root is None or root.name != 'records':
+        return
+    #the list is built before freeing any node
+    ads_records = _get_children(root._o).get('record', [])
+    for ads_record in ads_records:
+        canonical_bibcode = libxml2mod.xmlGetProp(ads_record, 'bibcode')
+        bibrecord_versions = [_get_record_version(metadata, canonical_bibcode)
+                              for metadata in _get_children(ads_record).get('metadata', [])]
+        if free_nodes:
+            libxml2mod.xmlUnlinkNode(ads_record)
+            libxml2mod.xmlFreeNode(ads_record)
+        #if I have no metadata it's an empty instance so I can skip it
+        if bibrecord_versions:
+            yield bibrecord_versions
+        else:
+            logger.info('No metadata for the record "%s": record skipped.' % canonical_bibcode)
+
+def _get_children(node):
+    """Returns a dictionary with the children elements of a raw libxml2mod node grouped by name"""
+    children = {}
+    child = libxml2mod.children(node)
+    while child is not None:
+        if libxml2mod.type(child) == 'element':
+            children.setdefault(libxml2mod.name(child), []).append(child)
+        child = libxml2mod.next(child)
+    return children
+
+def _select(children, name, subname):
+    """Returns the elements subname of the elements name (the path name/subname of XPath)"""
+    return [subchild for child in children.get(name, []) for subchild in _get_children(child).get(subname, [])]
+
+def _value(nodes):
+    """Returns the content of the first node (the value-of of XSLT)"""
+    if nodes:
+        return libxml2mod.xmlNodeGetContent(nodes[0])
+    return ''
+
+def _get_record_version(metadata, canonical_bibcode):
+    """Converts a metadata element to a bibrecord"""
+    children = _get_children(metadata)
+    origin = libxml2mod.xmlGetProp(metadata, 'origin') or ''
+    primary = libxml2mod.xmlGetProp(metadata, 'primary') or ''
+    #the subfields common to all the fields
+    common = [('7', origin),
+              ('97', _value(children.get('creation_time'))),
+              ('98', _value(children.get('modification_time'))),
+              ('99', primary)]
+    #the fields in the order of the stylesheet: (tag, ind1, ind2, subfields)
+    fields = []
+
+    #ISBN and ISSN
+    for tag, name, subname in (('020', 'isbns', 'isbn'), ('022', 'issns', 'issn')):
+        for node in _select(children, name, subname):
+            fields.append((tag, ' ', ' ', [('a', libxml2mod.xmlNodeGetContent(node))] + common))
+    #DOI
+    if 'DOI' in children:
+        fields.append(('024', '7', ' ', [('a', _value(children['DOI'])), ('2', 'DOI')] + common))
+    #Bibcode
+    bibcode_common = [('7', ADS_METADATA)] + common[1:]
+    fields.append(('970', ' ', ' ', [('a', canonical_bibcode or '')] + bibcode_common))
+    fields.append(('035', ' ', ' ', [('a', canonical_bibcode or ''), ('2', 'ADS bibcode')] + bibcode_common))
+    #Alternate bibcodes (without a canonical bibcode the comparison of XPath is always false)
+    for node in _select(children, 'alternates', 'alternate'):
+        alternate = libxml2mod.xmlNodeGetContent(node)
+        alternate_type = libxml2mod.xmlGetProp(node, 'type')
+        if canonical_bibcode is None or alternate == canonical_bibcode or alternate_type is None:
+            continue
+        if alternate_type == 'deleted':
+            fields.append(('035', ' ', ' ', [('z', alternate), ('2', alternate_type)] + common))
+        elif alternate_type == 'eprint':
+            fields.append(('035', ' ', ' ', [('y', alternate), ('2', 'eprint bibcode')] + common))
+        else:
+            fields.append(('035', ' ', ' ', [('y', alternate), ('2', alternate_type)] + common))
+    #other codes: arXiv
+    if 'preprintid' in children:
+        fields.append(('035', ' ', ' ', [('a', _value(children['preprintid'])), ('2', 'arXiv')] + common))
+
+    titles = children.get('title', [])
+    titles_lang = [libxml2mod.xmlGetProp(title, 'lang') for title in titles]
+    #the titles with a specific language not English
+    foreign_titles = [(title, lang) for title, lang in zip(titles, titles_lang) if lang not in (None, '', 'en')]
+    #Language code: the value of the tag language if exists, otherwise the language of the main title
+    if titles:
+        if 'language' in children:
+            fields.append(('041', ' ', ' ', [('a', _value(children['language']))] + common))
+        elif len(titles) > 1 and foreign_titles:
+            fields.append(('041', ' ', ' ', [('a', foreign_titles[0][1])] + common))
+        elif titles_lang[0] is not None:
+            fields.append(('041', ' ', ' ', [('a', titles_lang[0])] + common))
+
+    #Authors
+    for author in children.get('author', []):
+        author_children = _get_children(author)
+        subfields = [('a', _value(_select(author_children, 'name', 'western')))]
+        normalized = _select(author_children, 'name', 'normalized')
+        if normalized:
+            subfields.append(('b', _value(normalized)))
+        native = _select(author_children, 'name', 'native')
+        if native:
+            subfields.append(('q', _value(native)))
+        if 'type' in author_children:
+            subfields.append(('e', _value(author_children['type'])))
+        for code, name, subname in (('u', 'affiliations', 'affiliation'), ('m', 'emails', 'email'), ('j', 'author_ids', 'author_id')):
+            subfields.extend((code, libxml2mod.xmlNodeGetContent(node)) for node in _select(author_children, name, subname))
+        if _is_number_one(libxml2mod.xmlGetProp(author, 'nr')):
+            fields.append(('100', ' ', ' ', subfields + common))
+        else:
+            fields.append(('700', ' ', ' ', subfields + common))
+    #Conference metadata
+    if 'conf_metadata' in children:
+        fields.append(('111', ' ', ' ', [('a', _value(children['conf_metadata']))] + common))
+    #Title
+    if len(titles) == 1:
+        #(like in the stylesheet, the language is the one of the metadata)
+        metadata_lang = libxml2mod.xmlGetProp(metadata, 'lang')
+        subfields = [('a', libxml2mod.xmlNodeGetContent(titles[0]))]
+        if metadata_lang is not None:
+            subfields.append(('y', metadata_lang))
+        fields.append(('245', ' ', ' ', subfields + common))
+    elif foreign_titles:
+        #If there are titles with a specific language not English, only the first of them is 245
+        #and all the others (also English + unknown + title without language) are 242
+        for position, (title, lang) in enumerate(foreign_titles):
+            fields.append((position == 0 and '245' or '242', ' ', ' ', [('a', libxml2mod.xmlNodeGetContent(title)), ('y', lang)] + common))
+        for title, lang in zip(titles, titles_lang):
+            if lang in (None, '', 'en'):
+                subfields = [('a', libxml2mod.xmlNodeGetContent(title))]
+                if lang:
+                    subfields.append(('y', lang))
+                fields.append(('242', ' ', ' ', subfields + common))
+    else:
+        #Otherwise the first one is 245 and all the others 242
+        for position, (title, lang) in enumerate(zip(titles, titles_lang)):
+            subfields = [('a', libxml2mod.xmlNodeGetContent(title))]
+            if lang is not None:
+                subfields.append(('y', lang))
+            fields.append((position == 0 and '245' or '242', ' ', ' ', subfields + common))
+    #Publication date
+    for node in _select(children, 'dates', 'date'):
+        fields.append(('260', ' ', ' ', [('c', libxml2mod.xmlNodeGetContent(node)), ('t', libxml2mod.xmlGetProp(node, 'type') or '')] + common))
+    #Number of pages
+    if 'pagenumber' in children:
+        fields.append(('300', ' ', ' ', [('a', _value(children['pagenumber']))] + common))
+    #Comments (the origin is the one of the first comment with an origin)
+    if 'comment' in children:
+        comment_origins = [libxml2mod.xmlGetProp(node, 'origin') for node in children['comment']]
+        comment_origin = ([comment_origin for comment_origin in comment_origins if comment_origin is not None] or [''])[0]
+        fields.append(('500', ' ', ' ', [('a', _value(children['comment'])), common[0], ('9', comment_origin)] + common[1:]))
+    #Abstract
+    for node in children.get('abstract', []):
+        abstract = libxml2mod.xmlNodeGetContent(node)
+        if abstract != 'Not Available':
+            subfields = [('a', abstract)]
+            lang = libxml2mod.xmlGetProp(node, 'lang')
+            if lang:
+                subfields.append(('y', lang))
+            fields.append(('520', ' ', ' ', subfields + common))
+    #Copyright
+    if 'copyright' in children:
+        fields.append(('542', ' ', ' ', [('a', _value(children['copyright']))] + common))
+    #Associate papers
+    for node in _select(children, 'associates', 'associate'):
+        fields.append(('591', ' ', ' ', [('a', libxml2mod.xmlNodeGetContent(node)), ('c', libxml2mod.xmlGetProp(node, 'comment') or '')] + common))
+    #Special collection for eprints
+    for node in _select(children, 'arxivcategories', 'arxivcategory'):
+        category_type = libxml2mod.xmlGetProp(node, 'type')
+        if category_type == 'main':
+            fields.append(('650', '1', '7', [('a', libxml2mod.xmlNodeGetContent(node))] + common))
+        elif category_type == '':
+            fields.append(('650', '2', '7', [('a', libxml2mod.xmlNodeGetContent(node))] + common))
+    #Keywords: free keywords if there is no classification scheme, otherwise controlled keywords
+    for keywords in children.get('keywords', []):
+        classificationscheme = libxml2mod.xmlGetProp(keywords, 'type') or ''
+        for keyword in _get_children(keywords).get('keyword', []):
+            keyword_children = _get_children(keyword)
+            original = _value(keyword_children.get('original'))
+            if original:
+                subfields = [('a', original), ('b', _value(keyword_children.get('normalized')))]
+                if classificationscheme:
+                    fields.append(('695', ' ', ' ', subfields + [('2', classificationscheme)] + common))
+                else:
+                    fields.append(('653', '1', ' ', subfields + common))
+    #Facility/telescope/Instruments
+    for node in children.get('instruments', []):
+        fields.append(('693', ' ', ' ', [('i', libxml2mod.xmlNodeGetContent(node))] + common))
+    #Objects
+    for node in _select(children, 'objects', 'object'):
+        subfields = [('a', libxml2mod.xmlNodeGetContent(node)), common[0]]
+        object_origin = libxml2mod.xmlGetProp(node, 'origin')
+        if object_origin is not None:
+            subfields.append(('9', object_origin))
+        fields.append(('694', ' ', ' ', subfields + common[1:]))
+    #Journal: if it's an alternate journal it's an additional publication
+    if 'journal' in children:
+        subfields = [('p', _value(children.get('canonical_journal')))]
+        if 'volume' in children:
+            subfields.append(('v', _value(children['volume'])))
+        if 'issue' in children:
+            subfields.append(('n', _value(children['issue'])))
+        if 'page' in children:
+            page = _value(children['page'])
+            if 'lastpage' in children:
+                page += '-' + _value(children['lastpage'])
+            subfields.append(('c', page))
+        if 'electronic_id' in children:
+            subfields.append(('i', _value(children['electronic_id'])))
+        subfields.append(('y', (canonical_bibcode or '').decode('utf-8')[:4].encode('utf-8')))
+        subfields.append(('z', _value(children['journal'])))
+        if libxml2mod.xmlGetProp(metadata, 'alternate_journal') == 'False':
+            fields.append(('773', ' ', ' ', subfields + common))
+        else:
+            fields.append(('775', ' ', ' ', subfields + common))
+    #Links
+    for node in _select(children, 'links', 'link'):
+        subfields = [('u', libxml2mod.xmlGetProp(node, 'url') or ''),
+                     ('y', libxml2mod.xmlGetProp(node, 'title') or ''),
+                     ('3', libxml2mod.xmlGetProp(node, 'type') or '')]
+        count = libxml2mod.xmlGetProp(node, 'count')
+        if count is not None:
+            subfields.append(('5', count))
+        fields.append(('856', '4', ' ', subfields + common))
+    #Origin
+    for node in children.get('origin', []):
+        fields.append(('907', ' ', ' ', [('a', libxml2mod.xmlNodeGetContent(node))] + common))
+    #Creation and modification dates
+    if 'creation_time' in children and 'modification_time' in children:
+        fields.append(('961', ' ', ' ', [('c', common[2][1]), ('x', common[1][1])] + common))
+
+    #Collections: databases
+    for node in _select(children, 'databases', 'database'):
+        database = libxml2mod.xmlNodeGetContent(node)
+        if database != 'PRE':
+            fields.append(('980', ' ', ' ', [('a', DATABASES.get(database, database))] + common))
+    #other collections
+    for name, flag, collection in COLLECTION_FLAGS:
+        if flag in [libxml2mod.xmlNodeGetContent(node) for node in children.get(name, [])]:
+            fields.append(('980', ' ', ' ', [('p', collection)] + common))
+    #Special collection "pubtype"
+    if 'pubtype' in children:
+        fields.append(('980', ' ', ' ', [('p', _value(children['pubtype']).translate(UPPERCASE))] + common))
+    #Bibliographic groups, data sources and Vizier tables
+    for code, name, subname in (('b', 'bibgroups', 'bibgroup'), ('s', 'data_sources', 'data_source'), ('v', 'vizier_tables', 'vizier_table')):
+        for node in _select(children, name, subname):
+            fields.append(('980', ' ', ' ', [(code, libxml2mod.xmlNodeGetContent(node))] + common))
+    #Timestamp signature
+    if 'JSON_timestamp' in children:
+        fields.append(('995', ' ', ' ', [('a', _value(children['JSON_timestamp']))] + common))
+    #References
+    for node in children.get('reference', []):
+        subfields = []
+        for code, attribute, prefix in (('i', 'bibcode', ''), ('r', 'arxid', 'arxiv: '), ('a', 'doi', 'doi: '), ('e', 'score', ''), ('f', 'source', '')):
+            value = libxml2mod.xmlGetProp(node, attribute)
+            if value:
+                subfields.append((code, prefix + value))
+        reference = libxml2mod.xmlNodeGetContent(node)
+        if reference:
+            subfields.append(('b', reference))
+        extension = libxml2mod.xmlGetProp(node, 'extension')
+        if extension:
+            subfields.append(('w', extension))
+        fields.append(('999', 'C', '5', subfields + common))
+
+    #finally I build the bibrecord with the global position of the fields
+    bibrecord_version = {}
+    for position, (tag, ind1, ind2, subfields) in enumerate(fields):
+        bibrecord_version.setdefault(tag, []).append((SubfieldList(subfields), ind1, ind2, '', position + 1,))
+    return bibrecord_version
+
+def _is_number_one(value):
+    """Returns True if the value, converted to a number like XPath does, is 1"""
+    if value is None:
+        return False
+    match = XPATH_NUMBER.match(value)
+    return match is not None and float(match.group(1)) == 1
@@ -0,0 +1,323 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Compact set of bibcodes
+
+The bibcodes are stored sorted and without duplicates in a single string where
+every entry has the same width (shorter bibcodes are padded with NUL characters,
+that keep the same order of the plain strings). A set of millions of bibcodes
+costs then only the size of the bibcodes themselves, the lookups are binary
+searches and union, difference and intersection are linear merges.
+
+The module contains also the bulk reader of the files of bibcodes, that maps
+the file in memory and extracts the first column of big blocks of lines with a
+single regular expression.
+"""
+
+import os
+import re
+import mmap
+import heapq
+import itertools
+from cStringIO import StringIO
+
+from merger.merger_errors import GenericError
+
+#standard length of a bibcode
+BIBCODE_LENGTH = 19
+PADDING = '\0'
+
+#size of the blocks of a file of bibcodes parsed at once
+READ_BLOCK_SIZE = 8 * 1024 * 1024
+#first column of the lines not starting with a space
+#(matching the rest of the line too is faster than searching the next line start)
+FIRST_COLUMN_RE = re.compile(r'^([^ \t\r\n][^\t\r\n]*)[^\n]*', re.MULTILINE)
+
+def iter_bibcode_blocks(filepath, block_size=READ_BLOCK_SIZE):
+    """ Yields the lists of bibcodes found in consecutive blocks of a file:
+        the bibcode is the first column of a line (separated by a tab) and
+        the lines starting with a space are skipped.
+    """
+    try:
+        bibfile = open(filepath, 'rb')
+    except IOError:
+        raise GenericError('Mandatory file not readable. Please check %s' % filepath)
+    try:
+        size = os.fstat(bibfile.fileno()).st_size
+        if size == 0:
+            return
+        data = mmap.mmap(bibfile.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        bibfile.close()
+    try:
+        start = 0
+        while start < size:
+            end = start + block_size
+            if end >= size:
+                end = size
+            else:
+                #every block ends at the end of a line
+                end = data.find('\n', end) + 1 or size
+            yield FIRST_COLUMN_RE.findall(data[start:end])
+            start = end
+    finally:
+        data.close()
+
+def read_bibcodes(filepath):
+    """ Returns the list of bibcodes in a file, in the order of the file """
+    bibcodes = []
+    for block in iter_bibcode_blocks(filepath):
+        bibcodes.extend(block)
+    return bibcodes
+
+class BibcodeSet(object):
+    """ Immutable sorted set of bibcodes """
+
+    __slots__ = ('width', 'buffer')
+
+    def __init__(self, bibcodes=(), width=BIBCODE_LENGTH):
+        """ Constructor: bibcodes can be any iterable of strings """
+        if isinstance(bibcodes, BibcodeSet):
+            self.width = bibcodes.width
+            self.buffer = bibcodes.buffer
+            return
+        bibcodes = sorted(bibcodes)
+        if bibcodes:
+            width = max(width, max(itertools.imap(len, bibcodes)))
+        self.width = width
+        #the entries are written in the buffer skipping the duplicates
+        output = StringIO()
+        write = output.write
+        last = None
+        for bibcode in bibcodes:
+            if bibcode != last:
+                write(bibcode)
+                if len(bibcode) < width:
+                    write(PADDING * (width - len(bibcode)))
+                last = bibcode
+        self.buffer = output.getvalue()
+
+    @classmethod
+    def from_sorted(cls, bibcodes, width=BIBCODE_LENGTH):
+        """ Builds a set from an iterable of bibcodes already sorted
+            (duplicates are allowed), without sorting them again.
+        """
+        output = StringIO()
+        last = None
+        for bibcode in bibcodes:
+            if len(bibcode) > width:
+                #the entries written so far must be padded again
+                buf = output.getvalue()
+                output = StringIO()
+                _write_padded(output.write, buf, width, len(bibcode))
+                width = len(bibcode)
+                if last is not None:
+                    last = last.ljust(width, PADDING)
+            entry = bibcode.ljust(width, PADDING)
+            if last is not None and entry <= last:
+                if entry == last:
+                    continue
+                raise GenericError('Bibcodes not sorted: "%s" found after "%s"' % (bibcode, last.rstrip(PADDING)))
+            output.write(entry)
+            last = entry
+        return cls._from_buffer(output.getvalue(), width)
+
+    @classmethod
+    def from_file(cls, filepath):
+        """ Builds a set from the first column of a file of bibcodes
+            (the lines starting with a space are skipped).
+        """
+        #only one block of strings is alive at a time
+        return cls.union_all(cls(block) for block in iter_bibcode_blocks(filepath))
+
+    @classmethod
+    def union_all(cls, bibcode_sets):
+        """ Union of many sets with a single merge """
+        bibcode_sets = [bibcode_set for bibcode_set in bibcode_sets if bibcode_set]
+        if not bibcode_sets:
+            return cls()
+        width = max(bibcode_set.width for bibcode_set in bibcode_sets)
+        #if the sets follow each other (the file was sorted) I only have to concatenate them
+        consecutive = True
+        for previous, current in zip(bibcode_sets, bibcode_sets[1:]):
+            if previous[-1].ljust(width, PADDING) >= current[0].ljust(width, PADDING):
+                consecutive = False
+                break
+        output = StringIO()
+        write = output.write
+        if consecutive:
+            for bibcode_set in bibcode_sets:
+                _write_padded(write, bibcode_set.buffer, bibcode_set.width, width)
+            return cls._from_buffer(output.getvalue(), width)
+        last = None
+        for entry in heapq.merge(*[bibcode_set._entries(width) for bibcode_set in bibcode_sets]):
+            if entry != last:
+                write(entry)
+                last = entry
+        return cls._from_buffer(output.getvalue(), width)
+
+    @classmethod
+    def _from_buffer(cls, buf, width):
+        """ Builds a set from a buffer of padded, sorted and unique entries """
+        new_set = cls.__new__(cls)
+        new_set.width = width
+        new_set.buffer = buf
+        return new_set
+
+    def __len__(self):
+        return len(self.buffer) // self.width
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('BibcodeSet index out of range')
+        start = index * self.width
+        return self.buffer[start:start + self.width].rstrip(PADDING)
+
+    def __iter__(self):
+        width = self.width
+        buf = self.buffer
+        for start in xrange(0, len(buf), width):
+            yield buf[start:start + width].rstrip(PADDING)
+
+    def __contains__(self, bibcode):
+        if len(bibcode) > self.width:
+            return False
+        return self._bisect(bibcode.ljust(self.width, PADDING))[1]
+
+    def _bisect(self, entry):
+        """ Returns the position where entry should be and if it is there """
+        width = self.width
+        buf = self.buffer
+        low, high = 0, len(buf) // width
+        while low < high:
+            middle = (low + high) // 2
+            current = buf[middle * width:(middle + 1) * width]
+            if current < entry:
+                low = middle + 1
+            elif current > entry:
+                high = middle
+            else:
+                return middle, True
+        return low, False
+
+    def index(self, bibcode):
+        """ Returns the position of a bibcode in the set """
+        if len(bibcode) <= self.width:
+            position, found = self._bisect(bibcode.ljust(self.width, PADDING))
+            if found:
+                return position
+        raise ValueError('%s not in BibcodeSet' % bibcode)
+
+    def __eq__(self, other):
+        if not isinstance(other, BibcodeSet):
+            return NotImplemented
+        if self.width == other.width:
+            return self.buffer == other.buffer
+        return len(self) == len(other) and list(self) == list(other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __repr__(self):
+        return 'BibcodeSet(%r)' % list(self)
+
+    def __getstate__(self):
+        return self.width, self.buffer
+
+    def __setstate__(self, state):
+        self.width, self.buffer = state
+
+    def _entries(self, width):
+        """ Iterator over the entries padded to width """
+        if width == self.width:
+            buf = self.buffer
+            for start in xrange(0, len(buf), width):
+                yield buf[start:start + width]
+        else:
+            for start in xrange(0, len(self.buffer), self.width):
+                yield self.buffer[start:start + self.width].ljust(width, PADDING)
+
+    def _merge(self, other, keep_left, keep_both, keep_right):
+        """ Linear merge of two sets: the flags tell which entries to keep
+            (only in self, in both, only in other).
+        """
+        other = _as_bibcode_set(other)
+        width = max(self.width, other.width)
+        output = StringIO()
+        write = output.write
+        left = self._entries(width)
+        right = other._entries(width)
+        left_entry = next(left, None)
+        right_entry = next(right, None)
+        while left_entry is not None and right_entry is not None:
+            if left_entry < right_entry:
+                if keep_left:
+                    write(left_entry)
+                left_entry = next(left, None)
+            elif left_entry > right_entry:
+                if keep_right:
+                    write(right_entry)
+                right_entry = next(right, None)
+            else:
+                if keep_both:
+                    write(left_entry)
+                left_entry = next(left, None)
+                right_entry = next(right, None)
+        if keep_left and left_entry is not None:
+            write(left_entry)
+            for left_entry in left:
+                write(left_entry)
+        if keep_right and right_entry is not None:
+            write(right_entry)
+            for right_entry in right:
+                write(right_entry)
+        return BibcodeSet._from_buffer(output.getvalue(), width)
+
+    def union(self, other):
+        """ Returns the bibcodes in self or in other """
+        return self._merge(other, True, True, True)
+
+    def difference(self, other):
+        """ Returns the bibcodes in self but not in other """
+        return self._merge(other, True, False, False)
+
+    def intersection(self, other):
+        """ Returns the bibcodes both in self and in other """
+        return self._merge(other, False, True, False)
+
+    __or__ = union
+    __sub__ = difference
+    __and__ = intersection
+
+def _write_padded(write, buf, buf_width, width):
+    """ Writes the entries of a buffer padded to width """
+    if width == buf_width:
+        write(buf)
+        return
+    padding = PADDING * (width - buf_width)
+    for start in xrange(0, len(buf), buf_width):
+        write(buf[start:start + buf_width])
+        write(padding)
+
+def _as_bibcode_set(bibcodes):
+    """ Converts any iterable of bibcodes to a BibcodeSet """
+    if isinstance(bibcodes, BibcodeSet):
+        return bibcodes
+    return BibcodeSet(bibcodes)
@@ -0,0 +1,306 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Compact binary container of bibrecords
+
+A container file is made of:
+    * the MAGIC string
+    * blocks of records: a header (BLOCK_HEADER: the type of block, the number
+      of records and the size of the data) followed by the data, compressed
+      with zlib if that makes it smaller. The data of a block starts with the
+      table of the short strings (tags, indicators and subfield codes) used by
+      its records, then every record is length-prefixed: the number of
+      integers and the size of the values, the integers describing the
+      structure of the record (with the indexes of the strings in the table and
+      the lengths of the values) and finally the values themselves.
+    * a block with the index: offset and number of records of each block
+    * the TRAILER: offset of the index and MAGIC.
+
+Every block can be decoded on its own: the records can be read in a stream
+(iter_records, without waiting for the whole file) or one at a time through
+the index (BibrecordContainerReader).
+The records read back are equal to the ones written (the fields are tuples
+with a list of subfields, like in the records unpickled by bibupload).
+"""
+
+import zlib
+import struct
+from cStringIO import StringIO
+
+from merger.merger_errors import GenericError
+
+MAGIC = 'ADSBREC1'
+#type of block, number of records, size of the data
+BLOCK_HEADER = struct.Struct('!cII')
+#offset of the index block, MAGIC
+TRAILER = struct.Struct('!Q8s')
+#number of integers, size of the values of a record
+RECORD_HEADER = struct.Struct('!II')
+#number of strings in the table of a block
+TABLE_HEADER = struct.Struct('!I')
+
+RAW_BLOCK = 'r'
+COMPRESSED_BLOCK = 'z'
+RAW_INDEX = 'i'
+COMPRESSED_INDEX = 'x'
+
+RECORDS_PER_BLOCK = 64
+#fast compression: the files are written once and read once
+COMPRESSION_LEVEL = 1
+
+def is_container(header):
+    """Returns True if the string (the beginning of a file) is the beginning of a container"""
+    return header[:len(MAGIC)] == MAGIC
+
+def dumps(records):
+    """Returns the container of the records as a string"""
+    output = StringIO()
+    writer = BibrecordContainerWriter(output)
+    for record in records:
+        writer.write(record)
+    writer.close()
+    return output.getvalue()
+
+def loads(data):
+    """Returns the list of the records in a container string"""
+    return list(iter_records(StringIO(data)))
+
+class BibrecordContainerWriter(object):
+    """Writer of a container in a file object (that doesn't need to be seekable)"""
+    def __init__(self, fileobj, records_per_block=RECORDS_PER_BLOCK, compression_level=COMPRESSION_LEVEL):
+        self.fileobj = fileobj
+        self.records_per_block = records_per_block
+        self.compression_level = compression_level
+        #offset and number of records of the blocks written
+        self.index = []
+        self.offset = 0
+        self._write(MAGIC)
+        self._new_block()
+
+    def _new_block(self):
+        """Starts a new block"""
+        self.strings = []
+        self.strings_index = {}
+        self.block_records = []
+
+    def _write(self, data):
+        """Writes to the file keeping the current offset"""
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def _write_block(self, block_type, number_of_records, data):
+        """Writes a block compressing its data if useful"""
+        compressed = zlib.compress(data, self.compression_level)
+        if len(compressed) < len(data):
+            data = compressed
+            block_type = {RAW_BLOCK: COMPRESSED_BLOCK, RAW_INDEX: COMPRESSED_INDEX}[block_type]
+        self._write(BLOCK_HEADER.pack(block_type, number_of_records, len(data)))
+        self._write(data)
+
+    def _intern(self, string):
+        """Returns the index of a short string in the table of the block"""
+        index = self.strings_index.get(string)
+        if index is None:
+            if type(string) is not str:
+                raise GenericError('Only strings can be used as tags, indicators and subfield codes: %r' % (string,))
+            index = self.strings_index[string] = len(self.strings)
+            self.strings.append(string)
+        return index
+
+    def write(self, record):
+        """Adds a record to the container"""
+        ints = [len(record)]
+        values = []
+        #local names for the loop on the subfields
+        add_int = ints.append
+        add_value = values.append
+        get_index = self.strings_index.get
+        intern = self._intern
+        try:
+            for tag, fields in record.iteritems():
+                add_int(intern(tag))
+                add_int(len(fields))
+                for subfields, ind1, ind2, controlfield_value, position in fields:
+                    ints.extend((intern(ind1), intern(ind2), position, len(subfields)))
+                    if type(controlfield_value) is str:
+                        add_int(len(controlfield_value))
+                    else:
+                        controlfield_value = _encode_value(controlfield_value, ints)
+                    add_value(controlfield_value)
+                    for code, value in subfields:
+                        code_index = get_index(code)
+                        if code_index is None:
+                            code_index = intern(code)
+                        add_int(code_index)
+                        if type(value) is str:
+                            add_int(len(value))
+                        else:
+                            value = _encode_value(value, ints)
+                        add_value(value)
+            values = ''.join(values)
+            self.block_records.append(RECORD_HEADER.pack(len(ints), len(values)) + struct.pack('!%di' % len(ints), *ints) + values)
+        except (AttributeError, TypeError, ValueError, struct.error), error:
+            raise GenericError('Record not supported by the bibrecord container: %s' % error)
+        if len(self.block_records) >= self.records_per_block:
+            self.flush()
+
+    def flush(self):
+        """Writes the current block"""
+        if not self.block_records:
+            return
+        table = TABLE_HEADER.pack(len(self.strings)) + struct.pack('!%dH' % len(self.strings), *[len(string) for string in self.strings]) + ''.join(self.strings)
+        self.index.append((self.offset, len(self.block_records)))
+        self._write_block(RAW_BLOCK, len(self.block_records), table + ''.join(self.block_records))
+        self._new_block()
+
+    def close(self):
+        """Writes the last block, the index and the trailer (the file object is not closed)"""
+        self.flush()
+        index_offset = self.offset
+        index = [value for block in self.index for value in block]
+        self._write_block(RAW_INDEX, len(self.index), struct.pack('!%dQ' % len(index), *index))
+        self._write(TRAILER.pack(index_offset, MAGIC))
+
+def _encode_value(value, ints):
+    """Returns a unicode value of a field encoded in UTF-8 and adds its length to the integers of the record
+    (the lengths of the unicode values are negative)"""
+    if type(value) is not unicode:
+        raise GenericError('Only strings can be used as values of the fields: %r' % (value,))
+    value = value.encode('utf-8')
+    ints.append(-len(value) - 1)
+    return value
+
+def _read(fileobj, size):
+    """Reads exactly size bytes"""
+    data = fileobj.read(size)
+    if len(data) != size:
+        raise GenericError('Truncated bibrecord container')
+    return data
+
+def _read_block(fileobj):
+    """Reads a block from the current position: returns its type, number of records and (uncompressed) data"""
+    block_type, number_of_records, size = BLOCK_HEADER.unpack(_read(fileobj, BLOCK_HEADER.size))
+    data = _read(fileobj, size)
+    if block_type in (COMPRESSED_BLOCK, COMPRESSED_INDEX):
+        data = zlib.decompress(data)
+        block_type = {COMPRESSED_BLOCK: RAW_BLOCK, COMPRESSED_INDEX: RAW_INDEX}[block_type]
+    elif block_type not in (RAW_BLOCK, RAW_INDEX):
+        raise GenericError('Unknown block in bibrecord container: %r' % block_type)
+    return block_type, number_of_records, data
+
+def _decode_block(data, number_of_records):
+    """Returns the list of the records in the data of a block"""
+    number_of_strings, = TABLE_HEADER.unpack_from(data)
+    offset = TABLE_HEADER.size
+    lengths = struct.unpack_from('!%dH' % number_of_strings, data, offset)
+    offset += 2 * number_of_strings
+    strings = []
+    for length in lengths:
+        strings.append(data[offset:offset + length])
+        offset += length
+
+    records = []
+    for i in xrange(number_of_records):
+        number_of_ints, values_size = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        ints = struct.unpack_from('!%di' % number_of_ints, data, offset)
+        offset += 4 * number_of_ints
+        values = data[offset:offset + values_size]
+        offset += values_size
+
+        record = {}
+        value_offset = 0
+        pos = 1
+        for j in xrange(ints[0]):
+            fields = []
+            record[strings[ints[pos]]] = fields
+            number_of_fields = ints[pos + 1]
+            pos += 2
+            for k in xrange(number_of_fields):
+                ind1, ind2, position, number_of_subfields, length = ints[pos:pos + 5]
+                pos += 5
+                if length >= 0:
+                    controlfield_value = values[value_offset:value_offset + length]
+                else:
+                    length = -length - 1
+                    controlfield_value = values[value_offset:value_offset + length].decode('utf-8')
+                value_offset += length
+                subfields = []
+                for l in xrange(number_of_subfields):
+                    code, length = ints[pos:pos + 2]
+                    pos += 2
+                    if length >= 0:
+                        subfields.append((strings[code], values[value_offset:value_offset + length]))
+                    else:
+                        length = -length - 1
+                        subfields.append((strings[code], values[value_offset:value_offset + length].decode('utf-8')))
+                    value_offset += length
+                fields.append((subfields, strings[ind1], strings[ind2], controlfield_value, position))
+        records.append(record)
+    return records
+
+def iter_records(fileobj):
+    """Yields the records of a container reading the file object one block at a time"""
+    if not is_container(fileobj.read(len(MAGIC))):
+        raise GenericError('Not a bibrecord container')
+    while True:
+        block_type, number_of_records, data = _read_block(fileobj)
+        if block_type == RAW_INDEX:
+            return
+        for record in _decode_block(data, number_of_records):
+            yield record
+
+class BibrecordContainerReader(object):
+    """Random access to the records of a container in a seekable file object"""
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        fileobj.seek(-TRAILER.size, 2)
+        index_offset, magic = TRAILER.unpack(_read(fileobj, TRAILER.size))
+        if magic != MAGIC:
+            raise GenericError('Not a bibrecord container')
+        fileobj.seek(index_offset)
+        block_type, number_of_blocks, data = _read_block(fileobj)
+        index = struct.unpack('!%dQ' % (2 * number_of_blocks), data)
+        #offset and number of the first record of each block
+        self.blocks = []
+        self.number_of_records = 0
+        for i in xrange(number_of_blocks):
+            self.blocks.append((index[2 * i], self.number_of_records))
+            self.number_of_records += index[2 * i + 1]
+        #last block decoded
+        self.block_number = None
+        self.block_records = None
+
+    def __len__(self):
+        return self.number_of_records
+
+    def get_record(self, number):
+        """Returns the record with the given number (from 0) reading only its block"""
+        if number < 0 or number >= self.number_of_records:
+            raise IndexError('Record %d not in the container' % number)
+        #the block of the record is the last one starting before it
+        low, high = 0, len(self.blocks)
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self.blocks[middle][1] <= number:
+                low = middle
+            else:
+                high = middle
+        if low != self.block_number:
+            self.fileobj.seek(self.blocks[low][0])
+            block_type, number_of_records, data = _read_block(self.fileobj)
+            self.block_records = _decode_block(data, number_of_records)
+            self.block_number = low
+        return self.block_records[number - self.blocks[low][1]]
@@ -17,13 +17,50 @@
 
 """
 
+import os
+
 #libraries to transform the xml
 import libxml2
+import libxml2mod
 import libxslt
-import inspect 
 
 import pipeline_settings as settings
 from merger.merger_errors import GenericError
+from merger.basic_functions import SubfieldList
+from pipeline_log_functions import trace_method
+
+#compiled stylesheets of the process: path -> (modification time, stylesheet object)
+#the stylesheets are loaded once per process (or before forking the workers)
+#and parsed again only when the file on disk changes
+_STYLESHEETS = {}
+
+def get_stylesheet(path):
+    """Returns the compiled stylesheet for the file at path,
+        parsing it again only if the file has been modified since it was loaded"""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        raise GenericError('ERROR: stylesheet "%s" not readable' % path)
+    cached = _STYLESHEETS.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    try:
+        style_obj = libxslt.parseStylesheetDoc(libxml2.parseFile(path))
+    except:
+        style_obj = None
+    if style_obj is None:
+        raise GenericError('ERROR: problem loading stylesheet "%s"' % path)
+    #I free the old version of the stylesheet
+    if cached is not None:
+        del _STYLESHEETS[path]
+        cached[1].freeStylesheet()
+    _STYLESHEETS[path] = (mtime, style_obj)
+    return style_obj
+
+def free_stylesheets():
+    """Frees all the stylesheets compiled by the process"""
+    while _STYLESHEETS:
+        _STYLESHEETS.popitem()[1][1].freeStylesheet()
 
 class XmlTransformer(object):
     """ Class that transform an ADS xml in MarcXML"""
@@ -36,22 +73,21 @@ class XmlTransformer(object):
         #I initialize the style sheet object
         self.style_obj = None
     
+    @trace_method
     def init_stylesheet(self):
         """ Method that initialize the transformation engine """
-        self.logger.info("In function %s.%s" % (self.__class__.__name__, inspect.stack()[0][3]))
-        #create the stylesheet obj
+        #I get the stylesheet obj from the cache of the process
         try:
-            self.style_obj = libxslt.parseStylesheetDoc(libxml2.parseFile(self.stylesheet))
-        except:
-            err_msg = "ERROR: problem loading stylesheet"
-            self.logger.critical(err_msg)
-            raise GenericError(err_msg)
+            self.style_obj = get_stylesheet(self.stylesheet)
+        except GenericError, error:
+            self.logger.critical(error)
+            raise
         return True
     
+    @trace_method
     def transform(self, doc):
         """ Method that actually make the transformation"""
-        self.logger.info("In function %s.%s" % (self.__class__.__name__, inspect.stack()[0][3]))
-        #I load the stylesheet
+        #I load the stylesheet (it is parsed only the first time or if the file changed)
         self.init_stylesheet()   
         #transformation
         try:
@@ -69,83 +105,95 @@ class XmlTransformer(object):
 
 def create_record_from_libxml_obj(domdoc, logger):
     """Creates a record from the document (of type libxml2/libxslt)."""
+    all_bibrecords = list(iter_records_from_libxml_obj(domdoc, logger))
+    #If I haven't found any record I return an empty bibrecord
+    if len(all_bibrecords) == 0:
+        return {}
+    return all_bibrecords
+
+def iter_records_from_libxml_obj(domdoc, logger, free_nodes=False):
+    """Generator that yields the versions of one record of the document at a time.
+    If free_nodes is True the node of each record is removed from the document 
+    and freed once parsed, so the document shrinks while the records are processed."""
     #I define some names for the tags before getting to the actual marcxml
     global_wrapper = 'collections'
     record_wrapper = 'collection'
-    record_version_wrapper = 'record'
     
-    #I define an XPATH handler
-    ctxt = domdoc.xpathNewContext()
+    #the tree is walked directly: evaluating an XPath for every node is much slower
+    #(the nodes are the raw ones of libxml2mod, without creating a python wrapper for each one)
+    root = domdoc.getRootElement()
+    if root is None or root.name != global_wrapper:
+        return
     #I select all the records (that are defined by the "collection" tag (maybe it's better to raname these tags in something like collection/record/recordversion to avoid misunderstanding)
-    retrieved_records = ctxt.xpathEval('/%s/%s'%(global_wrapper, record_wrapper))
-    #If I haven't found any record I return an empty bibrecord
-    if len(retrieved_records) == 0:
-        return {}
-    #else:
-    #    print 'found %s records' % len(retrieved_records)
-    
-    #global list for the records I retrieve
-    all_bibrecords = []
-        
+    #(the list is built before freeing any node)
+    retrieved_records = list(_iter_child_elements(root._o, record_wrapper))
     #If I have records, I process each record and then each version of the record
     for retrieved_record in retrieved_records:
-        #list for the versions of the record I find
-        bibrecord_versions = []
-        #I set the context node to the current one
-        ctxt.setContextNode(retrieved_record)
-        record_versions = ctxt.xpathEval(record_version_wrapper)
+        bibrecord_versions = _get_record_versions(retrieved_record)
+        if free_nodes:
+            libxml2mod.xmlUnlinkNode(retrieved_record)
+            libxml2mod.xmlFreeNode(retrieved_record)
         #if I have no record versions it's an empty instance so I can skip it
-        if len(record_versions) == 0:
+        if bibrecord_versions is not None:
+            yield bibrecord_versions
+
+def _iter_child_elements(node, name):
+    """Iterator over the children elements with a name of a raw libxml2mod node"""
+    child = libxml2mod.children(node)
+    while child is not None:
+        if libxml2mod.type(child) == 'element' and libxml2mod.name(child) == name:
+            yield child
+        child = libxml2mod.next(child)
+
+def _get_record_versions(retrieved_record):
+    """Returns the list of the versions of a record (None if the record has no version)"""
+    record_version_wrapper = 'record'
+    #list for the versions of the record I find
+    bibrecord_versions = []
+    record_versions = list(_iter_child_elements(retrieved_record, record_version_wrapper))
+    #if I have no record versions it's an empty instance so I can skip it
+    if len(record_versions) == 0:
+        return None
+    #otherwise I start to analize the single record version
+    for record_version in record_versions:
+        #I define a global counter  and the wrapper for all the record
+        field_position_global = 1
+        bibrecord_version = {}
+        
+        datafields = list(_iter_child_elements(record_version, 'datafield'))
+        #if I don't have any datafield it means that the record is empty and I can skip it
+        if len(datafields) == 0:
             continue
-        #otherwise I start to analize the single record version
-        for record_version in record_versions:
-            #I define a global counter  and the wrapper for all the record
-            field_position_global = 1
-            bibrecord_version = {}
-            
-            ctxt.setContextNode(record_version)
-            datafields = ctxt.xpathEval('datafield')
-            #if I don't have any datafield it means that the record is empty and I can skip it
-            if len(datafields) == 0:
+        #otherwise I can parse the datafields
+        for datafield in datafields:
+            #I extract infos at the datafield level
+            tag = libxml2mod.xmlGetProp(datafield, 'tag')
+            ind1 = libxml2mod.xmlGetProp(datafield, 'ind1')
+            ind2 = libxml2mod.xmlGetProp(datafield, 'ind2')
+            if tag is None or ind1 is None or ind2 is None:
+                #if something is missing from the XML I skip the field
                 continue
-            #otherwise I can parse the datafields
-            for datafield in datafields:
-                ctxt.setContextNode(datafield)
-                #I extract infos at the datafield level
-                try:
-                    tag = ctxt.xpathEval('@tag')[0].content#.encode('utf-8')
-                    ind1 = ctxt.xpathEval('@ind1')[0].content#.encode('utf-8')
-                    ind2 = ctxt.xpathEval('@ind2')[0].content#.encode('utf-8')
-                except IndexError:
-                    #if something is missing from the XML I skip the field
-                    continue
-                #I sanitaze the indicators
-                if ind1 == '':
-                    ind1 = ' '
-                if ind2 == '':
-                    ind2 = ' '
-                #I extract the subfields
-                subfields = ctxt.xpathEval('subfield')
-                if len(subfields) == 0:
+            #I sanitaze the indicators
+            if ind1 == '':
+                ind1 = ' '
+            if ind2 == '':
+                ind2 = ' '
+            #I extract the subfields
+            #I define a list where to store the subfields
+            bibrecord_subfields = []
+            has_subfields = False
+            for subfield in _iter_child_elements(datafield, 'subfield'):
+                has_subfields = True
+                code = libxml2mod.xmlGetProp(subfield, 'code')
+                if code is None:
                     continue
-                #I define a list where to store the subfields
-                bibrecord_subfields = []
-                for subfield in subfields:
-                    value = subfield.content#.encode('utf-8')
-                    ctxt.setContextNode(subfield)
-                    try:
-                        code = ctxt.xpathEval('@code')[0].content.encode('utf-8')
-                    except IndexError:
-                        continue
-                    #then I put the result inside the list of subfields
-                    bibrecord_subfields.append((code, value,))
-                #then I append the field to the main record
-                bibrecord_version.setdefault(tag, []).append((bibrecord_subfields, ind1, ind2, '', field_position_global,))
-                field_position_global += 1
-            #then I append the bibrecord version to the list of all the versions for this record
-            bibrecord_versions.append(bibrecord_version)
-        #finally I append all the versions of the same record to the list of records
-        all_bibrecords.append(bibrecord_versions)
-    
-    return all_bibrecords
-    
\ No newline at end of file
+                #then I put the result inside the list of subfields
+                bibrecord_subfields.append((code, libxml2mod.xmlNodeGetContent(subfield),))
+            if not has_subfields:
+                continue
+            #then I append the field to the main record (the subfields are indexed by code at the first lookup)
+            bibrecord_version.setdefault(tag, []).append((SubfieldList(bibrecord_subfields), ind1, ind2, '', field_position_global,))
+            field_position_global += 1
+        #then I append the bibrecord version to the list of all the versions for this record
+        bibrecord_versions.append(bibrecord_version)
+    return bibrecord_versions
@@ -27,12 +27,13 @@ This class uses multiprocessing, so it is compatible only with python 2.6+
 import sys
 sys.path.append('/proj/ads/soft/python/lib/site-packages')
 
-import inspect
 import multiprocessing
+import threading
+import Queue
 import libxml2
 import itertools
 import os
-import pickle
+import time
 
 from ads.ADSExports import ADSRecords
 
@@ -40,8 +41,12 @@ from invenio import bibrecord
 from invenio.bibtask import task_low_level_submission
 
 import pipeline_settings as settings
+from pipeline_log_functions import trace, get_resident_memory
 import pipeline_write_files as write_files
+import pipeline_group_scheduler
+import pipeline_upload_spool as upload_spool
 import misclibs.xml_transformer as xml_transformer
+import misclibs.ads_xml_converter as ads_xml_converter
 from merger.merger_errors import GenericError
 from merger import merger
 from pipeline_invenio_uploader import bibupload_merger
@@ -55,13 +60,15 @@ logger = logging.getLogger(pipeline_settings.LOGGING_GLOBAL_NAME)
 BIBCODES_TO_EXTRACT_LIST = []
 BIBCODES_TO_DELETE_LIST = []
 EXTRACTION_DIRECTORY = ''
+#the estimate of the extraction cost of the bibcodes
+COST_MODEL = pipeline_group_scheduler.CostModel()
 
 
+@trace(logger)
 def extract(bibcodes_to_extract_list, bibcodes_to_delete_list, file_to_upload_remaining, extraction_directory, upload_mode):
     """manager of the extraction"""
-    logger.info("In function %s" % (inspect.stack()[0][3],))
     
-    global EXTRACTION_DIRECTORY, BIBCODES_TO_DELETE_LIST, BIBCODES_TO_EXTRACT_LIST
+    global EXTRACTION_DIRECTORY, BIBCODES_TO_DELETE_LIST, BIBCODES_TO_EXTRACT_LIST, COST_MODEL
     #the bibcodes to extract MUST NOT be sorted
     BIBCODES_TO_EXTRACT_LIST = bibcodes_to_extract_list
     BIBCODES_TO_DELETE_LIST = bibcodes_to_delete_list
@@ -87,7 +94,14 @@ def extract(bibcodes_to_extract_list, bibcodes_to_delete_list, file_to_upload_re
     #part where the bibcode to extract (new or update) are processed
 
     #I split the list of bibcodes to process in multiple groups
-    bibtoprocess_splitted = grouper(settings.NUMBER_OF_BIBCODES_PER_GROUP, BIBCODES_TO_EXTRACT_LIST)
+    #(the groups are generated only when the manager puts them in the queue of the groups to process)
+    COST_MODEL = pipeline_group_scheduler.CostModel.load(settings.GROUP_COST_HISTORY)
+    if settings.ADAPTIVE_GROUP_SIZE:
+        #groups with about the same extraction cost, smaller at the end of the extraction
+        bibtoprocess_splitted = pipeline_group_scheduler.iter_groups(BIBCODES_TO_EXTRACT_LIST, COST_MODEL, settings.NUMBER_OF_BIBCODES_PER_GROUP, settings.NUMBER_WORKERS)
+    else:
+        bibtoprocess_splitted = grouper(settings.NUMBER_OF_BIBCODES_PER_GROUP, BIBCODES_TO_EXTRACT_LIST)
+    logger.info('%d bibcodes to extract' % len(BIBCODES_TO_EXTRACT_LIST))
 
     #I define a manager for the workers
     manager = multiprocessing.Process(target=extractor_manager_process, args=(bibtoprocess_splitted, file_to_upload_remaining, EXTRACTION_DIRECTORY, EXTRACTION_NAME, upload_mode))
@@ -106,15 +120,18 @@ def extract(bibcodes_to_extract_list, bibcodes_to_delete_list, file_to_upload_re
 
 
 def grouper(n, iterable):
-    """method to split a list in multiple groups"""
-    logger.info("In function %s" % (inspect.stack()[0][3],))
-    args = [iter(iterable)] * n
-    return list(([e for e in t if e != None] for t in itertools.izip_longest(*args)))
+    """generator that splits a list in groups of n elements"""
+    iterator = iter(iterable)
+    while True:
+        group = list(itertools.islice(iterator, n))
+        if not group:
+            return
+        yield group
 
 
+@trace(logger)
 def process_bibcodes_to_delete(extraction_directory, upload_mode):
     """method that creates the MarcXML for the bibcodes to delete"""
-    logger.info("In function %s" % (inspect.stack()[0][3],))
 
     #I create an unique file for all the bibcodes to delete:
     #I don't think it's necessary to split the content in groups, since the XML is really simple
@@ -169,9 +186,9 @@ def process_bibcodes_to_delete(extraction_directory, upload_mode):
         logger.error('Upload mode "%s" not supported! File not uploaded' % upload_mode)
     return True
 
+@trace(logger)
 def set_extraction_name():
     """Method that sets the name of the current extraction"""
-    logger.info("In function %s" % (inspect.stack()[0][3],))
 
     filepath = os.path.join(settings.BASE_OUTPUT_PATH, EXTRACTION_DIRECTORY, settings.EXTRACTION_FILENAME_LOG)
     file_obj = open(filepath,'r')
@@ -200,13 +217,13 @@ def set_extraction_name():
     return extraction_name
 
 
+@trace(logger)
 def extractor_manager_process(bibtoprocess_splitted, file_to_upload_remaining, extraction_directory, extraction_name, upload_mode):
     """Process that takes care of managing all the other worker processes
         this process also creates new worker processes when the existing ones reach the maximum number of groups of bibcode to process
     """
-    logger.info("In function %s" % (inspect.stack()[0][3],))
-    #a queue for the bibcodes to process
-    q_todo = multiprocessing.Queue()
+    #a queue for the bibcodes to process (bounded: the groups are put in the queue only when the workers need them)
+    q_todo = multiprocessing.Queue(settings.MAX_GROUPS_IN_QUEUE)
     #a queue for the bibcodes processed
     q_done = multiprocessing.Queue()
     #a queue for the bibcodes with problems
@@ -222,13 +239,15 @@ def extractor_manager_process(bibtoprocess_splitted, file_to_upload_remaining, e
     #a lock for the uploader processes to access the log of the uploaded files
     lock_donefiles = multiprocessing.Lock()
 
-    logger.info(multiprocessing.current_process().name + ' (Manager) Filling the queue with the tasks')
+    #in concurrent upload mode the merged records are passed to the upload workers through a spool in memory
+    #(and they can be written in a container instead of being pickled: bibupload reads only the pickled files)
+    if upload_mode == 'concurrent':
+        spool_directory = upload_spool.create_spool_directory(extraction_name)
+        file_format = settings.BIBRECORD_FILE_FORMAT
+    else:
+        spool_directory = None
+        file_format = 'pickle'
 
-    #I split all the bibcodes in groups of NUMBER_OF_BIBCODES_PER_GROUP and I put them in the todo queue
-    counter = 0 #I need the counter to uniquely identify each group
-    for grp in bibtoprocess_splitted:
-        counter += 1
-        q_todo.put([str(counter).zfill(7), grp])
     #I pre-fill the list of files to upload if there are some
     file_to_upload_remaining.sort()
     for file2up in file_to_upload_remaining:
@@ -247,12 +266,17 @@ def extractor_manager_process(bibtoprocess_splitted, file_to_upload_remaining, e
     logger.info(multiprocessing.current_process().name + ' (Manager) Creating the upload workers')
     upload_processes = [multiprocessing.Process(target=upload_process, args=(q_uplfile, lock_stdout, lock_donefiles, q_life, extraction_directory, extraction_name, upload_mode)) for i in range(settings.NUMBER_UPLOAD_WORKER)]
     
+    #I compile the stylesheet before forking, so that the workers inherit it
+    if settings.ADS_XML_CONVERTER != 'native':
+        xml_transformer.get_stylesheet(settings.STYLESHEET_PATH)
+
     logger.info(multiprocessing.current_process().name + ' (Manager) Creating the first pool of workers')
     #I define the worker processes
-    processes = [multiprocessing.Process(target=extractor_process, args=(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_createdfiles, q_life, extraction_directory, extraction_name)) for i in range(number_of_processes)]
-    #I append to the todo queue a list of commands to stop the worker processes
-    for i in range(number_of_processes):
-        q_todo.put(['STOP', ''])
+    processes = [multiprocessing.Process(target=extractor_process, args=(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_createdfiles, q_life, extraction_directory, extraction_name, spool_directory, file_format)) for i in range(number_of_processes)]
+    #I define the thread that fills the todo queue with the groups of bibcodes and then with the commands to stop the worker processes
+    producer_stats = {'groups': 0, 'error': None}
+    producer = threading.Thread(target=fill_todo_queue, args=(q_todo, bibtoprocess_splitted, number_of_processes, producer_stats))
+    producer.daemon = True
 
 
     logger.warning(multiprocessing.current_process().name + ' (Manager) Starting all the workers')
@@ -266,6 +290,9 @@ def extractor_manager_process(bibtoprocess_splitted, file_to_upload_remaining, e
     #I start the worker processes
     for p in processes:
         p.start()
+    #and then the thread that gives them the groups to process
+    logger.info(multiprocessing.current_process().name + ' (Manager) Filling the queue with the tasks')
+    producer.start()
     
     #then I have to wait for the workers that have to tell me if they reached the maximum amount of chunk to process or if the extraction ended
     #in the first case I have to start another process
@@ -273,12 +300,21 @@ def extractor_manager_process(bibtoprocess_splitted, file_to_upload_remaining, e
     active_workers = settings.NUMBER_WORKERS
     active_upload_workers = settings.NUMBER_UPLOAD_WORKER
     additional_workers = 2
+    #statistics of all the extraction workers
+    all_workers_stats = {'workers': 0, 'startup': 0.0, 'groups': 0, 'bibcodes': 0, 'processing': 0.0}
+    all_timings = {}
     while active_workers > 0 or additional_workers > 0 or active_upload_workers > 0:
         #I get the message from the worker
         death_reason = q_life.get()
+        #the extraction workers send their statistics
+        if death_reason[0] in ('MAX LIFE REACHED', 'QUEUE EMPTY'):
+            all_workers_stats['workers'] += 1
+            for key in ('startup', 'groups', 'bibcodes', 'processing'):
+                all_workers_stats[key] += death_reason[1][key]
+            pipeline_group_scheduler.add_timings(all_timings, death_reason[1]['timings'])
         #if the reason of the death is that the process reached the max number of groups to process, then I have to start another one
         if death_reason[0] == 'MAX LIFE REACHED':
-            newprocess = multiprocessing.Process(target=extractor_process, args=(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_createdfiles, q_life, extraction_directory, extraction_name))
+            newprocess = multiprocessing.Process(target=extractor_process, args=(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_createdfiles, q_life, extraction_directory, extraction_name, spool_directory, file_format))
             newprocess.start()
             processes.append(newprocess)
             #!!!!!!!!!!!!!!!!!!!!!!!!
@@ -304,13 +340,54 @@ def extractor_manager_process(bibtoprocess_splitted, file_to_upload_remaining, e
             active_upload_workers = active_upload_workers - 1
             logger.info(multiprocessing.current_process().name + ' (Manager) %s upload workers waiting to finish their job' % str(active_upload_workers))
 
+    #the thread that fills the todo queue must be done (unless the workers stopped before the end of the queue)
+    producer.join(1)
+    if producer.is_alive():
+        logger.error(multiprocessing.current_process().name + ' (Manager) The workers stopped before processing all the groups of bibcodes')
+        q_todo.cancel_join_thread()
+    elif producer_stats['error'] is not None:
+        logger.error(multiprocessing.current_process().name + ' (Manager) Error generating the groups of bibcodes: %s' % producer_stats['error'])
+    logger.info(multiprocessing.current_process().name + ' (Manager) %d groups of bibcodes put in the queue' % producer_stats['groups'])
+    if all_workers_stats['workers'] > 0:
+        logger.warning(multiprocessing.current_process().name + ' (Manager) %d extraction workers. Average startup %.3f s. Total: %s' % (all_workers_stats['workers'], all_workers_stats['startup'] / all_workers_stats['workers'], format_worker_stats(all_workers_stats)))
+    #I update the timing history used to estimate the cost of the groups in the next extractions
+    if settings.GROUP_COST_HISTORY is not None and all_timings:
+        COST_MODEL.add_timings(all_timings)
+        try:
+            COST_MODEL.save(settings.GROUP_COST_HISTORY)
+        except GenericError:
+            logger.warning(multiprocessing.current_process().name + ' (Manager) Timing history not updated')
+    #I free the stylesheet compiled before forking the workers
+    xml_transformer.free_stylesheets()
+    #I remove the spool (with the records of the upload workers that eventually failed)
+    if spool_directory is not None:
+        upload_spool.remove_spool_directory(extraction_name)
     logger.info(multiprocessing.current_process().name + ' (Manager) All the workers are done. Exiting...')
 
 
-def extractor_process(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_createdfiles, q_life, extraction_directory, extraction_name):
+def fill_todo_queue(q_todo, bibtoprocess_splitted, number_of_processes, producer_stats):
+    """Function of the thread of the manager that puts the groups of bibcodes in the todo queue as they are generated,
+        and then the commands to stop the worker processes: when the queue is full it waits for the workers to take some groups.
+        It doesn't log anything (the logging lock could be inherited locked by the workers started in the meanwhile):
+        the number of groups and the eventual error are stored in producer_stats"""
+    try:
+        for grp in bibtoprocess_splitted:
+            #I need the counter to uniquely identify each group
+            producer_stats['groups'] += 1
+            q_todo.put([str(producer_stats['groups']).zfill(7), grp])
+    except Exception, error:
+        #without the stop commands the workers would wait forever
+        producer_stats['error'] = '%s: %s' % (type(error).__name__, error)
+    for i in range(number_of_processes):
+        q_todo.put(['STOP', ''])
+
+def extractor_process(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_createdfiles, q_life, extraction_directory, extraction_name, spool_directory, file_format):
     """Worker function for the extraction of bibcodes from ADS
-        it has been defined outside any class because it's more simple to treat with multiprocessing """
+        it has been defined outside any class because it's more simple to treat with multiprocessing
+        if spool_directory is not None the merged records are passed to the upload workers through the spool
+        file_format is the format of the files of merged records ('container' or 'pickle') """
     logger.warning(multiprocessing.current_process().name + ' (worker) Process started')
+    start_time = time.time()
     #I create a local logger
     fh = logging.FileHandler(os.path.join(pipeline_settings.BASE_OUTPUT_PATH, extraction_directory, pipeline_settings.BASE_LOGGING_PATH, multiprocessing.current_process().name+'_worker.log'))
     fmt = logging.Formatter(pipeline_settings.LOGGING_FORMAT)
@@ -325,13 +402,29 @@ def extractor_process(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_crea
     #I remove the automatic join from the queue of the files to upload
     q_uplfile.cancel_join_thread()
     
-    #I get the maximum number of groups I can process
+    #I get the maximum number of groups I can process (None if there is no limit) and the maximum memory I can use
     max_num_groups = settings.MAX_NUMBER_OF_GROUP_TO_PROCESS
+    max_rss = settings.WORKER_MAX_RSS_MB * 1024 * 1024
     #variable used to know if I'm exiting because the queue is empty or because I reached the maximum number of groups to process
     queue_empty = False
-
-    #while there is something to process or I reach the maximum number of groups I can process,  I try to process
-    for grpnum in range(max_num_groups):
+    #I define the transformation object used for all the groups (the stylesheet is compiled only once per worker)
+    transf = xml_transformer.XmlTransformer(local_logger)
+    if settings.ADS_XML_CONVERTER != 'native':
+        transf.init_stylesheet()
+    #when the spool is used the files for the recovery are written on disk by a thread, outside the processing of the groups
+    recovery_writer = None
+    if spool_directory is not None:
+        q_recovery = Queue.Queue(settings.MAX_RECOVERY_FILES_IN_QUEUE)
+        writer_stats = {'error': None}
+        recovery_writer = threading.Thread(target=recovery_file_writer, args=(q_recovery, q_done, lock_createdfiles, extraction_directory, writer_stats, local_logger))
+        recovery_writer.daemon = True
+        recovery_writer.start()
+    #statistics of the worker, passed to the manager when exiting
+    worker_stats = {'startup': time.time() - start_time, 'groups': 0, 'bibcodes': 0, 'processing': 0.0, 'timings': {}}
+    local_logger.warning(multiprocessing.current_process().name + ' Ready to process groups (startup in %.3f s)' % worker_stats['startup'])
+
+    #while there is something to process, until I use too much memory or I reach the maximum number of groups I can process, I try to process
+    while max_num_groups is None or worker_stats['groups'] < max_num_groups:
 
         task_todo = q_todo.get()
         if task_todo[0] == 'STOP':
@@ -342,12 +435,15 @@ def extractor_process(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_crea
 
         #I print when I'm starting the extraction
         local_logger.warning(multiprocessing.current_process().name + (' starting to process group %s' % task_todo[0]))
+        group_start_time = time.time()
 
         ############
         #then I process the bibcodes
         # I define a couple of lists where to store the bibcodes processed
         bibcodes_ok = []
         bibcodes_probl = []
+        #path of the records in the spool (if used)
+        spool_path = None
 
         #I define a ADSEXPORT object
         recs = ADSRecords('full', 'XML')
@@ -388,19 +484,24 @@ def extractor_process(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_crea
         xmlobj = recs.export()
         del recs
 
-        try:
-            #I define a transformation object
-            transf = xml_transformer.XmlTransformer(local_logger)
-            #and I transform my object
-            marcxml = transf.transform(xmlobj)
-        except:
-            err_msg = ' Impossible to transform the XML!'
-            local_logger.critical(err_msg)
-            raise GenericError(err_msg)
-
-        if marcxml:
-            #I merge the records
-            merged_records, records_with_merging_probl = merger.merge_records_xml(marcxml)
+        if settings.ADS_XML_CONVERTER == 'native':
+            #I convert my object directly to bibrecords (the converted records are freed from the object)
+            bibrecords = ads_xml_converter.iter_records_from_ads_xml(xmlobj, local_logger, free_nodes=True)
+        else:
+            try:
+                #I transform my object
+                marcxml = transf.transform(xmlobj)
+            except:
+                err_msg = ' Impossible to transform the XML!'
+                local_logger.critical(err_msg)
+                raise GenericError(err_msg)
+            #the records are parsed one at a time (and freed from the marcxml object)
+            bibrecords = marcxml and xml_transformer.iter_records_from_libxml_obj(marcxml, local_logger, free_nodes=True)
+
+        if bibrecords:
+            #I merge the records one at a time
+            records_with_merging_probl = []
+            merged_records = list(merger.iter_merge_bibrecords(bibrecords, records_with_merging_probl))
             #If I had problems to merge some records I remove the bibcodes from the list "bibcodes_ok" and I add them to "bibcodes_probl"
             for elem in records_with_merging_probl:
                 try:
@@ -414,18 +515,23 @@ def extractor_process(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_crea
             #I write the object in a file
             ##########
             filepath = os.path.join(settings.BASE_OUTPUT_PATH, extraction_directory, pipeline_settings.BASE_BIBRECORD_FILES_DIR, pipeline_settings.BIBREC_FILE_BASE_NAME+'_'+extraction_name+'_'+task_todo[0])
-            output = open(filepath, 'wb')
-            pickle.dump(merged_records, output)
-            output.close()
-            #then I write the filepath to a file for eventual future recovery
-            lock_createdfiles.acquire()
-            bibrec_file_obj = open(os.path.join(settings.BASE_OUTPUT_PATH, extraction_directory,settings.LIST_BIBREC_CREATED), 'a')
-            bibrec_file_obj.write(filepath + '\n')
-            bibrec_file_obj.close()
-            lock_createdfiles.release()
-            #finally I append the file to the queue
-            local_logger.info('Insert in queue for upload the file "%s" of the group "%s" ' % (filepath, task_todo[0]))
-            q_uplfile.put((task_todo[0],filepath))
+            #I serialize the records only once
+            data = upload_spool.serialize_records(merged_records, file_format)
+            del merged_records
+            #if there is space in the spool, I pass the records to the upload workers through it
+            spool_path = upload_spool.write_spool(spool_directory, os.path.basename(filepath), data)
+            if spool_path is not None:
+                local_logger.info('Insert in queue for upload the spool "%s" of the group "%s" ' % (spool_path, task_todo[0]))
+                q_uplfile.put((task_todo[0], filepath, spool_path))
+                #the file for the recovery is written by the thread, that marks the bibcodes as done only once the file is registered
+                #(if I die before, the bibcodes are extracted again)
+                q_recovery.put((task_todo[0], filepath, data, bibcodes_ok))
+            else:
+                #otherwise I write the file and then I append it to the queue
+                write_recovery_file(filepath, data, lock_createdfiles, extraction_directory)
+                local_logger.info('Insert in queue for upload the file "%s" of the group "%s" ' % (filepath, task_todo[0]))
+                q_uplfile.put((task_todo[0],filepath))
+            del data
             
             #logger.info('record created, merged but not uploaded')
             #bibupload_merger(merged_records, local_logger, 'replace_or_insert')
@@ -437,33 +543,97 @@ def extractor_process(q_todo, q_done, q_probl, q_uplfile, lock_stdout, lock_crea
             bibcodes_ok = []
         
         
-        #finally I pass to the done bibcodes to the proper file
-        q_done.put([task_todo[0], bibcodes_ok])
+        #finally I pass to the done bibcodes to the proper file (if the thread writing the file for the recovery doesn't do it)
+        if spool_path is None:
+            q_done.put([task_todo[0], bibcodes_ok])
         #and the problematic bibcodes
         q_probl.put([task_todo[0], bibcodes_probl])
+        if recovery_writer is not None and writer_stats['error'] is not None:
+            raise GenericError(writer_stats['error'])
+
+        group_time = time.time() - group_start_time
+        worker_stats['groups'] += 1
+        worker_stats['bibcodes'] += len(task_todo[1])
+        worker_stats['processing'] += group_time
+        pipeline_group_scheduler.add_timings(worker_stats['timings'], COST_MODEL.get_group_timings(task_todo[1], group_time))
+        local_logger.warning(multiprocessing.current_process().name + (' finished to process group %s (%d bibcodes in %.1f s)' % (task_todo[0], len(task_todo[1]), group_time)))
+
+        #if I'm using too much memory I stop here and the manager replaces me with a new worker
+        rss = get_resident_memory()
+        if rss is not None and rss > max_rss:
+            local_logger.warning(multiprocessing.current_process().name + ' Resident memory of %d MB above the limit of %d MB' % (rss / (1024 * 1024), settings.WORKER_MAX_RSS_MB))
+            break
 
-        local_logger.warning(multiprocessing.current_process().name + (' finished to process group %s' % task_todo[0]))
-
+    #I wait for the files for the recovery still to write
+    if recovery_writer is not None:
+        q_recovery.put(None)
+        recovery_writer.join()
+        if writer_stats['error'] is not None:
+            raise GenericError(writer_stats['error'])
+    local_logger.warning(multiprocessing.current_process().name + ' ' + format_worker_stats(worker_stats))
     if queue_empty:
         #I tell the output processes that I'm done
         local_logger.info('Telling the queue of done and problematic bibcodes that the queue is empty')
         q_done.put(['WORKER DONE'])
         q_probl.put(['WORKER DONE'])
         #I tell the manager that I'm dying because the queue is empty
-        q_life.put(['QUEUE EMPTY'])
+        q_life.put(['QUEUE EMPTY', worker_stats])
         #I set a variable to skip the messages outside the loop
         lock_stdout.acquire()
         logger.warning(multiprocessing.current_process().name + ' (worker) Queue empty: exiting (pid #%s)' % os.getpid())
         lock_stdout.release()
         local_logger.warning(multiprocessing.current_process().name + ' Queue empty: exiting')
     else:
-        #I tell the manager that I'm dying because I reached the maximum amount of group to process
-        q_life.put(['MAX LIFE REACHED'])
-        logger.warning(multiprocessing.current_process().name + ' (worker) Maximum amount of groups of bibcodes reached: exiting (pid #%s)' % os.getpid())
-        local_logger.warning(multiprocessing.current_process().name + ' Maximum amount of groups of bibcodes reached: exiting')
+        #I tell the manager that I'm dying because I reached the maximum amount of memory or of groups to process
+        q_life.put(['MAX LIFE REACHED', worker_stats])
+        logger.warning(multiprocessing.current_process().name + ' (worker) Maximum amount of memory or of groups of bibcodes reached: exiting (pid #%s)' % os.getpid())
+        local_logger.warning(multiprocessing.current_process().name + ' Maximum amount of memory or of groups of bibcodes reached: exiting')
+    #I free the stylesheet compiled by the worker
+    xml_transformer.free_stylesheets()
     return
 
 
+def write_recovery_file(filepath, data, lock_createdfiles, extraction_directory):
+    """Writes the serialized records in the file for the recovery and registers the file in the list of the files created"""
+    output = open(filepath, 'wb')
+    output.write(data)
+    output.close()
+    #then I write the filepath to a file for eventual future recovery
+    lock_createdfiles.acquire()
+    try:
+        bibrec_file_obj = open(os.path.join(settings.BASE_OUTPUT_PATH, extraction_directory,settings.LIST_BIBREC_CREATED), 'a')
+        bibrec_file_obj.write(filepath + '\n')
+        bibrec_file_obj.close()
+    finally:
+        lock_createdfiles.release()
+
+def recovery_file_writer(q_recovery, q_done, lock_createdfiles, extraction_directory, writer_stats, local_logger):
+    """Function of the thread of an extraction worker that writes the files for the recovery of the groups passed through the spool:
+        the bibcodes of a group are marked as done only after its file is registered.
+        After the first error (stored in writer_stats) the groups are only taken from the queue, until it gets None"""
+    while True:
+        recovery_todo = q_recovery.get()
+        if recovery_todo is None:
+            return
+        if writer_stats['error'] is not None:
+            continue
+        group, filepath, data, bibcodes_ok = recovery_todo
+        try:
+            write_recovery_file(filepath, data, lock_createdfiles, extraction_directory)
+        except (IOError, OSError), error:
+            writer_stats['error'] = 'Impossible to write the file "%s" for the recovery of the group "%s": %s' % (filepath, group, error)
+            local_logger.critical(writer_stats['error'])
+            continue
+        q_done.put([group, bibcodes_ok])
+
+def format_worker_stats(worker_stats):
+    """Returns a string with the startup time and the throughput of one or more extraction workers"""
+    if worker_stats['processing'] > 0:
+        throughput = '%.1f bibcodes/s' % (worker_stats['bibcodes'] / worker_stats['processing'])
+    else:
+        throughput = 'no throughput'
+    return 'Startup %.3f s, %d groups, %d bibcodes processed in %.1f s (%s)' % (worker_stats['startup'], worker_stats['groups'], worker_stats['bibcodes'], worker_stats['processing'], throughput)
+
 def done_extraction_process(q_done, num_active_workers, lock_stdout, q_life, extraction_directory):
     """Worker that takes care of the groups of bibcodes processed and writes the bibcodes to the related file
         NOTE: this can be also the process that submiths the upload processes to invenio
@@ -565,7 +735,7 @@ def upload_process(q_uplfile, lock_stdout, lock_donefiles, q_life, extraction_di
     
     while(True):
         file_to_upload = q_uplfile.get()
-        if len(file_to_upload) == 2:
+        if len(file_to_upload) >= 2:
             local_logger.info('Processing group "%s" with file "%s"' % (file_to_upload[0], file_to_upload[1]))
         else:
             local_logger.info('Message in queue "%s" ' % file_to_upload[0])
@@ -581,11 +751,12 @@ def upload_process(q_uplfile, lock_stdout, lock_donefiles, q_life, extraction_di
                 logger.error('Received the unexpected message "%s" from upload queue.' % file_to_upload[0])
                 break
             if upload_mode == 'concurrent':
-                file_obj = open(filepath, 'rb')
-                # I load the object in the file
+                # I read the records from the spool (that is removed) or from the file while uploading them
                 local_logger.warning('Upload of the group "%s" started' % file_to_upload[0])
-                merged_records = pickle.load(file_obj)
-                file_obj.close()
+                if len(file_to_upload) == 3:
+                    merged_records = upload_spool.read_spool(file_to_upload[2])
+                else:
+                    merged_records = upload_spool.iter_records(filepath)
                 #finally I upload
                 bibupload_merger(merged_records, local_logger, 'replace_or_insert')
                 #I log that I uploaded the file
@@ -596,6 +767,9 @@ def upload_process(q_uplfile, lock_stdout, lock_donefiles, q_life, extraction_di
                 local_logger.warning('Upload of the group "%s" ended' % file_to_upload[0])
                 del merged_records
             elif upload_mode == 'bibupload':
+                #the files of a previous extraction in concurrent mode can be containers
+                if upload_spool.convert_to_pickle(filepath):
+                    local_logger.warning('File "%s" converted to pickle for bibupload.' % filepath)
                 task_low_level_submission('bibupload', 'admin', '-i', '-r', '--pickled-input-file', '--update-mode', filepath)
                 with open(os.path.join(settings.BASE_OUTPUT_PATH, extraction_directory,settings.LIST_BIBREC_UPLOADED), 'a') as bibrec_file_obj:
                     bibrec_file_obj.write(filepath + '\n')
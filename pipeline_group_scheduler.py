@@ -0,0 +1,188 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Scheduler of the groups of bibcodes to extract.
+
+The cost of the extraction of a bibcode changes a lot with the bibcode:
+old scanned articles are cheap, recent papers with long lists of references
+are expensive. The cost of each bibcode is estimated from its year and its
+journal (the first 9 characters of the bibcode), with the times measured in the
+previous extractions, or from the table BIBCODE_COST_BY_YEAR when there is no history.
+
+The bibcodes are split (without changing their order) in groups with about the
+same estimated cost, and the groups get smaller at the end of the list, so that
+all the workers finish at about the same time.
+"""
+
+import os
+
+import pipeline_settings as settings
+from merger.merger_errors import GenericError
+
+#I get the global logger
+import logging
+logger = logging.getLogger(settings.LOGGING_GLOBAL_NAME)
+
+#length of the part of the bibcode (year and journal) that defines its cost
+COST_KEY_LENGTH = 9
+
+def get_cost_keys(bibcode):
+    """Returns the keys of the timing history for a bibcode:
+    the year plus the journal, then the year"""
+    return (bibcode[:COST_KEY_LENGTH], bibcode[:4])
+
+def get_default_cost(bibcode):
+    """Returns the cost of a bibcode from the table of the costs by publication year"""
+    try:
+        year = int(bibcode[:4])
+    except ValueError:
+        #without a valid year I assume the highest cost
+        return max(cost for first_year, cost in settings.BIBCODE_COST_BY_YEAR)
+    default_cost = settings.BIBCODE_COST_BY_YEAR[0][1]
+    for first_year, cost in settings.BIBCODE_COST_BY_YEAR:
+        if year < first_year:
+            break
+        default_cost = cost
+    return default_cost
+
+def add_timings(timings, new_timings):
+    """Adds the timings in new_timings ({key: [seconds, bibcodes]}) to timings"""
+    for key, (seconds, bibcodes) in new_timings.iteritems():
+        timing = timings.get(key)
+        if timing is None:
+            timings[key] = [seconds, bibcodes]
+        else:
+            timing[0] += seconds
+            timing[1] += bibcodes
+
+class CostModel(object):
+    """Estimate of the extraction time of the bibcodes"""
+    def __init__(self, timings=None):
+        #timing history: {key: [seconds, bibcodes]}
+        if timings is None:
+            timings = {}
+        self.timings = timings
+        #the estimates depend only on the year and the journal: I keep them for each year plus journal
+        self.estimates = {}
+
+    def estimate(self, bibcode):
+        """Returns the estimated extraction time of a bibcode"""
+        try:
+            return self.estimates[bibcode[:COST_KEY_LENGTH]]
+        except KeyError:
+            cost = self._estimate(bibcode)
+            self.estimates[bibcode[:COST_KEY_LENGTH]] = cost
+            return cost
+
+    def _estimate(self, bibcode):
+        """Computes the estimated extraction time of a bibcode"""
+        for key in get_cost_keys(bibcode):
+            timing = self.timings.get(key)
+            if timing is not None and timing[1] >= settings.BIBCODE_COST_MIN_SAMPLES:
+                return timing[0] / timing[1]
+        return get_default_cost(bibcode)
+
+    def get_group_timings(self, bibcodes, seconds):
+        """Returns the timings of a group of bibcodes extracted in the given time:
+        the time is split among the bibcodes according to their estimated cost"""
+        costs = [self.estimate(bibcode) for bibcode in bibcodes]
+        total_cost = sum(costs)
+        group_timings = {}
+        if total_cost <= 0:
+            return group_timings
+        for bibcode, cost in zip(bibcodes, costs):
+            bibcode_seconds = seconds * cost / total_cost
+            for key in get_cost_keys(bibcode):
+                timing = group_timings.get(key)
+                if timing is None:
+                    group_timings[key] = [bibcode_seconds, 1]
+                else:
+                    timing[0] += bibcode_seconds
+                    timing[1] += 1
+        return group_timings
+
+    def add_timings(self, new_timings):
+        """Adds new timings to the history"""
+        add_timings(self.timings, new_timings)
+        self.estimates.clear()
+
+    @classmethod
+    def load(cls, filepath):
+        """Returns the model with the timing history in the file (an empty history if the file doesn't exist)"""
+        timings = {}
+        if filepath is None or not os.path.exists(filepath):
+            return cls(timings)
+        try:
+            with open(filepath) as history_file:
+                for line in history_file:
+                    key, seconds, bibcodes = line.rstrip('\n').split('\t')
+                    timings[key] = [float(seconds), int(bibcodes)]
+        except (IOError, ValueError), error:
+            #the history only improves the estimates: I can go on without it
+            logger.error('Impossible to read the timing history "%s": %s' % (filepath, error))
+            timings = {}
+        return cls(timings)
+
+    def save(self, filepath):
+        """Writes the timing history in the file"""
+        temp_filepath = filepath + '.tmp'
+        try:
+            with open(temp_filepath, 'w') as history_file:
+                for key in sorted(self.timings):
+                    seconds, bibcodes = self.timings[key]
+                    history_file.write('%s\t%r\t%d\n' % (key, seconds, bibcodes))
+            os.rename(temp_filepath, filepath)
+        except (IOError, OSError), error:
+            err_msg = 'Impossible to write the timing history "%s": %s' % (filepath, error)
+            logger.error(err_msg)
+            raise GenericError(err_msg)
+
+def make_groups(bibcodes, cost_model, group_size, number_of_workers):
+    """Returns the list of the groups of iter_groups"""
+    return list(iter_groups(bibcodes, cost_model, group_size, number_of_workers))
+
+def iter_groups(bibcodes, cost_model, group_size, number_of_workers):
+    """Generator that splits the bibcodes (without changing their order) in groups with about the same estimated cost
+    and at most group_size bibcodes. The cost of a full group is the average cost of group_size bibcodes;
+    at the end of the list the groups are split: each group costs at most half of the remaining cost
+    divided by the number of workers (and at least GROUP_TAIL_MIN_FRACTION of a full group)"""
+    if len(bibcodes) == 0:
+        return
+    total_cost = sum(cost_model.estimate(bibcode) for bibcode in bibcodes)
+    number_of_full_groups = (len(bibcodes) + group_size - 1) // group_size
+    full_group_cost = total_cost / number_of_full_groups
+    min_group_cost = full_group_cost * settings.GROUP_TAIL_MIN_FRACTION
+    remaining_cost = total_cost
+
+    group = []
+    group_cost = 0.0
+    max_group_cost = _get_max_group_cost(remaining_cost, full_group_cost, min_group_cost, number_of_workers)
+    for bibcode in bibcodes:
+        cost = cost_model.estimate(bibcode)
+        #I close the group if it's full (the tolerance avoids to close the groups one bibcode earlier because of rounding)
+        if group and (len(group) >= group_size or group_cost + cost > max_group_cost * (1 + 1e-9)):
+            yield group
+            remaining_cost -= group_cost
+            group = []
+            group_cost = 0.0
+            max_group_cost = _get_max_group_cost(remaining_cost, full_group_cost, min_group_cost, number_of_workers)
+        group.append(bibcode)
+        group_cost += cost
+    yield group
+
+def _get_max_group_cost(remaining_cost, full_group_cost, min_group_cost, number_of_workers):
+    """Returns the maximum cost of the next group"""
+    return min(full_group_cost, max(min_group_cost, remaining_cost / (2 * number_of_workers)))
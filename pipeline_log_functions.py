@@ -20,8 +20,11 @@ File containing global functions
 import sys
 import os
 import time
+import inspect
+import logging
+from functools import wraps
 
-from pipeline_settings import VERBOSE
+from pipeline_settings import VERBOSE, TRACE_FUNCTIONS
 
 def msg(message, verbose=VERBOSE):
     """
@@ -32,12 +35,22 @@ def msg(message, verbose=VERBOSE):
         print time.strftime("%Y-%m-%d %H:%M:%S"), '---', message
 
 
+def get_resident_memory():
+    """Returns the resident memory (RSS) of the current process in bytes,
+    read from /proc/self/statm (None where it is not available)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
 def manage_check_error(msg_str, type_check, logger):
     """function that prints a warning or 
     raises an exception according to the type of check"""
     from merger.merger_errors import GenericError
     if type_check == 'warnings':
-        logger.warning('          CHECK WARNING: %s' % msg_str)
+        logger.warning('          CHECK WARNING: %s', msg_str)
     elif type_check == 'errors':
         logger.critical(msg_str)
         raise GenericError(msg_str)
@@ -45,4 +58,106 @@ def manage_check_error(msg_str, type_check, logger):
         error_string = 'Type of check "%s" cannot be handled by the "manage_check_error" function.' % type_check 
         logger.critical(error_string)
         raise GenericError(error_string)
-    return None
\ No newline at end of file
+    return None
+
+class SilentLogger(object):
+    """logger that drops the debug and info messages and passes all the others to a real logger"""
+    def __init__(self, logger):
+        self.logger = logger
+
+    def debug(self, *args, **kwargs):
+        pass
+
+    info = debug
+
+    def isEnabledFor(self, level):
+        return level > logging.INFO and self.logger.isEnabledFor(level)
+
+    def __getattr__(self, name):
+        return getattr(self.logger, name)
+
+def get_logger(name, silent=False):
+    """returns the logger with the given name: if silent is True the debug and info messages are dropped
+    without even looking at the logging configuration"""
+    logger = logging.getLogger(name)
+    if silent:
+        return SilentLogger(logger)
+    return logger
+
+def trace(logger, enabled=None):
+    """decorator that logs the entry and the exit of a function with the time spent in it.
+    If the tracing is disabled (TRACE_FUNCTIONS) the function is returned as it is, so it costs nothing.
+    The generator functions are traced while they are iterated, until they are exhausted or closed."""
+    if enabled is None:
+        enabled = TRACE_FUNCTIONS
+    def decorator(function):
+        if not enabled:
+            return function
+        call_traced = _get_call_traced(function)
+        @wraps(function)
+        def traced(*args, **kwargs):
+            return call_traced(logger, function.__name__, function, args, kwargs)
+        return traced
+    return decorator
+
+def trace_method(function=None, enabled=None):
+    """decorator like trace for the methods of the objects that have their logger in self.logger"""
+    if enabled is None:
+        enabled = TRACE_FUNCTIONS
+    def decorator(function):
+        if not enabled:
+            return function
+        call_traced = _get_call_traced(function)
+        @wraps(function)
+        def traced(self, *args, **kwargs):
+            name = '%s.%s' % (self.__class__.__name__, function.__name__)
+            return call_traced(self.logger, name, function, (self,) + args, kwargs)
+        return traced
+    if function is not None:
+        return decorator(function)
+    return decorator
+
+def _call_traced(logger, name, function, args, kwargs):
+    """calls a function logging its entry and exit"""
+    if not logger.isEnabledFor(logging.INFO):
+        return function(*args, **kwargs)
+    logger.info("In function %s", name)
+    start = time.time()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        logger.info("Out of function %s (%.3f s)", name, time.time() - start)
+
+def _get_call_traced(function):
+    """returns the function that calls a traced function: the generators are timed while they are iterated"""
+    if inspect.isgeneratorfunction(function):
+        return _call_traced_generator
+    return _call_traced
+
+def _call_traced_generator(logger, name, function, args, kwargs):
+    """calls a generator function: the generator returned logs its entry and exit"""
+    if not logger.isEnabledFor(logging.INFO):
+        return function(*args, **kwargs)
+    return _iter_traced(logger, name, function(*args, **kwargs))
+
+def _iter_traced(logger, name, generator):
+    """iterates over a generator logging the entry (the first iteration) and the exit
+    (when the generator is exhausted or closed) with the time spent in the generator only"""
+    logger.info("In function %s", name)
+    elapsed = 0.0
+    try:
+        while True:
+            start = time.time()
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.time() - start
+            yield item
+    finally:
+        #the generator is closed if the iteration is interrupted
+        start = time.time()
+        generator.close()
+        elapsed += time.time() - start
+        logger.info("Out of function %s (%.3f s)", name, elapsed)
@@ -32,15 +32,17 @@ Finally I lunch the manager with the entire list of bibcodes to extract
 import os
 import sys
 from time import strftime
-import inspect
 import shutil
 
 sys.path.append('/proj/ads/soft/python/lib/site-packages')
 from ads import Looker
 
 import pipeline_settings as settings
+from pipeline_log_functions import trace
 import pipeline_ads_record_extractor
+import pipeline_upload_spool as upload_spool
 from merger.merger_errors import GenericError
+from misclibs.bibcode_set import BibcodeSet, read_bibcodes
 import pipeline_timestamp_manager
 import pipeline_settings
 
@@ -53,13 +55,15 @@ logger = logging.getLogger(pipeline_settings.LOGGING_GLOBAL_NAME)
 DIRNAME = ''
 LATEST_EXTR_DIR = ''
 MODE = ''
+UPLOAD_MODE = ''
 
+@trace(logger)
 def manage(mode, upload_mode, norecover=False):
     """public function"""
-    logger.info("In function %s" % (inspect.stack()[0][3],))
     
-    global MODE
+    global MODE, UPLOAD_MODE
     MODE = mode
+    UPLOAD_MODE = upload_mode
     
     #If there is a wrong mode, I will raise an exception
     if mode != 'full' and mode != 'update':
@@ -72,11 +76,26 @@ def manage(mode, upload_mode, norecover=False):
         (bibcodes_to_extract_list, bibcodes_to_delete_list, file_to_upload_list) = retrieve_bibcodes_to_extract()
         #call the extractor manager
         pipeline_ads_record_extractor.extract(bibcodes_to_extract_list, bibcodes_to_delete_list, file_to_upload_list, DIRNAME, upload_mode)
+        #if some bibcodes have not been processed (e.g. a worker stopped after too many errors)
+        #the next run recovers the extraction and commits the snapshot at its end
+        bibcodes_pending = extr_diff_bibs_from_extraction(os.path.join(settings.BASE_OUTPUT_PATH, DIRNAME))[0]
+        if bibcodes_pending:
+            logger.warning('%d bibcodes not processed: the snapshot of the timestamps will be committed by the recovery of the extraction' % len(bibcodes_pending))
+            return
+        #the extraction is complete: the snapshot of the timestamps becomes the reference for the next update
+        #(the bibcodes with problems and the ones not uploaded will be extracted again)
+        bibcodes_probl = read_bibcode_file(os.path.join(settings.BASE_OUTPUT_PATH, DIRNAME, settings.BASE_FILES['prob']))
+        try:
+            bibcodes_not_uploaded = get_bibcodes_not_uploaded(os.path.join(settings.BASE_OUTPUT_PATH, DIRNAME))
+        except GenericError:
+            logger.error('Snapshot of the timestamps not committed: the next update will extract again the bibcodes of this extraction')
+            return
+        pipeline_timestamp_manager.commit_snapshot(bibcodes_probl + bibcodes_not_uploaded)
         return
 
+@trace(logger)
 def retrieve_bibcodes_to_extract(norecover=False):
     """method that retrieves the bibcodes that need to be extracted from ADS"""
-    logger.info("In function %s" % (inspect.stack()[0][3],))
 
     #check the status of the last extraction
     if norecover:
@@ -124,9 +143,9 @@ def retrieve_bibcodes_to_extract(norecover=False):
         return rem_bibs_to_extr_del(os.path.join(settings.BASE_OUTPUT_PATH, LATEST_EXTR_DIR))
 
 
+@trace(logger)
 def check_last_extraction():
     """method that checks if the last extraction finished properly"""
-    logger.info("In function %s" % (inspect.stack()[0][3],))
 
     #I retrieve the list of entries in the output directory
     list_of_elements = os.listdir(settings.BASE_OUTPUT_PATH)
@@ -174,19 +193,22 @@ def check_last_extraction():
     logger.info("Checked last extraction: status returned OK")
     return 'OK'
 
+@trace(logger)
 def extract_full_list_of_bibcodes():
     """ method that extracts the complete list of bibcodes
         it first extracts the list of arxiv bibcodes and then all the others
     """
-    logger.info("In function %s" % (inspect.stack()[0][3],))
     
     #I extract the list of published preprint
-    publ_prepr = read_bibcode_file(settings.ARXIV2PUB)
+    publ_prepr = read_bibcode_file(settings.ARXIV2PUB, as_set=True)
     
     #then I extract the complete list    
     all_bibcodes = get_all_bibcodes()
-    bibcode_to_extract = list(set(all_bibcodes) - set(publ_prepr))
-    bibcode_to_extract.sort()
+    #and I take a snapshot of the timestamps for the next updates
+    pipeline_timestamp_manager.write_snapshot()
+    #the result is already sorted
+    bibcode_to_extract = all_bibcodes - publ_prepr
+    del all_bibcodes, publ_prepr
 
     #I write these lists bibcodes to the file of bibcodes to extract
     bibcode_file = open(os.path.join(settings.BASE_OUTPUT_PATH, DIRNAME, settings.BASE_FILES['new']), 'a')
@@ -194,27 +216,28 @@ def extract_full_list_of_bibcodes():
     for bibcode in bibcode_to_extract:
         bibcode_file.write(bibcode + '\n')
     bibcode_file.close()
-    del bibcode, bibcode_file
+    del bibcode_file
 
     logger.info("Full list of bibcodes and related file generated")
     #finally I return the full list of bibcodes and an empty list for the bibcodes to delete
     return (bibcode_to_extract, [], [])
 
+@trace(logger)
 def extract_update_list_of_bibcodes():
     """Method that extracts the list of bibcodes to update"""
-    logger.info("In function %s" % (inspect.stack()[0][3],))
 
     #I estract the bibcodes
-    records_added, records_modified, records_deleted = pipeline_timestamp_manager.get_records_status()
+    #(with bibupload the uploads are only queued: the ones that fail later are found only comparing with Invenio)
+    records_added, records_modified, records_deleted = pipeline_timestamp_manager.get_records_status(use_snapshot=(UPLOAD_MODE == 'concurrent'))
     #I merge the add and modif because I have to extract them in any case
     new_mod_bibcodes_to_extract = list(records_added) + list(records_modified)
 
     #I extract the list of published preprint
-    publ_prepr = read_bibcode_file(settings.ARXIV2PUB)
+    publ_prepr = read_bibcode_file(settings.ARXIV2PUB, as_set=True)
     
     #I extract the not preprint first
-    bibcodes_to_extract = list(set(new_mod_bibcodes_to_extract) - set(publ_prepr))
-    bibcodes_to_extract.sort()
+    bibcodes_to_extract = BibcodeSet(new_mod_bibcodes_to_extract) - publ_prepr
+    del new_mod_bibcodes_to_extract, publ_prepr
     
     #then I write all these bibcodes to the proper files
     #first the one to extract
@@ -251,19 +274,19 @@ def extract_update_list_of_bibcodes():
 #    return published_from_preprint
 
 
+@trace(logger)
 def extr_diff_bibs_from_extraction(extraction_dir):
     """method that extracts the list of bibcodes not processed from a directory used for an extraction"""
-    logger.info("In function %s" % (inspect.stack()[0][3],))
     #first I extract the list of bibcodes that I had to extract
-    bibcodes_to_extract = read_bibcode_file(os.path.join(extraction_dir, settings.BASE_FILES['new']))
+    bibcodes_to_extract = read_bibcode_file(os.path.join(extraction_dir, settings.BASE_FILES['new']), as_set=True)
     #then the ones I had to delete
-    bibcodes_to_delete = read_bibcode_file(os.path.join(extraction_dir, settings.BASE_FILES['del']))
+    bibcodes_to_delete = read_bibcode_file(os.path.join(extraction_dir, settings.BASE_FILES['del']), as_set=True)
     #then the ones that had problems during the extraction
-    bibcodes_probl = read_bibcode_file(os.path.join(extraction_dir, settings.BASE_FILES['prob']))
+    bibcodes_probl = read_bibcode_file(os.path.join(extraction_dir, settings.BASE_FILES['prob']), as_set=True)
     #finally the ones that have been extracted correctly
-    bibcodes_done = read_bibcode_file(os.path.join(extraction_dir, settings.BASE_FILES['done']))
+    bibcodes_done = read_bibcode_file(os.path.join(extraction_dir, settings.BASE_FILES['done']), as_set=True)
     #then I extract the ones remaining
-    bibcodes_remaining = list((set(bibcodes_to_extract).union(set(bibcodes_to_delete))) - (set(bibcodes_probl).union(set(bibcodes_done))))
+    bibcodes_remaining = (bibcodes_to_extract | bibcodes_to_delete) - (bibcodes_probl | bibcodes_done)
     
     #then I extract the files to upload and the ones uploaded
     files_to_upload = read_bibcode_file(os.path.join(extraction_dir, settings.LIST_BIBREC_CREATED))
@@ -273,24 +296,23 @@ def extr_diff_bibs_from_extraction(extraction_dir):
     return bibcodes_remaining, files_remaining
 
 
+@trace(logger)
 def rem_bibs_to_extr_del(extraction_dir):
     """method that finds the bibcodes to extract and to delete not processed in an extraction """
-    logger.info("In function %s" % (inspect.stack()[0][3],))
     #first I extract the list of bibcodes that I had to extract
-    bibcodes_to_extract = read_bibcode_file(os.path.join(extraction_dir, settings.BASE_FILES['new']))
+    bibcodes_to_extract = read_bibcode_file(os.path.join(extraction_dir, settings.BASE_FILES['new']), as_set=True)
     #then the ones I had to delete
-    bibcodes_to_delete = read_bibcode_file(os.path.join(extraction_dir, settings.BASE_FILES['del']))
+    bibcodes_to_delete = read_bibcode_file(os.path.join(extraction_dir, settings.BASE_FILES['del']), as_set=True)
     #then the ones that had problems during the extraction
-    bibcodes_probl = read_bibcode_file(os.path.join(extraction_dir, settings.BASE_FILES['prob']))
+    bibcodes_probl = read_bibcode_file(os.path.join(extraction_dir, settings.BASE_FILES['prob']), as_set=True)
     #finally the ones that have been extracted correctly
-    bibcodes_done = read_bibcode_file(os.path.join(extraction_dir, settings.BASE_FILES['done']))
+    bibcodes_done = read_bibcode_file(os.path.join(extraction_dir, settings.BASE_FILES['done']), as_set=True)
 
-    bibcode_processed = list(set(bibcodes_probl).union(set(bibcodes_done)))
-    #then I find the ones remaining to extract
-    bibcodes_to_extract_remaining = list(set(bibcodes_to_extract) - set(bibcode_processed))
-    bibcodes_to_extract_remaining.sort()
+    bibcode_processed = bibcodes_probl | bibcodes_done
+    #then I find the ones remaining to extract (already sorted)
+    bibcodes_to_extract_remaining = bibcodes_to_extract - bibcode_processed
     #then I find the ones remaining to delete
-    bibcodes_to_delete_remaining = list(set(bibcodes_to_delete) - set(bibcode_processed))
+    bibcodes_to_delete_remaining = list(bibcodes_to_delete - bibcode_processed)
 
     #then I extract the files to upload and the ones uploaded
     files_to_upload = read_bibcode_file(os.path.join(extraction_dir, settings.LIST_BIBREC_CREATED))
@@ -299,47 +321,42 @@ def rem_bibs_to_extr_del(extraction_dir):
     
     return (bibcodes_to_extract_remaining, bibcodes_to_delete_remaining, files_remaining)
 
+@trace(logger)
+def get_bibcodes_not_uploaded(extraction_dir):
+    """method that returns the bibcodes of the files of bibrecords created but not uploaded in an extraction"""
+    files_to_upload = read_bibcode_file(os.path.join(extraction_dir, settings.LIST_BIBREC_CREATED))
+    files_uploaded = read_bibcode_file(os.path.join(extraction_dir, settings.LIST_BIBREC_UPLOADED))
+    bibcodes_not_uploaded = []
+    for filepath in sorted(set(files_to_upload) - set(files_uploaded)):
+        try:
+            bibcodes_not_uploaded.extend(upload_spool.get_file_bibcodes(filepath))
+        except Exception, error:
+            err_msg = 'Impossible to read the bibcodes of the file not uploaded "%s": %s' % (filepath, error)
+            logger.error(err_msg)
+            raise GenericError(err_msg)
+    if bibcodes_not_uploaded:
+        logger.warning('%d bibcodes extracted but not uploaded: they will be extracted again' % len(bibcodes_not_uploaded))
+    return bibcodes_not_uploaded
+
+@trace(logger)
 def get_all_bibcodes():
-    """Method that retrieves the complete list of bibcodes"""
-    logger.info("In function %s" % (inspect.stack()[0][3],))
+    """Method that retrieves the complete set of bibcodes"""
     # Timestamps ordered by increasing order of importance.
     timestamp_files_hierarchy = [settings.BIBCODES_GEN, settings.BIBCODES_PRE, settings.BIBCODES_PHY, settings.BIBCODES_AST ]
 
-    bibcodes = set([])
-    for filename in timestamp_files_hierarchy:
-        db_bibcodes = read_bibcode_file(filename)
-        bibcodes = bibcodes.union(set(db_bibcodes))
-    bibcodes_list = list(bibcodes)
-    bibcodes_list.sort()
-    return bibcodes_list
+    return BibcodeSet.union_all(read_bibcode_file(filename, as_set=True) for filename in timestamp_files_hierarchy)
 
-def read_bibcode_file(bibcode_file_path):
+def read_bibcode_file(bibcode_file_path, as_set=False):
     """ Function that read the list of bibcodes in one file:
         The bibcodes must be at the beginning of a row.
+        If as_set is True a sorted BibcodeSet is returned instead of a list.
     """
-    logger.info("In function %s" % (inspect.stack()[0][3],))
     logger.info("Reading %s" % bibcode_file_path)
     try:
-        bibfile = open(bibcode_file_path, "rU")
-    except IOError:
-        err_msg = 'Mandatory file not readable. Please check %s \n' % bibcode_file_path
-        logger.critical(err_msg)
-        raise GenericError(err_msg)
-
-    bibcodes_list = []
-
-    for bibrow in bibfile:
-        if bibrow[0] != " ":
-            bibrow_elements =  bibrow.split('\t')
-            bibcode = bibrow_elements[0].rstrip('\n')
-            if bibcode != '':
-                bibcodes_list.append(bibcode)
-
-    bibfile.close()
-    del bibfile
-    #return the list of bibcodes
-    return bibcodes_list
-
-
-
-
+        if as_set:
+            return BibcodeSet.from_file(bibcode_file_path)
+        else:
+            return read_bibcodes(bibcode_file_path)
+    except GenericError, error:
+        logger.critical(str(error))
+        raise
@@ -35,6 +35,8 @@ LOGGING_WORKER_NAME = 'Worker'
 LOGGING_DONE_BIBS_NAME = 'Done Bibs'
 LOGGING_PROBL_BIBS_NAME = 'Probl Bibs'
 LOGGING_UPLOAD_NAME = 'Upload'
+#if True the entry and the exit of the functions decorated with trace are logged (at INFO level) with the time spent
+TRACE_FUNCTIONS = False
 
 
 #list of files that MUST be in each output directory
@@ -62,8 +64,25 @@ BIBCODES_PRE = '/proj/ads/abstracts/pre/load/current/index.status'
 #The connection between published bibcodes and preprint
 ARXIV2PUB = '/proj/ads/abstracts/config/links/preprint/arxiv2pub.list'
 
+#directory where to store the snapshot of the timestamps of the last extraction, e.g. BASEDIR + 'timestamp_snapshot'
+#(None to always compare the ADS timestamps with the ones in Invenio). The snapshot is used only
+#with the upload mode "concurrent": with "bibupload" the uploads can fail after the extraction and
+#only the comparison with Invenio finds them.
+TIMESTAMP_SNAPSHOT_DIR = None
+#number of lines of the timestamp files per block of the snapshot
+TIMESTAMP_SNAPSHOT_BLOCK_LINES = 4096
+#maximum number of days between two comparisons of the ADS timestamps with the ones in Invenio:
+#after this the update compares with Invenio again, to catch the records whose upload failed (None to never do it)
+TIMESTAMP_SNAPSHOT_MAX_AGE_DAYS = 7
+#number of record ids per chunk when reading the timestamps from Invenio
+INVENIO_TIMESTAMP_CHUNK_SIZE = 50000
+
 #style sheet path
 STYLESHEET_PATH = BASEDIR + 'misc/AdsXML2MarcXML_v2.xsl'
+#converter of the ADS XML to bibrecord objects:
+#'xslt' transforms the ADS XML in MarcXML with the style sheet and then parses the MarcXML,
+#'native' converts the ADS XML directly (misclibs/ads_xml_converter.py, same mappings of the style sheet)
+ADS_XML_CONVERTER = 'xslt'
 
 #base name for the file of bibcodes to delete
 BIBCODE_TO_DELETE_OUT_NAME = 'marcxml_to_delete.xml'
@@ -75,16 +94,46 @@ BIBREC_EXTENSION = '.bib'
 #maximum number of bibcodes per group of extraction -> it means that this is also the maximum number of bibcodes per file of marcxml
 NUMBER_OF_BIBCODES_PER_GROUP = 5000
 
+#if True the groups are formed with about the same estimated extraction cost (see pipeline_group_scheduler.py),
+#with at most NUMBER_OF_BIBCODES_PER_GROUP bibcodes, otherwise they have exactly NUMBER_OF_BIBCODES_PER_GROUP bibcodes
+ADAPTIVE_GROUP_SIZE = True
+#estimated extraction time (in seconds) of a bibcode by publication year, used when there is no timing history:
+#(first year, time) in increasing order of year
+BIBCODE_COST_BY_YEAR = ((0, 0.01), (1980, 0.02), (2000, 0.04), (2010, 0.06))
+#minimum number of bibcodes timed for a journal or a year before using the timing history instead of the table
+BIBCODE_COST_MIN_SAMPLES = 100
+#smallest cost of the groups at the end of the extraction, as a fraction of the cost of a full group
+GROUP_TAIL_MIN_FRACTION = 0.1
+#file with the timing history of the extractions (set it to None to not use the history)
+GROUP_COST_HISTORY = BASEDIR + 'group_cost_history.txt'
+
 #maximum amount of bibcodes that can be skipped for each group
 MAX_SKIPPED_BIBCODES = NUMBER_OF_BIBCODES_PER_GROUP #/ 2
 
 #maximum number of worker processes that have to run
 NUMBER_WORKERS = 16
 
+#maximum number of groups of bibcodes waiting in the queue of the workers (the others are generated when there is place in the queue)
+MAX_GROUPS_IN_QUEUE = 2 * NUMBER_WORKERS
+
 #number of upload workers
 NUMBER_UPLOAD_WORKER = 8
 
+#directory in memory where the extraction workers pass the merged records to the upload workers in "concurrent" upload mode
+#(None to make the upload workers read the files on disk)
+UPLOAD_SPOOL_DIR = '/dev/shm'
+#minimum free space (in MB) to leave in the spool directory: if there is less the upload workers read the files on disk
+UPLOAD_SPOOL_MIN_FREE_MB = 512
+#maximum number of files for the recovery waiting to be written on disk by each extraction worker when the spool is used
+MAX_RECOVERY_FILES_IN_QUEUE = 2
+#format of the files of merged records in "concurrent" upload mode: 'container' (compact binary container) or 'pickle'
+#(the files for bibupload are always pickled)
+BIBRECORD_FILE_FORMAT = 'container'
+
 #maximum number of groups of bibcodes that each worker can process before dying
-MAX_NUMBER_OF_GROUP_TO_PROCESS = 1
+#(None: the workers are restarted only when they use too much memory)
+MAX_NUMBER_OF_GROUP_TO_PROCESS = None
+#maximum resident memory (in MB) of a worker: after a group, a worker that uses more is replaced by a new one
+WORKER_MAX_RSS_MB = 2048
 
 
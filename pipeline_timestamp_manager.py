@@ -17,18 +17,33 @@
 Pipeline timestamp manager.
 
 This module is responsible for comparing the records in ADS and the records in
-Invenio. Its only public method is get_record_status() which returns 3 sets of
+Invenio. Its main public method is get_records_status() which returns 3 lists of
 bibcodes:
     * the bibcodes not yet added to Invenio.
     * the bibcodes of the records that have been modified.
     * the bibcodes of the records that have been deleted in ADS.
+
+The comparison is done with a streaming sorted merge (see iter_records_status())
+of the ADS timestamp files and of the Invenio timestamps, both sorted by
+bibcode, so that the memory used does not grow with the number of records.
+
+If TIMESTAMP_SNAPSHOT_DIR is set, the ADS timestamps can be compared with the
+snapshot written during the last extraction instead (see
+pipeline_timestamp_snapshot), which only costs as much as the changes.
 """
-import inspect
+import heapq
+import itertools
+import tempfile
+import cPickle
 import ads
 
 from invenio.dbquery import run_sql
 
-from pipeline_settings import BIBCODES_AST, BIBCODES_PHY, BIBCODES_GEN, BIBCODES_PRE, LOGGING_GLOBAL_NAME
+from pipeline_settings import BIBCODES_AST, BIBCODES_PHY, BIBCODES_GEN, BIBCODES_PRE, LOGGING_GLOBAL_NAME, \
+    TIMESTAMP_SNAPSHOT_DIR, INVENIO_TIMESTAMP_CHUNK_SIZE
+from merger.merger_errors import GenericError
+from pipeline_log_functions import trace
+import pipeline_timestamp_snapshot
 #I get the global logger
 import logging
 logger = logging.getLogger(LOGGING_GLOBAL_NAME)
@@ -41,119 +56,299 @@ TIMESTAMP_FILES_HIERARCHY = [
         BIBCODES_AST,
         ]
 
-def get_records_status():
+# Status of a bibcode returned by iter_records_status().
+STATUS_ADDED = 'added'
+STATUS_MODIFIED = 'modified'
+STATUS_DELETED = 'deleted'
+
+@trace(logger)
+def get_records_status(use_snapshot=True):
     """
-    Return 3 sets of bibcodes:
+    Return 3 lists of bibcodes (sorted):
     * bibcodes added are bibcodes that are in ADS and not in Invenio.
     * bibcodes modified are bibcodes that are both in ADS and in Invenio and
       that have been modified since the last update.
     * bibcodes deleted are bibcodes that are in Invenio but not in ADS.
+    If use_snapshot is False the ADS timestamps are compared with Invenio even
+    if there is a snapshot.
     """
-    logger.info("In function %s" % (inspect.stack()[0][3],))
-    records_added = []
-    records_modified = []
-    records_deleted = []
-
-    logger.info('Getting ADS timestamps.')
-    ads_timestamps = _get_ads_timestamps()
-    logger.info('Getting ADS bibcodes.')
-    ads_bibcodes = set(ads_timestamps.keys())
-    logger.info('Getting Invenio timestamps.')
-    invenio_timestamps = _get_invenio_timestamps()
-    logger.info('Getting Invenio bibcodes.')
-    invenio_bibcodes = set(invenio_timestamps.keys())
-
-    logger.info('Deducting the added records.')
-    records_added = ads_bibcodes - invenio_bibcodes
-    logger.info('    %d records to add.' % len(records_added))
-    logger.info('Deducting the deleted records.')
-    records_deleted = invenio_bibcodes - ads_bibcodes
-    logger.info('    %d records to delete.' % len(records_deleted))
-
-    records_to_check = invenio_bibcodes - records_deleted
-    logger.info('Checking timestamps for %d records.' % len(records_to_check))
-
-    for bibcode in records_to_check:
-        # ADS timestamp in the file has tabs as separators where the XML has
-        # colons.
-        ads_timestamp = ads_timestamps[bibcode]
-        invenio_timestamp = invenio_timestamps[bibcode]
-
-        if invenio_timestamp != ads_timestamp:
-            records_modified.append(bibcode)
-
-    logger.info('    %d records to modify.' % len(records_modified))
+    records = {
+        STATUS_ADDED: [],
+        STATUS_MODIFIED: [],
+        STATUS_DELETED: [],
+        }
+
+    logger.info('Comparing ADS and Invenio timestamps.')
+    for status, bibcode in iter_records_status(use_snapshot):
+        records[status].append(bibcode)
+
+    logger.info('    %d records to add.' % len(records[STATUS_ADDED]))
+    logger.info('    %d records to delete.' % len(records[STATUS_DELETED]))
+    logger.info('    %d records to modify.' % len(records[STATUS_MODIFIED]))
     logger.info('Done with timestamps.')
 
-    return records_added, records_modified, records_deleted
-
-def _get_invenio_timestamps():
-    """
-    Returns a set of timestamps found in Invenio.
-    """
-    logger.info("In function %s" % (inspect.stack()[0][3],))
-    # First get the list of deleted records, i.e. records which have DELETED in 980__c.
-    query = "SELECT bb.id_bibrec FROM bib98x AS b, bibrec_bib98x AS bb " \
-            "WHERE b.tag='980__c' AND b.value='DELETED' AND b.id=bb.id_bibxxx"
-    logger.info("Running query 1")
-    deleted_recids = set(line[0] for line in run_sql(query))
-
-    # Get the correspondence between recid and bibcode.
-    query = "SELECT bb.id_bibrec, b.value FROM bibrec_bib97x AS bb JOIN bib97x AS b ON (bb.id_bibxxx=b.id AND b.tag='970__a')"
-    logger.info("Running query 2")
-    recid_bibcode = dict(run_sql(query))
-
-    # Now get the timestamps.
-    query = "SELECT bb.id_bibrec, b.value FROM bibrec_bib99x AS bb JOIN bib99x AS b ON (bb.id_bibxxx=b.id AND b.tag='995__a')"
-    logger.info("Running query 3")
-    timestamps = {}
-    for recid, timestamp in run_sql(query):
-        if recid not in deleted_recids:
-            bibcode = recid_bibcode.get(recid)
-            if bibcode is None:
-                logger.error( 'ERROR: Record %d has no bibcode.' % recid)
-            else:
-                timestamps[bibcode] = timestamp
+    return records[STATUS_ADDED], records[STATUS_MODIFIED], records[STATUS_DELETED]
 
-    return timestamps
+@trace(logger)
+def iter_records_status(use_snapshot=True):
+    """
+    Streaming version of get_records_status().
 
-def _get_ads_timestamps():
+    Yields tuples (status, bibcode) in bibcode order, where status is one of
+    STATUS_ADDED, STATUS_MODIFIED or STATUS_DELETED. Bibcodes that are
+    unchanged are not returned.
     """
-    Merges the timestamp files according to the importance of the database
-    in ADS.
+    if TIMESTAMP_SNAPSHOT_DIR:
+        if not use_snapshot:
+            logger.info('Snapshot of the ADS timestamps not used: comparing with Invenio.')
+        elif not pipeline_timestamp_snapshot.snapshot_exists(TIMESTAMP_FILES_HIERARCHY):
+            logger.info('No snapshot of the ADS timestamps: comparing with Invenio.')
+        elif pipeline_timestamp_snapshot.invenio_check_needed():
+            #the records whose upload failed are found only in Invenio
+            logger.info('Snapshot of the ADS timestamps not compared with Invenio for too long: comparing with Invenio.')
+        else:
+            logger.info('Comparing the ADS timestamps with the snapshot of the last extraction.')
+            return _iter_snapshot_status()
+        write_snapshot()
+    return diff_timestamps(_iter_ads_timestamps(), _iter_invenio_timestamps())
 
-    Returns a dictionary with the bibcodes as keys and the timestamps as values.
+@trace(logger)
+def write_snapshot():
     """
-    logger.info("In function %s" % (inspect.stack()[0][3],))
-    timestamps = {}
-    for filename in TIMESTAMP_FILES_HIERARCHY:
-        logger.info("Reading \"%s\"" % filename)
-        db_timestamps = _read_timestamp_file(filename)
-        timestamps.update(db_timestamps)
+    Writes a new pending snapshot of the ADS timestamps, that will be used for
+    the next update once committed.
+    """
+    if not TIMESTAMP_SNAPSHOT_DIR:
+        return
+    try:
+        pipeline_timestamp_snapshot.write_snapshot(TIMESTAMP_FILES_HIERARCHY, _get_published_eprints())
+    except GenericError:
+        logger.error('Impossible to write the snapshot of the ADS timestamps.')
 
-    # Now let's remove the timestamps of published eprints as they don't appear
-    # as such in Invenio.
-    published_eprints = [line.strip().split('\t', 1)[1]
-                         for line in open(ads.pub2arx)]
-    for bibcode in published_eprints:
-        try:
-            del timestamps[bibcode]
-        except:
+@trace(logger)
+def commit_snapshot(problematic_bibcodes):
+    """
+    Function to call when an extraction is complete: the pending snapshot of
+    the ADS timestamps becomes the reference for the next update.
+    problematic_bibcodes are the bibcodes not extracted or not uploaded, that
+    are extracted again the next time.
+    If there is no pending snapshot (e.g. at the end of the recovery of an
+    extraction whose snapshot was already committed) the bibcodes are added to
+    the ones to extract again with the current snapshot.
+    """
+    if not TIMESTAMP_SNAPSHOT_DIR:
+        return
+    if pipeline_timestamp_snapshot.pending_snapshot_exists():
+        pipeline_timestamp_snapshot.commit_snapshot(problematic_bibcodes)
+    elif problematic_bibcodes:
+        pipeline_timestamp_snapshot.add_retry_bibcodes(problematic_bibcodes)
+
+def _iter_snapshot_status():
+    """
+    Yields tuples (status, bibcode) comparing the ADS timestamps with the
+    snapshot of the last extraction.
+    """
+    changes = pipeline_timestamp_snapshot.iter_changes(TIMESTAMP_FILES_HIERARCHY, _get_published_eprints())
+    for bibcode, old_digest, new_digest in changes:
+        if old_digest is None:
+            yield STATUS_ADDED, bibcode
+        elif new_digest is None:
+            yield STATUS_DELETED, bibcode
+        else:
+            yield STATUS_MODIFIED, bibcode
+
+def diff_timestamps(ads_timestamps, invenio_timestamps):
+    """
+    Compares two iterables of (bibcode, timestamp) sorted by bibcode with a
+    single sorted merge and yields tuples (status, bibcode).
+
+    If the same bibcode appears more than once in an iterable, the last
+    timestamp is used.
+    """
+    ads_iter = _unique_bibcodes(ads_timestamps, 'ADS')
+    invenio_iter = _unique_bibcodes(invenio_timestamps, 'Invenio')
+
+    ads_item = next(ads_iter, None)
+    invenio_item = next(invenio_iter, None)
+    while ads_item is not None and invenio_item is not None:
+        if ads_item[0] < invenio_item[0]:
+            yield STATUS_ADDED, ads_item[0]
+            ads_item = next(ads_iter, None)
+        elif ads_item[0] > invenio_item[0]:
+            yield STATUS_DELETED, invenio_item[0]
+            invenio_item = next(invenio_iter, None)
+        else:
+            # ADS timestamp in the file has tabs as separators where the XML has
+            # colons.
+            if ads_item[1] != invenio_item[1]:
+                yield STATUS_MODIFIED, ads_item[0]
+            ads_item = next(ads_iter, None)
+            invenio_item = next(invenio_iter, None)
+
+    while ads_item is not None:
+        yield STATUS_ADDED, ads_item[0]
+        ads_item = next(ads_iter, None)
+    while invenio_item is not None:
+        yield STATUS_DELETED, invenio_item[0]
+        invenio_item = next(invenio_iter, None)
+
+def _unique_bibcodes(timestamps, source):
+    """
+    Checks that the (bibcode, timestamp) tuples are sorted by bibcode and
+    keeps only the last timestamp of each bibcode.
+    """
+    previous = None
+    for bibcode, group in itertools.groupby(timestamps, key=lambda item: item[0]):
+        if previous is not None and bibcode < previous:
+            err_msg = 'The %s timestamps are not sorted by bibcode ("%s" found after "%s").' % (source, bibcode, previous)
+            logger.critical(err_msg)
+            raise GenericError(err_msg)
+        previous = bibcode
+        for item in group:
             pass
+        yield item
 
-    return timestamps
+@trace(logger)
+def _iter_ads_timestamps():
+    """
+    K-way sorted merge of the timestamp files that follows the importance of
+    the databases in TIMESTAMP_FILES_HIERARCHY.
 
-def _read_timestamp_file(filename):
+    Yields tuples (bibcode, timestamp) sorted by bibcode.
     """
-    Reads a timestamp file and returns a dictionary with the bibcodes as keys
-    and the timestamps as values.
+    published_eprints = _get_published_eprints()
+
+    # Each file is tagged with its rank in the hierarchy and each line with
+    # its number, so that for the same bibcode the last tuple of the merge is
+    # the one from the most important database.
+    streams = [_iter_ranked_timestamp_file(filename, rank)
+               for rank, filename in enumerate(TIMESTAMP_FILES_HIERARCHY)]
+    for bibcode, group in itertools.groupby(heapq.merge(*streams), key=lambda item: item[0]):
+        for item in group:
+            pass
+        if bibcode not in published_eprints:
+            yield bibcode, item[3]
+
+def _get_published_eprints():
+    """
+    Returns the set of the published eprints: they don't appear as such in
+    Invenio. This set is bounded by the number of published eprints, not by
+    the size of ADS.
+    """
+    return set(line.strip().split('\t', 1)[1] for line in open(ads.pub2arx))
+
+def _iter_ranked_timestamp_file(filename, rank):
+    """
+    Yields tuples (bibcode, rank, line number, timestamp) from a timestamp file
+    that must be sorted by bibcode.
     """
-    logger.info("In function %s" % (inspect.stack()[0][3],))
+    logger.info("Reading \"%s\"" % filename)
+    previous = None
     fdesc = open(filename)
-    timestamps = {}
-    for line in fdesc:
-        bibcode, timestamp = line[:-1].split('\t', 1)
-        timestamps[bibcode] = timestamp
-    fdesc.close()
+    try:
+        for line_number, line in enumerate(fdesc):
+            bibcode, timestamp = line[:-1].split('\t', 1)
+            if previous is not None and bibcode < previous:
+                err_msg = 'Timestamp file "%s" is not sorted by bibcode (line %d).' % (filename, line_number + 1)
+                logger.critical(err_msg)
+                raise GenericError(err_msg)
+            previous = bibcode
+            yield bibcode, rank, line_number, timestamp
+    finally:
+        fdesc.close()
+
+# Range of the record ids with a timestamp (MIN and MAX are read from the index on id_bibrec).
+INVENIO_RECID_RANGE_QUERY = "SELECT MIN(id_bibrec), MAX(id_bibrec) FROM bibrec_bib99x"
+
+# Queries on a range of record ids: both are range scans of the index on
+# id_bibrec followed by lookups on the primary keys, and neither needs a sort.
+INVENIO_DELETED_QUERY = "SELECT bb98.id_bibrec " \
+    "FROM bibrec_bib98x AS bb98 JOIN bib98x AS b98 ON (bb98.id_bibxxx=b98.id AND b98.tag='980__c' AND b98.value='DELETED') " \
+    "WHERE bb98.id_bibrec >= %s AND bb98.id_bibrec < %s"
+
+# (the records without bibcode are returned with a NULL bibcode, to report them)
+INVENIO_TIMESTAMPS_QUERY = "SELECT b97.value, bb99.id_bibrec, b99.id, b99.value " \
+    "FROM bibrec_bib99x AS bb99 JOIN bib99x AS b99 ON (bb99.id_bibxxx=b99.id AND b99.tag='995__a') " \
+    "LEFT JOIN (bibrec_bib97x AS bb97 JOIN bib97x AS b97 ON (bb97.id_bibxxx=b97.id AND b97.tag='970__a')) " \
+    "ON (bb97.id_bibrec=bb99.id_bibrec) " \
+    "WHERE bb99.id_bibrec >= %s AND bb99.id_bibrec < %s"
+
+# Number of rows of a sorted run pickled together in its temporary file.
+INVENIO_RUN_BLOCK_ROWS = 1000
+
+@trace(logger)
+def _iter_invenio_timestamps(run_sql_function=None, chunk_size=None):
+    """
+    Yields tuples (bibcode, timestamp) for the records in Invenio that are not
+    deleted, sorted by bibcode.
 
-    return timestamps
+    The records are read by ranges of chunk_size record ids. The rows of each
+    range are sorted by bibcode and written in a temporary file, then all the
+    sorted runs are merged: the memory used is bounded by the size of a chunk.
+    run_sql_function can be changed to run the queries against another
+    database (e.g. SQLite).
+    """
+    if run_sql_function is None:
+        run_sql_function = run_sql
+    if chunk_size is None:
+        chunk_size = INVENIO_TIMESTAMP_CHUNK_SIZE
+    runs = []
+    try:
+        #the last chunk is merged directly from memory
+        last_rows = []
+        for rows in _iter_invenio_chunks(run_sql_function, chunk_size):
+            if last_rows:
+                runs.append(_write_sorted_run(last_rows))
+            last_rows = rows
+        streams = [_iter_sorted_run(run) for run in runs] + [iter(last_rows)]
+        logger.info('    Invenio timestamps merged from %d sorted runs.' % (len(runs) + bool(last_rows)))
+        for bibcode, recid, timestamp_id, timestamp in heapq.merge(*streams):
+            yield bibcode, timestamp
+    finally:
+        for run in runs:
+            run.close()
+
+def _iter_invenio_chunks(run_sql_function, chunk_size):
+    """
+    Yields the lists of rows (bibcode, recid, timestamp id, timestamp) of the
+    records not deleted of each range of record ids, sorted.
+    """
+    first_recid, last_recid = run_sql_function(INVENIO_RECID_RANGE_QUERY)[0]
+    if first_recid is None:
+        return
+    for start in xrange(first_recid, last_recid + 1, chunk_size):
+        end = start + chunk_size
+        deleted_recids = set(row[0] for row in run_sql_function(INVENIO_DELETED_QUERY, (start, end)))
+        rows = []
+        for row in run_sql_function(INVENIO_TIMESTAMPS_QUERY, (start, end)):
+            if row[1] in deleted_recids:
+                continue
+            if row[0] is None:
+                logger.error('ERROR: Record %d has no bibcode.' % row[1])
+            else:
+                rows.append(row)
+        rows.sort()
+        yield rows
+
+def _write_sorted_run(rows):
+    """
+    Writes the rows in a temporary file (in blocks of INVENIO_RUN_BLOCK_ROWS
+    rows) and returns the file, ready to be read.
+    """
+    run = tempfile.TemporaryFile()
+    for index in xrange(0, len(rows), INVENIO_RUN_BLOCK_ROWS):
+        cPickle.dump(rows[index:index + INVENIO_RUN_BLOCK_ROWS], run, cPickle.HIGHEST_PROTOCOL)
+    run.seek(0)
+    return run
+
+def _iter_sorted_run(run):
+    """
+    Yields the rows of a sorted run, reading one block at a time.
+    """
+    while True:
+        try:
+            rows = cPickle.load(run)
+        except EOFError:
+            return
+        for row in rows:
+            yield row
@@ -0,0 +1,450 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Persistent snapshot of the ADS timestamps.
+
+The snapshot stores, for each timestamp file of the hierarchy, the content of
+the file as it was at the time of the last extraction:
+    * a data file with sorted fixed-width records: the bibcode (padded with
+      NUL characters to BIBCODE_LENGTH) followed by a digest of the timestamp.
+      The file is memory-mapped and searched with a binary search.
+    * a block index: one line per block of lines of the timestamp file with
+      the first bibcode of the block, the position and number of its records
+      in the data file and the checksum of the raw lines of the block.
+
+When a timestamp file is compared with the snapshot, it is cut at the first
+bibcodes of the blocks of the snapshot and the checksum of each region is
+compared with the one in the index: only the regions that changed are parsed.
+
+A new snapshot is always written in the "pending" directory and becomes the
+"current" one only when the extraction that used it is complete (see
+commit_snapshot()). If the extraction does not complete, the pending snapshot
+is committed by the run that recovers it. The snapshot also stores the time of the last comparison
+of the ADS timestamps with Invenio: when it is older than
+TIMESTAMP_SNAPSHOT_MAX_AGE_DAYS the update compares with Invenio again.
+"""
+
+import os
+import mmap
+import time
+import shutil
+import hashlib
+
+import pipeline_settings as settings
+from pipeline_log_functions import trace
+from merger.merger_errors import GenericError
+
+#I get the global logger
+import logging
+logger = logging.getLogger(settings.LOGGING_GLOBAL_NAME)
+
+BIBCODE_LENGTH = 19
+DIGEST_LENGTH = 8
+RECORD_LENGTH = BIBCODE_LENGTH + DIGEST_LENGTH
+
+CURRENT_DIR = 'current'
+PENDING_DIR = 'pending'
+OLD_DIR = 'old'
+MANIFEST_FILE = 'sources.list'
+EPRINTS_FILE = 'published_eprints.list'
+RETRY_FILE = 'retry.list'
+INVENIO_CHECK_FILE = 'invenio_check.time'
+DATA_EXTENSION = '.dat'
+INDEX_EXTENSION = '.idx'
+
+
+def snapshot_exists(filenames):
+    """Returns True if there is a current snapshot for this list of timestamp files."""
+    manifest = os.path.join(settings.TIMESTAMP_SNAPSHOT_DIR, CURRENT_DIR, MANIFEST_FILE)
+    if not os.path.isfile(manifest):
+        return False
+    return _read_lines(manifest) == list(filenames)
+
+def pending_snapshot_exists():
+    """Returns True if a snapshot is waiting to be committed."""
+    return os.path.isfile(os.path.join(settings.TIMESTAMP_SNAPSHOT_DIR, PENDING_DIR, MANIFEST_FILE))
+
+def invenio_check_needed():
+    """Returns True if the current snapshot was compared with Invenio more than TIMESTAMP_SNAPSHOT_MAX_AGE_DAYS ago."""
+    if settings.TIMESTAMP_SNAPSHOT_MAX_AGE_DAYS is None:
+        return False
+    try:
+        checked = float(_read_lines(os.path.join(settings.TIMESTAMP_SNAPSHOT_DIR, CURRENT_DIR, INVENIO_CHECK_FILE))[0])
+    except (IndexError, ValueError):
+        return True
+    return time.time() - checked > settings.TIMESTAMP_SNAPSHOT_MAX_AGE_DAYS * 24 * 3600
+
+@trace(logger)
+def write_snapshot(filenames, published_eprints):
+    """Writes a pending snapshot from scratch (the extraction that uses it is checked against Invenio)."""
+    new_dir = _prepare_pending_dir()
+    for rank, filename in enumerate(filenames):
+        _diff_source(rank, filename, None, new_dir, collect_changes=False)
+    _write_lines(os.path.join(new_dir, INVENIO_CHECK_FILE), [repr(time.time())])
+    _write_lines(os.path.join(new_dir, EPRINTS_FILE), sorted(published_eprints))
+    _write_lines(os.path.join(new_dir, MANIFEST_FILE), filenames)
+
+@trace(logger)
+def iter_changes(filenames, published_eprints):
+    """
+    Compares the timestamp files with the current snapshot and writes the
+    pending snapshot.
+
+    Yields tuples (bibcode, old digest, new digest) sorted by bibcode for the
+    bibcodes whose merged timestamp changed; the old digest is None for the new
+    bibcodes and the new digest is None for the deleted ones. The bibcodes that
+    could not be extracted the last time are returned with two equal digests.
+    """
+    old_dir = os.path.join(settings.TIMESTAMP_SNAPSHOT_DIR, CURRENT_DIR)
+    new_dir = _prepare_pending_dir()
+
+    old_data = []
+    changes = []
+    for rank, filename in enumerate(filenames):
+        source_changes = _diff_source(rank, filename, old_dir, new_dir)
+        logger.info('    %d timestamps changed in "%s".' % (len(source_changes), filename))
+        changes.append(source_changes)
+        old_data.append(_SnapshotData(old_dir, rank))
+
+    old_eprints = set(_read_lines(os.path.join(old_dir, EPRINTS_FILE)))
+    retry = set(_read_lines(os.path.join(old_dir, RETRY_FILE)))
+    #the snapshot has not been compared with Invenio again
+    _write_lines(os.path.join(new_dir, INVENIO_CHECK_FILE), _read_lines(os.path.join(old_dir, INVENIO_CHECK_FILE)))
+    _write_lines(os.path.join(new_dir, EPRINTS_FILE), sorted(published_eprints))
+    _write_lines(os.path.join(new_dir, MANIFEST_FILE), filenames)
+
+    bibcodes = set(retry)
+    bibcodes.update(old_eprints.symmetric_difference(published_eprints))
+    for source_changes in changes:
+        bibcodes.update(source_changes)
+
+    for bibcode in sorted(bibcodes):
+        old_digest = new_digest = None
+        #the most important database is the last one of the hierarchy
+        for rank in reversed(range(len(filenames))):
+            if bibcode in changes[rank]:
+                old_value, new_value = changes[rank][bibcode]
+            else:
+                old_value = new_value = old_data[rank].get(bibcode)
+            if old_digest is None:
+                old_digest = old_value
+            if new_digest is None:
+                new_digest = new_value
+        if bibcode in old_eprints:
+            old_digest = None
+        if bibcode in published_eprints:
+            new_digest = None
+        if old_digest != new_digest or (bibcode in retry and new_digest is not None):
+            yield bibcode, old_digest, new_digest
+
+    for data in old_data:
+        data.close()
+
+@trace(logger)
+def commit_snapshot(problematic_bibcodes):
+    """
+    Makes the pending snapshot the current one. The bibcodes with problems
+    are stored so that they are extracted again the next time.
+    """
+    base_dir = settings.TIMESTAMP_SNAPSHOT_DIR
+    _write_lines(os.path.join(base_dir, PENDING_DIR, RETRY_FILE), sorted(set(problematic_bibcodes)))
+    if os.path.isdir(os.path.join(base_dir, OLD_DIR)):
+        shutil.rmtree(os.path.join(base_dir, OLD_DIR))
+    if os.path.isdir(os.path.join(base_dir, CURRENT_DIR)):
+        os.rename(os.path.join(base_dir, CURRENT_DIR), os.path.join(base_dir, OLD_DIR))
+    os.rename(os.path.join(base_dir, PENDING_DIR), os.path.join(base_dir, CURRENT_DIR))
+    if os.path.isdir(os.path.join(base_dir, OLD_DIR)):
+        shutil.rmtree(os.path.join(base_dir, OLD_DIR))
+    logger.info('Timestamp snapshot committed.')
+
+@trace(logger)
+def add_retry_bibcodes(bibcodes):
+    """
+    Adds bibcodes to the ones extracted again the next time with the current
+    snapshot: for the extractions that end without a pending snapshot (like the
+    recovery of an extraction). Returns False if there is no current snapshot.
+    """
+    current_dir = os.path.join(settings.TIMESTAMP_SNAPSHOT_DIR, CURRENT_DIR)
+    if not os.path.isfile(os.path.join(current_dir, MANIFEST_FILE)):
+        return False
+    retry_file = os.path.join(current_dir, RETRY_FILE)
+    retry = set(_read_lines(retry_file))
+    if not retry.issuperset(bibcodes):
+        retry.update(bibcodes)
+        _write_lines(retry_file, sorted(retry))
+    logger.info('Bibcodes to extract again added to the current timestamp snapshot.')
+    return True
+
+def _prepare_pending_dir():
+    """Creates an empty pending directory"""
+    new_dir = os.path.join(settings.TIMESTAMP_SNAPSHOT_DIR, PENDING_DIR)
+    if os.path.isdir(new_dir):
+        shutil.rmtree(new_dir)
+    os.makedirs(new_dir, 0755)
+    return new_dir
+
+def _diff_source(rank, filename, old_dir, new_dir, collect_changes=True):
+    """
+    Compares a timestamp file with its snapshot and writes the new snapshot.
+    Returns a dictionary bibcode -> (old digest, new digest) of the changes.
+    """
+    if old_dir is None:
+        old_data = _SnapshotData(None, rank)
+        old_blocks = []
+    else:
+        old_data = _SnapshotData(old_dir, rank)
+        old_blocks = _read_block_index(old_dir, rank)
+    writer = _SnapshotWriter(new_dir, rank)
+    changes = {}
+
+    fdesc = open(filename, 'rb')
+    try:
+        if os.fstat(fdesc.fileno()).st_size == 0:
+            content = ''
+        else:
+            content = mmap.mmap(fdesc.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # I cut the file in regions that start at the first bibcode of the old
+        # blocks. If a bibcode is not found any more, its block is merged with
+        # the previous one.
+        regions = [[0, []]]
+        for index, block in enumerate(old_blocks):
+            position = -1
+            if index > 0:
+                position = _find_line(content, block[0], regions[-1][0] + 1)
+            if position > 0:
+                regions.append([position, [index]])
+            else:
+                regions[-1][1].append(index)
+
+        for region_index, (start, blocks) in enumerate(regions):
+            if region_index + 1 < len(regions):
+                end = regions[region_index + 1][0]
+            else:
+                end = len(content)
+            if len(blocks) == 1:
+                block = old_blocks[blocks[0]]
+                if block[1] + block[2] <= len(old_data) and \
+                        hashlib.md5(content[start:end]).hexdigest() == block[3]:
+                    # The region did not change: no need to parse it.
+                    writer.copy_block(old_data, block)
+                    continue
+            if blocks:
+                old_records = old_data.records(old_blocks[blocks[0]][1], old_blocks[blocks[-1]][1] + old_blocks[blocks[-1]][2])
+            else:
+                old_records = []
+            new_records = writer.add_lines(content[start:end].splitlines(True))
+            if collect_changes:
+                _diff_records(old_records, new_records, changes)
+        if content:
+            content.close()
+    finally:
+        fdesc.close()
+    writer.close()
+    old_data.close()
+    return changes
+
+def _diff_records(old_records, new_records, changes):
+    """Sorted merge of two lists of (bibcode, digest)"""
+    old_index = new_index = 0
+    while old_index < len(old_records) or new_index < len(new_records):
+        if new_index == len(new_records) or \
+                (old_index < len(old_records) and old_records[old_index][0] < new_records[new_index][0]):
+            changes[old_records[old_index][0]] = (old_records[old_index][1], None)
+            old_index += 1
+        elif old_index == len(old_records) or old_records[old_index][0] > new_records[new_index][0]:
+            changes[new_records[new_index][0]] = (None, new_records[new_index][1])
+            new_index += 1
+        else:
+            if old_records[old_index][1] != new_records[new_index][1]:
+                changes[old_records[old_index][0]] = (old_records[old_index][1], new_records[new_index][1])
+            old_index += 1
+            new_index += 1
+
+def _find_line(content, bibcode, start):
+    """
+    Returns the position of the first line starting with the bibcode after the
+    position start or -1. The lines are sorted by bibcode: the search is a
+    binary search that reads only a few lines.
+    """
+    low, high = start, len(content)
+    while low < high:
+        middle = (low + high) // 2
+        line_start = _next_line_start(content, middle)
+        end_of_bibcode = content.find('\t', line_start)
+        if end_of_bibcode < 0:
+            end_of_bibcode = len(content)
+        if line_start < len(content) and content[line_start:end_of_bibcode] < bibcode:
+            #all the lines up to this one come before the bibcode
+            low = line_start + 1
+        else:
+            high = middle
+    position = _next_line_start(content, low)
+    if position < len(content) and content[position:position + len(bibcode) + 1] == bibcode + '\t':
+        return position
+    return -1
+
+def _next_line_start(content, position):
+    """Returns the position of the first line starting at or after position (the length of the content if there is none)"""
+    if position == 0:
+        return 0
+    end_of_line = content.find('\n', position - 1)
+    if end_of_line < 0:
+        return len(content)
+    return end_of_line + 1
+
+def _pad_bibcode(bibcode):
+    """Returns the bibcode with the fixed length of the data file"""
+    if len(bibcode) > BIBCODE_LENGTH:
+        err_msg = 'Bibcode "%s" too long for the timestamp snapshot.' % bibcode
+        logger.critical(err_msg)
+        raise GenericError(err_msg)
+    return bibcode.ljust(BIBCODE_LENGTH, '\0')
+
+def _read_block_index(snapshot_dir, rank):
+    """Returns the list of blocks (first bibcode, first record, number of records, checksum)"""
+    blocks = []
+    for line in _read_lines(os.path.join(snapshot_dir, str(rank) + INDEX_EXTENSION)):
+        bibcode, first_record, num_records, checksum = line.split('\t')
+        blocks.append((bibcode, int(first_record), int(num_records), checksum))
+    return blocks
+
+def _read_lines(filepath):
+    """Returns the lines of a file without the newline characters"""
+    if not os.path.isfile(filepath):
+        return []
+    fdesc = open(filepath)
+    lines = [line.rstrip('\n') for line in fdesc]
+    fdesc.close()
+    return lines
+
+def _write_lines(filepath, lines):
+    """Writes a list of strings in a file, one per line"""
+    fdesc = open(filepath, 'w')
+    for line in lines:
+        fdesc.write(line + '\n')
+    fdesc.close()
+
+
+class _SnapshotData(object):
+    """Memory-mapped data file of the snapshot of one timestamp file"""
+
+    def __init__(self, snapshot_dir, rank):
+        """Constructor"""
+        self.fdesc = None
+        self.content = ''
+        if snapshot_dir is not None:
+            filepath = os.path.join(snapshot_dir, str(rank) + DATA_EXTENSION)
+            if os.path.isfile(filepath) and os.path.getsize(filepath) > 0:
+                self.fdesc = open(filepath, 'rb')
+                self.content = mmap.mmap(self.fdesc.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.content) // RECORD_LENGTH
+
+    def raw(self, first_record, last_record):
+        """Returns the raw content of a range of records"""
+        return self.content[first_record * RECORD_LENGTH:last_record * RECORD_LENGTH]
+
+    def records(self, first_record, last_record):
+        """Returns a list of (bibcode, digest) for a range of records"""
+        raw = self.raw(first_record, last_record)
+        return [(raw[pos:pos + BIBCODE_LENGTH].rstrip('\0'), raw[pos + BIBCODE_LENGTH:pos + RECORD_LENGTH])
+                for pos in xrange(0, len(raw), RECORD_LENGTH)]
+
+    def get(self, bibcode):
+        """Binary search of a bibcode: returns its digest or None"""
+        key = _pad_bibcode(bibcode)
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            position = middle * RECORD_LENGTH
+            if self.content[position:position + BIBCODE_LENGTH] < key:
+                low = middle + 1
+            else:
+                high = middle
+        position = low * RECORD_LENGTH
+        if low < len(self) and self.content[position:position + BIBCODE_LENGTH] == key:
+            return self.content[position + BIBCODE_LENGTH:position + RECORD_LENGTH]
+        return None
+
+    def close(self):
+        """Releases the memory map"""
+        if self.fdesc is not None:
+            self.content.close()
+            self.fdesc.close()
+            self.fdesc = None
+            self.content = ''
+
+
+class _SnapshotWriter(object):
+    """Writes the data file and the block index of one timestamp file"""
+
+    def __init__(self, snapshot_dir, rank):
+        """Constructor"""
+        self.data = open(os.path.join(snapshot_dir, str(rank) + DATA_EXTENSION), 'wb')
+        self.index = open(os.path.join(snapshot_dir, str(rank) + INDEX_EXTENSION), 'w')
+        self.num_records = 0
+        self.last_bibcode = ''
+
+    def copy_block(self, old_data, block):
+        """Copies an unchanged block from the old snapshot"""
+        self.data.write(old_data.raw(block[1], block[1] + block[2]))
+        self.index.write('%s\t%d\t%d\t%s\n' % (block[0], self.num_records, block[2], block[3]))
+        self.num_records += block[2]
+        #the lines that follow must come after the last bibcode of the block
+        self.last_bibcode = old_data.records(block[1] + block[2] - 1, block[1] + block[2])[0][0]
+
+    def add_lines(self, lines):
+        """
+        Parses lines of a timestamp file and writes them in blocks.
+        Returns the list of (bibcode, digest).
+        """
+        records = []
+        block_start = 0
+        block_checksum = hashlib.md5()
+        for line in lines:
+            bibcode, timestamp = line.rstrip('\n').split('\t', 1)
+            if records and bibcode == records[-1][0]:
+                #same bibcode: the last timestamp wins and the block cannot end here
+                records[-1] = (bibcode, hashlib.md5(timestamp).digest()[:DIGEST_LENGTH])
+                block_checksum.update(line)
+                continue
+            if bibcode < self.last_bibcode:
+                err_msg = 'Timestamp file not sorted by bibcode ("%s" found after "%s").' % (bibcode, self.last_bibcode)
+                logger.critical(err_msg)
+                raise GenericError(err_msg)
+            self.last_bibcode = bibcode
+            if len(records) - block_start >= settings.TIMESTAMP_SNAPSHOT_BLOCK_LINES:
+                self._write_block(records, block_start, block_checksum)
+                block_start = len(records)
+                block_checksum = hashlib.md5()
+            records.append((bibcode, hashlib.md5(timestamp).digest()[:DIGEST_LENGTH]))
+            block_checksum.update(line)
+        if len(records) > block_start:
+            self._write_block(records, block_start, block_checksum)
+        return records
+
+    def _write_block(self, records, block_start, block_checksum):
+        """Writes the records of a block and its entry in the index"""
+        self.data.write(''.join(_pad_bibcode(bibcode) + digest for bibcode, digest in records[block_start:]))
+        self.index.write('%s\t%d\t%d\t%s\n' % (records[block_start][0], self.num_records, len(records) - block_start, block_checksum.hexdigest()))
+        self.num_records += len(records) - block_start
+
+    def close(self):
+        """Closes the files"""
+        self.data.close()
+        self.index.close()
@@ -0,0 +1,138 @@
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Spool in shared memory for the merged records passed from the extraction workers
+to the upload workers (upload mode "concurrent").
+
+The records of a group are serialized once by the extraction worker: the data is
+written in a file of the spool directory (by default in /dev/shm, so the file is
+in memory) and the upload worker reads it from there, instead of reading back the
+file written on disk for the recovery of the extraction.
+The spool is used only if there is enough free space, otherwise the upload workers
+read the file on disk.
+
+The records are serialized in the compact container of misclibs.bibrecord_container
+(BIBRECORD_FILE_FORMAT = 'container') or pickled: bibupload reads only the pickled files,
+so the containers are converted to pickle before submitting them to bibupload.
+"""
+
+import os
+import shutil
+import cPickle
+
+import pipeline_settings as settings
+import misclibs.bibrecord_container as bibrecord_container
+from merger.merger_errors import GenericError
+
+#I get the global logger
+import logging
+logger = logging.getLogger(settings.LOGGING_GLOBAL_NAME)
+
+def serialize_records(records, file_format='pickle'):
+    """Returns the serialized records: in a container or pickled (binary format, that pickle.load can read)"""
+    if file_format == 'container':
+        try:
+            return bibrecord_container.dumps(records)
+        except GenericError, error:
+            #pickle can serialize any record
+            logger.warning('Records pickled instead of written in a container: %s' % error)
+    return cPickle.dumps(records, cPickle.HIGHEST_PROTOCOL)
+
+def iter_records(filepath):
+    """Yields the records serialized in the file (in a container they are read one block at a time)"""
+    with open(filepath, 'rb') as file_obj:
+        if bibrecord_container.is_container(file_obj.read(len(bibrecord_container.MAGIC))):
+            file_obj.seek(0)
+            for record in bibrecord_container.iter_records(file_obj):
+                yield record
+        else:
+            file_obj.seek(0)
+            for record in cPickle.load(file_obj):
+                yield record
+
+def load_records(filepath):
+    """Returns the list of the records serialized in the file"""
+    return list(iter_records(filepath))
+
+def get_file_bibcodes(filepath):
+    """Returns the list of the bibcodes (970__a) of the records in the file"""
+    bibcodes = []
+    for record in iter_records(filepath):
+        for field in record.get('970', []):
+            bibcodes.extend(value for code, value in field[0] if code == 'a')
+    return bibcodes
+
+def convert_to_pickle(filepath):
+    """Pickles the records of a file if they are in a container (bibupload reads only pickled files).
+    Returns True if the file has been converted"""
+    with open(filepath, 'rb') as file_obj:
+        if not bibrecord_container.is_container(file_obj.read(len(bibrecord_container.MAGIC))):
+            return False
+    temp_filepath = filepath + '.tmp'
+    with open(temp_filepath, 'wb') as file_obj:
+        cPickle.dump(load_records(filepath), file_obj, cPickle.HIGHEST_PROTOCOL)
+    os.rename(temp_filepath, filepath)
+    return True
+
+def get_spool_directory(extraction_name):
+    """Returns the spool directory of an extraction (None if the spool is disabled)"""
+    if settings.UPLOAD_SPOOL_DIR is None:
+        return None
+    return os.path.join(settings.UPLOAD_SPOOL_DIR, 'ads_merger_spool_' + extraction_name)
+
+def create_spool_directory(extraction_name):
+    """Creates the spool directory of an extraction and returns it (None if the spool can't be used)"""
+    spool_directory = get_spool_directory(extraction_name)
+    if spool_directory is None:
+        return None
+    try:
+        if not os.path.isdir(spool_directory):
+            os.makedirs(spool_directory)
+    except OSError, error:
+        logger.warning('Impossible to create the upload spool "%s" (%s): the files on disk will be used.' % (spool_directory, error))
+        return None
+    return spool_directory
+
+def remove_spool_directory(extraction_name):
+    """Removes the spool directory of an extraction with the data not uploaded"""
+    spool_directory = get_spool_directory(extraction_name)
+    if spool_directory is not None and os.path.isdir(spool_directory):
+        shutil.rmtree(spool_directory, True)
+
+def write_spool(spool_directory, name, data):
+    """Writes the serialized data in the spool and returns the path of the spool file:
+    None if there isn't enough free space in the spool"""
+    if spool_directory is None:
+        return None
+    try:
+        stats = os.statvfs(spool_directory)
+        if stats.f_bavail * stats.f_frsize < len(data) + settings.UPLOAD_SPOOL_MIN_FREE_MB * 1024 * 1024:
+            return None
+        spool_path = os.path.join(spool_directory, name)
+        with open(spool_path, 'wb') as spool_file:
+            spool_file.write(data)
+    except (IOError, OSError), error:
+        logger.warning('Impossible to write "%s" in the upload spool: %s' % (name, error))
+        return None
+    return spool_path
+
+def read_spool(spool_path):
+    """Yields the records in a spool file and removes the file"""
+    try:
+        for record in iter_records(spool_path):
+            yield record
+    finally:
+        os.remove(spool_path)
@@ -20,10 +20,9 @@ can be freed just after the operation is complete
 '''
 
 import os
-import inspect
 
 import pipeline_settings as settings
-from pipeline_log_functions import msg as printmsg
+from pipeline_log_functions import msg as printmsg, trace_method
 from merger.merger_errors import GenericError
 
 class WriteFile(object):
@@ -35,9 +34,9 @@ class WriteFile(object):
         self.dirname = dirname
         self.logger = logger
 
+    @trace_method
     def write_done_bibcodes_to_file(self, bibcodes_list):
         """Method that writes a list of bibcodes in the file of the done bibcodes"""
-        self.logger.info("In function %s.%s" % (self.__class__.__name__, inspect.stack()[0][3]))
 
         filepath = os.path.join(settings.BASE_OUTPUT_PATH, self.dirname, settings.BASE_FILES['done'])
 
@@ -52,9 +51,9 @@ class WriteFile(object):
             raise GenericError(err_msg)
         return True
 
+    @trace_method
     def write_problem_bibcodes_to_file(self, bibcodes_list):
         """Method that writes a list of bibcodes in the file of the done bibcodes"""
-        self.logger.info("In function %s.%s" % (self.__class__.__name__, inspect.stack()[0][3]))
         
         filepath = os.path.join(settings.BASE_OUTPUT_PATH, self.dirname, settings.BASE_FILES['prob'])
         
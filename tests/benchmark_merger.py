@@ -0,0 +1,197 @@
+# -*- encoding: utf-8 -*-
+'''
+Benchmark of the merger: it compares the merge of all the versions of the
+sample records done two versions at a time with the one done in one pass.
+Then it does the same with a synthetic record with many versions (each with its
+authors and references) and measures the merge of a record of a big collaboration
+and the peak memory allocated by the merge of a record with many references.
+
+usage: python benchmark_merger.py [repetitions]
+
+The samples are the ADS records in xmlfiles (transformed with the stylesheet
+in misc) and the MarcXML records in misc (the old origin subfield "8" is
+renamed to the current one). The records that the merger refuses are skipped.
+'''
+
+import sys
+sys.path.append('../')
+import os
+import gc
+import glob
+import time
+import copy
+import resource
+import libxml2
+import libxslt
+
+import merger.merger as m
+from merger.merger_settings import ORIGIN_SUBFIELD, AUTHOR_NORM_NAME_SUBFIELD
+from misclibs.xml_transformer import create_record_from_libxml_obj
+
+import pipeline_settings
+
+import logging
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
+logger.setLevel(logging.CRITICAL)
+
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+
+def load_samples():
+    """returns the list of (name, versions of a record) of the samples"""
+    docs = []
+    stylesheet = libxslt.parseStylesheetDoc(libxml2.parseFile(os.path.join(BASEDIR, '..', 'misc', 'AdsXML2MarcXML_v2.xsl')))
+    for filename in sorted(glob.glob(os.path.join(BASEDIR, 'xmlfiles', '*.xml'))):
+        docs.append((filename, stylesheet.applyStylesheet(libxml2.parseFile(filename), None)))
+    for filename in sorted(glob.glob(os.path.join(BASEDIR, '..', 'misc', '*.xml'))):
+        marcxml = open(filename).read().replace('code="8"', 'code="%s"' % ORIGIN_SUBFIELD)
+        docs.append((filename, libxml2.parseDoc(marcxml)))
+    samples = []
+    for filename, doc in docs:
+        for versions in create_record_from_libxml_obj(doc, logger):
+            try:
+                merge_pairwise(copy.deepcopy(versions))
+            except Exception, error:
+                print 'skipped a record of %s (%s: %s)' % (os.path.basename(filename), error.__class__.__name__, error)
+                continue
+            samples.append((os.path.basename(filename), versions))
+    return samples
+
+def synthetic_collaboration_record(authors=5000):
+    """returns the two versions of a record with many authors: the most trusted
+    has only the names, the other one has also the affiliations and the emails"""
+    versions = []
+    for origin, enriched in (('ADS metadata', False), ('AAS', True)):
+        record = {}
+        for index in xrange(authors):
+            name = 'Author%05d, A.' % index
+            subfields = [('a', name), (AUTHOR_NORM_NAME_SUBFIELD, name)]
+            if enriched:
+                subfields.extend([('u', 'Institute %d' % (index % 200)), ('m', 'author%05d@example.org' % index)])
+            subfields.append((ORIGIN_SUBFIELD, origin))
+            tag = '100' if index == 0 else '700'
+            record.setdefault(tag, []).append((subfields, ' ', ' ', '', index + 1))
+        versions.append(record)
+    return versions
+
+def synthetic_multiple_versions_record(authors=300, references=1000):
+    """returns the versions of a record from several origins: each version has the same
+    authors with different subfields and most of the references of the others"""
+    versions = []
+    author_origins = ('AAS', 'ISI', 'ADS metadata', 'A&A', 'ARXIV', 'APJ')
+    reference_origins = ('AUTHOR', 'ISI', 'CROSSREF', 'OTHER', 'A&A', 'SPRINGER')
+    for number, (author_origin, reference_origin) in enumerate(zip(author_origins, reference_origins)):
+        record = {}
+        for index in xrange(authors):
+            name = 'Author%04d, A.' % index
+            subfields = [('a', name), (AUTHOR_NORM_NAME_SUBFIELD, name)]
+            if index % len(author_origins) == number:
+                subfields.append(('u', 'Institute %d' % number))
+            if (index + 1) % len(author_origins) == number:
+                subfields.append(('m', 'author%04d@example.org' % index))
+            subfields.append((ORIGIN_SUBFIELD, author_origin))
+            tag = '100' if index == 0 else '700'
+            record.setdefault(tag, []).append((subfields, ' ', ' ', '', index + 1))
+        for index in xrange(references):
+            if index % len(reference_origins) == number:
+                continue
+            subfields = [('i', '2000Ref....%05d' % index), ('b', 'Reference %d (%s)' % (index, reference_origin))]
+            if index % 7 == number:
+                subfields.append(('w', 'extension.xml'))
+            subfields.append((ORIGIN_SUBFIELD, reference_origin))
+            record.setdefault('999', []).append((subfields, 'C', '5', '', index + 1))
+        versions.append(record)
+    return versions
+
+def synthetic_references_record(references=20000):
+    """returns the two versions of a record with many references from two origins to take (and a collection)"""
+    versions = []
+    for origin in ('AUTHOR', 'ISI'):
+        fields = [([('i', '2000Ref...%06d' % index), ('b', 'Reference %d (%s)' % (index, origin)), (ORIGIN_SUBFIELD, origin)], 'C', '5', '', index + 1)
+                  for index in xrange(references)]
+        versions.append({'980': [([('a', 'ASTRONOMY'), (ORIGIN_SUBFIELD, 'ADS metadata')], '', '', '', 1)], '999': fields})
+    return versions
+
+def peak_allocation(function, build_versions):
+    """returns the memory (in KB) taken by the versions built and the peak of memory allocated by their merge:
+    they are measured in a child process with the maximum resident memory, which can only grow"""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        versions = build_versions()
+        gc.collect()
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        function(versions)
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(write_fd, '%d %d' % (before - start, after - before))
+        os._exit(0)
+    os.close(write_fd)
+    result = os.read(read_fd, 100)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    return [int(value) for value in result.split()]
+
+def sort_references(record):
+    """returns the record with the references sorted: the order of the references merged
+    in one pass can differ from the one of the references merged two versions at a time"""
+    record = dict(record)
+    if '999' in record:
+        record['999'] = sorted((sorted(field[0]),) + field[1:] for field in record['999'])
+    return record
+
+def merge_pairwise(records):
+    """merges the versions two at a time"""
+    merged_record = m.merge_two_records(records[0], records[1])
+    for record in records[2:]:
+        merged_record = m.merge_two_records(merged_record, record)
+    return merged_record
+
+def merge_one_pass(records):
+    """merges all the versions at once"""
+    return m.merge_records_by_tag(records)
+
+def run(function, samples, repetitions):
+    """returns the time spent merging all the samples"""
+    spent = 0.0
+    for _ in xrange(repetitions):
+        for name, versions in samples:
+            records = copy.deepcopy(versions)
+            start = time.time()
+            function(records)
+            spent += time.time() - start
+    return spent
+
+def compare(samples, repetitions):
+    """checks that the two merges give the same results and prints their times"""
+    for name, versions in samples:
+        if sort_references(merge_pairwise(copy.deepcopy(versions))) != sort_references(merge_one_pass(copy.deepcopy(versions))):
+            print 'Different results for a record of %s' % name
+            sys.exit(1)
+    print '%d records, %d versions, %d repetitions' % (len(samples), sum(len(versions) for name, versions in samples), repetitions)
+    pairwise = run(merge_pairwise, samples, repetitions)
+    one_pass = run(merge_one_pass, samples, repetitions)
+    print 'two versions at a time: %.3f s' % pairwise
+    print 'one pass:               %.3f s' % one_pass
+    print 'speedup:                %.2fx' % (pairwise / one_pass)
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    #the memory is measured first, before the other merges make the process grow
+    references = 20000
+    versions_memory, merge_memory = peak_allocation(m.merge_multiple_records, lambda: synthetic_references_record(references))
+    print 'record with 2 x %d references: %d KB of versions, %d KB allocated at most by the merge' % (references, versions_memory, merge_memory)
+    samples = load_samples()
+    if not samples:
+        print 'No sample record to merge'
+        return
+    compare(samples, repetitions)
+    multiple_versions = [('synthetic', synthetic_multiple_versions_record())]
+    compare(multiple_versions, repetitions)
+    authors = 5000
+    collaboration = [('synthetic', synthetic_collaboration_record(authors))]
+    print 'record with %d authors:  %.3f s per merge' % (authors, run(merge_one_pass, collaboration, repetitions) / repetitions)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# -*- encoding: utf-8 -*-
+'''
+Benchmark of the conversion of the MarcXML documents to bibrecord objects:
+it compares the walk of the tree done by create_record_from_libxml_obj with the
+previous conversion, that evaluated an XPath expression for every node.
+
+usage: python benchmark_xml_transformer.py [repetitions]
+
+The samples are the ADS records in xmlfiles transformed with the stylesheet in misc.
+'''
+
+import sys
+sys.path.append('../')
+import os
+import glob
+import time
+import libxml2
+import libxslt
+
+from misclibs.xml_transformer import create_record_from_libxml_obj
+
+import pipeline_settings
+
+import logging
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
+logger.setLevel(logging.CRITICAL)
+
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+
+def load_samples():
+    """returns the transformed documents of the samples"""
+    stylesheet = libxslt.parseStylesheetDoc(libxml2.parseFile(os.path.join(BASEDIR, '..', 'misc', 'AdsXML2MarcXML_v2.xsl')))
+    return [stylesheet.applyStylesheet(libxml2.parseFile(filename), None)
+            for filename in sorted(glob.glob(os.path.join(BASEDIR, 'xmlfiles', '*.xml')))]
+
+def create_record_with_xpath(domdoc, logger):
+    """the previous conversion, with an XPath evaluation for every node"""
+    ctxt = domdoc.xpathNewContext()
+    retrieved_records = ctxt.xpathEval('/collections/collection')
+    if len(retrieved_records) == 0:
+        return {}
+    all_bibrecords = []
+    for retrieved_record in retrieved_records:
+        bibrecord_versions = []
+        ctxt.setContextNode(retrieved_record)
+        record_versions = ctxt.xpathEval('record')
+        if len(record_versions) == 0:
+            continue
+        for record_version in record_versions:
+            field_position_global = 1
+            bibrecord_version = {}
+            ctxt.setContextNode(record_version)
+            datafields = ctxt.xpathEval('datafield')
+            if len(datafields) == 0:
+                continue
+            for datafield in datafields:
+                ctxt.setContextNode(datafield)
+                try:
+                    tag = ctxt.xpathEval('@tag')[0].content
+                    ind1 = ctxt.xpathEval('@ind1')[0].content
+                    ind2 = ctxt.xpathEval('@ind2')[0].content
+                except IndexError:
+                    continue
+                if ind1 == '':
+                    ind1 = ' '
+                if ind2 == '':
+                    ind2 = ' '
+                subfields = ctxt.xpathEval('subfield')
+                if len(subfields) == 0:
+                    continue
+                bibrecord_subfields = []
+                for subfield in subfields:
+                    value = subfield.content
+                    ctxt.setContextNode(subfield)
+                    try:
+                        code = ctxt.xpathEval('@code')[0].content.encode('utf-8')
+                    except IndexError:
+                        continue
+                    bibrecord_subfields.append((code, value,))
+                bibrecord_version.setdefault(tag, []).append((bibrecord_subfields, ind1, ind2, '', field_position_global,))
+                field_position_global += 1
+            bibrecord_versions.append(bibrecord_version)
+        all_bibrecords.append(bibrecord_versions)
+    ctxt.xpathFreeContext()
+    return all_bibrecords
+
+def run(function, docs, repetitions):
+    """returns the time spent converting all the documents"""
+    start = time.time()
+    for _ in xrange(repetitions):
+        for doc in docs:
+            function(doc, logger)
+    return time.time() - start
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    docs = load_samples()
+    if not docs:
+        print 'No sample document to convert'
+        return
+    for doc in docs:
+        if create_record_with_xpath(doc, logger) != create_record_from_libxml_obj(doc, logger):
+            print 'Different results for a document'
+            sys.exit(1)
+    fields = sum(len(fields) for doc in docs for versions in create_record_from_libxml_obj(doc, logger)
+                 for version in versions for fields in version.values())
+    print '%d documents, %d fields, %d repetitions' % (len(docs), fields, repetitions)
+    xpath = run(create_record_with_xpath, docs, repetitions)
+    tree_walk = run(create_record_from_libxml_obj, docs, repetitions)
+    print 'XPath per node: %.3f s' % xpath
+    print 'tree walk:      %.3f s' % tree_walk
+    print 'speedup:        %.2fx' % (xpath / tree_walk)
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,10 @@ import sys
 sys.path.append('../')
 
 import unittest
+import pickle
 
 import merger.basic_functions as b
+from merger.merger_errors import GenericError
 
 class TestBasicFunctions(unittest.TestCase):
 
@@ -34,5 +36,44 @@ class TestBasicFunctions(unittest.TestCase):
     def test_get_origin_value(self):
         pass
 
+    def test_get_origin_importance(self):
+        b.clear_origin_importance_cache()
+        #the references have their own priority list, the unknown tags use the default one
+        self.assertEqual(b.get_origin_importance('999', 'ISI'), b.PRIORITIES['references_priority_list']['ISI'])
+        self.assertEqual(b.get_origin_importance('000', 'ads metadata'), b.PRIORITIES['standard_priority_list']['ADS METADATA'])
+        #with multiple origins the most important one is taken
+        self.assertEqual(b.get_origin_importance('245', 'ARXIV; ADS metadata'), b.PRIORITIES['standard_priority_list']['ADS METADATA'])
+        self.assertRaises(b.OriginValueNotFound, b.get_origin_importance, '245', 'ARXIV; NOT AN ORIGIN')
+        self.assertEqual(b.get_origin_importance('999', 'ISI'), b.PRIORITIES['references_priority_list']['ISI'])
+        info = b.get_origin_importance_cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['size']), (1, 4, 3))
+        b.clear_origin_importance_cache()
+        info = b.get_origin_importance_cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['size']), (0, 0, 0))
+
+    def test_subfield_list(self):
+        field = (b.SubfieldList([('a', 'Title'), ('7', 'ADS'), ('a', 'Other title')]), ' ', ' ', '', 1)
+        self.assertEqual(field, ([('a', 'Title'), ('7', 'ADS'), ('a', 'Other title')], ' ', ' ', '', 1))
+        self.assertEqual(b.get_subfield_values(field, 'a'), ('Title', 'Other title'))
+        self.assertEqual(b.get_subfield_values(field, 'b'), ())
+        #the index is built again after a modification
+        field[0].append(('b', 'Subtitle'))
+        self.assertEqual(b.get_subfield_values(field, 'b'), ('Subtitle',))
+        del field[0][0]
+        self.assertEqual(b.get_subfield_values(field, 'a'), ('Other title',))
+        #the plain lists are scanned
+        self.assertEqual(list(b.get_subfield_values((list(field[0]),) + field[1:], 'a')), ['Other title'])
+        #the pickled subfields are plain lists
+        for protocol in (0, 2):
+            self.assertEqual(type(pickle.loads(pickle.dumps(field, protocol))[0]), list)
+
+    def test_resolve_function(self):
+        modules = {'basic_functions': b}
+        self.assertEqual(b.resolve_function('basic_functions.is_unicode', modules), b.is_unicode)
+        self.assertRaises(GenericError, b.resolve_function, 'basic_functions.not_a_function', modules)
+        self.assertRaises(GenericError, b.resolve_function, 'other_module.is_unicode', modules)
+        self.assertRaises(GenericError, b.resolve_function, 'is_unicode', modules)
+        self.assertRaises(GenericError, b.resolve_function, 'basic_functions.GenericError.args', modules)
+
 if __name__ == '__main__':
     unittest.main()
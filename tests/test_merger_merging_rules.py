@@ -162,7 +162,17 @@ class TestMergingRules(unittest.TestCase):
                ([('y', '2011arXiv1103.2570C'), ('2', 'eprint bibcode'), ('7', 'ADS metadata')], ' ', ' ', '', 3), 
                ([('a', 'arXiv:1103.2570'), ('2', 'arXiv'), ('7', 'ADS metadata')], ' ', ' ', '', 4)]
         self.assertEqual(m.take_all(fields1, fields2, '035'), out)
-    
+
+    def test_take_all_trusted_field_replaces_untrusted(self):
+        #the untrusted field is removed and the trusted one is appended at the end
+        fields1 = [([('a', 'arXiv:1103.2570'), ('2', 'arXiv'), ('7', 'ARXIV')], ' ', ' ', '', 3),
+                   ([('a', '2011ApJ...741...91C'), ('2', 'ADS bibcode'), ('7', 'ADS metadata')], ' ', ' ', '', 2)]
+        fields2 = [([('2', 'arXiv'), ('a', 'arXiv:1103.2570'), ('7', 'ADS metadata')], ' ', ' ', '', 4),
+                   ([('a', '2011ApJ...741...91C'), ('7', 'ARXIV'), ('2', 'ADS bibcode')], ' ', ' ', '', 5)]
+        out = [([('a', '2011ApJ...741...91C'), ('2', 'ADS bibcode'), ('7', 'ADS metadata')], ' ', ' ', '', 2),
+               ([('2', 'arXiv'), ('a', 'arXiv:1103.2570'), ('7', 'ADS metadata')], ' ', ' ', '', 4)]
+        self.assertEqual(m.take_all(fields1, fields2, '035'), out)
+
     def test_reference_merger_1(self):
         #simple merge between two reference list tht have to be merged
         fields1 = [([('i', '1965IBVS...91....1K'), ('e', '1'), ('f', 'AUTHOR'), ('b', '1965IBVS...91....1K'), ('7', 'AUTHOR')], 'C', '5', '', 31)]
@@ -215,6 +225,44 @@ class TestMergingRules(unittest.TestCase):
         merged = m.references_merger(fields1, fields2, '999')
         self.assertEqual([(sorted(elem[0]),)+elem[1:] for elem in sorted(merged)], [(sorted(elem[0]),)+elem[1:] for elem in sorted(out)])
         
+    def test_references_merger_multiple(self):
+        #the references of three versions merged at once are the ones merged two versions at a time
+        fields1 = [([('i', '1965IBVS...91....1K'), ('b', '1965IBVS...91....1K'), ('7', 'AUTHOR')], 'C', '5', '', 31),
+                   ([('i', '1964IBVS...54....1S'), ('b', 'Strohmeier, W.:1964, Inf Bull Var. Stars No. 54'), ('7', 'A&A')], 'C', '5', '', 35)]
+        fields2 = [([('i', '1974IBVS..888....1C'), ('b', 'Castore de Sister6, M.E., Sister6, R.F.:1974, Inf Bull Var. Stars No. 888'), ('7', 'SPRINGER')], 'C', '5', '', 27)]
+        fields3 = [([('i', '1965IBVS...91....1K'), ('b', 'Kohler, U.: Photometric Light-Curves of Southern BV-Stars 1965'), ('w', 'iop.xml'), ('7', 'CROSSREF')], 'C', '5', '', 31),
+                   ([('b', 'Van Hamme, W.:1982, Astron. Astrophys. 105, 389'), ('7', 'CROSSREF')], 'C', '5', '', 22)]
+        merged = m.references_merger(m.references_merger(fields1, fields2, '999'), fields3, '999')
+        self.assertEqual([(sorted(elem[0]),)+elem[1:] for elem in sorted(m.references_merger_multiple([fields1, fields2, fields3], '999'))],
+                         [(sorted(elem[0]),)+elem[1:] for elem in sorted(merged)])
+
+    def test_priority_based_merger_multiple(self):
+        #the most trusted version is selected at once
+        fields1 = [([('a', 'Title'), ('7', 'AAS')], ' ', ' ', '', 2)]
+        fields2 = [([('a', 'Better title'), ('7', 'ADS metadata')], ' ', ' ', '', 3)]
+        fields3 = [([('a', 'Other title'), ('7', 'ARXIV')], ' ', ' ', '', 4)]
+        for fields_lists in ([fields1, fields2, fields3], [fields3, [], fields1, fields2], [fields1, [], fields3]):
+            merged = fields_lists[0]
+            for fields in fields_lists[1:]:
+                merged = m.priority_based_merger(merged, fields, '245')
+            self.assertEqual(m.priority_based_merger_multiple(fields_lists, '245'), merged)
+
+    def test_author_merger_multiple(self):
+        #the authors of three versions merged at once are the ones merged two versions at a time:
+        #the most trusted list changes at the second version and it is enriched by the other two
+        fields1 = [([('a', 'Doe, J.'), ('b', 'doe, j'), ('u', 'Institute 1'), ('7', 'AAS')], ' ', ' ', '', 1),
+                   ([('a', 'Roe, R.'), ('b', 'roe, r'), ('7', 'AAS')], ' ', ' ', '', 2)]
+        fields2 = [([('a', 'Doe, John'), ('b', 'doe, j'), ('7', 'ADS metadata')], ' ', ' ', '', 3),
+                   ([('a', 'Roe, Richard'), ('b', 'roe, r'), ('7', 'ADS metadata')], ' ', ' ', '', 4)]
+        fields3 = [([('a', 'Roe, R.'), ('b', 'roe, r'), ('m', 'roe@example.org'), ('7', 'ISI')], ' ', ' ', '', 5),
+                   ([('a', 'Doe, J.'), ('b', 'doe, j'), ('u', 'Institute 2'), ('7', 'ISI')], ' ', ' ', '', 6)]
+        merged = m.author_merger(m.author_merger(fields1, fields2, '700'), fields3, '700')
+        self.assertEqual(m.author_merger_multiple([fields1, fields2, fields3], '700'), merged)
+        self.assertEqual(merged[0], ([('a', 'Doe, John'), ('b', 'doe, j'), ('7', 'ADS metadata'), ('u', 'Institute 1')], ' ', ' ', '', 3))
+        self.assertEqual(merged[1], ([('a', 'Roe, Richard'), ('b', 'roe, r'), ('7', 'ADS metadata'), ('m', 'roe@example.org')], ' ', ' ', '', 4))
+        #the versions are not modified
+        self.assertEqual(fields2[0], ([('a', 'Doe, John'), ('b', 'doe, j'), ('7', 'ADS metadata')], ' ', ' ', '', 3))
+
     def test_pub_date_merger_1(self):
         #merging two dates and the first is from primary
         fields1 = [([('c', '1973-00-00'), ('t', 'date-published'), ('7', 'ARI'), ('97', '2011-11-15T23:41:14'), ('98', '2011-11-15T23:41:14'), ('99', 'True')], ' ', ' ', '', 6)]
@@ -3,6 +3,7 @@
 import sys
 sys.path.append('../')
 import unittest
+import copy
 import libxml2
 
 import merger.merger as m
@@ -308,5 +309,85 @@ class TestAuthorMerger(unittest.TestCase):
         merged_record = m.merge_records_xml(libxml2.parseDoc(marcxml))[0]
         self.assertTrue(b._compare_fields(merged_record[0]['100'][0], expected_record[0]['100'][0], strict=False))
 
+class TestMultipleMerge(unittest.TestCase):
+
+    marcxml = """<collections><collection>
+  <record>
+    <datafield tag="300" ind1=" " ind2=" ">
+      <subfield code="a">10</subfield>
+      <subfield code="7">NED</subfield>
+    </datafield>
+    <datafield tag="694" ind1=" " ind2=" ">
+      <subfield code="a">M31</subfield>
+      <subfield code="7">NED</subfield>
+    </datafield>
+    <datafield tag="980" ind1="" ind2="">
+      <subfield code="a">ASTRONOMY</subfield>
+      <subfield code="7">ADS metadata</subfield>
+    </datafield>
+  </record>
+  <record>
+    <datafield tag="694" ind1=" " ind2=" ">
+      <subfield code="a">M31</subfield>
+      <subfield code="7">A&amp;A</subfield>
+    </datafield>
+    <datafield tag="694" ind1=" " ind2=" ">
+      <subfield code="a">M33</subfield>
+      <subfield code="7">A&amp;A</subfield>
+    </datafield>
+  </record>
+  <record>
+    <datafield tag="300" ind1=" " ind2=" ">
+      <subfield code="a">15</subfield>
+      <subfield code="7">A&amp;A</subfield>
+    </datafield>
+    <datafield tag="694" ind1=" " ind2=" ">
+      <subfield code="a">M101</subfield>
+      <subfield code="7">NED</subfield>
+    </datafield>
+  </record>
+</collection></collections>"""
+
+    def test_01_merge_three_records(self):
+        """
+        MULTIPLE: 3 records merged in one pass or two at a time.
+        """
+        records = create_record_from_libxml_obj(libxml2.parseDoc(self.marcxml), logger)[0]
+        merged_record = m.merge_two_records(m.merge_two_records(records[0], records[1]), records[2])
+        self.assertEqual(m.merge_records_by_tag(records), merged_record)
+        self.assertEqual(len(merged_record['694']), 3)
+        self.assertEqual(b.field_get_subfield_values(merged_record['300'][0], 'a'), ['15'])
+
+    def test_02_merge_one_record(self):
+        """
+        MULTIPLE: 1 record.
+        """
+        records = create_record_from_libxml_obj(libxml2.parseDoc(self.marcxml), logger)[0]
+        merged_record = m.merge_multiple_records(records[:1])
+        self.assertEqual(sorted(merged_record.keys()), ['300', '694', '980'])
+
+    def test_03_records_not_modified(self):
+        """
+        MULTIPLE: the versions of the record are not modified by the merger.
+        """
+        records = create_record_from_libxml_obj(libxml2.parseDoc(self.marcxml), logger)[0]
+        original_records = copy.deepcopy(records)
+        m.merge_multiple_records(records)
+        self.assertEqual(records, original_records)
+
+    def test_04_iter_merge_records(self):
+        """
+        MULTIPLE: the records merged one at a time are the same of the ones merged all together.
+        """
+        marcxml = self.marcxml.replace('</collection></collections>', '</collection>' + self.marcxml[len('<collections>'):])
+        merged_records, records_with_merging_probl = m.merge_records_xml(libxml2.parseDoc(marcxml))
+        self.assertEqual(len(merged_records), 2)
+        doc = libxml2.parseDoc(marcxml)
+        problems = []
+        self.assertEqual(list(m.iter_merge_records(doc, problems, free_nodes=True)), merged_records)
+        self.assertEqual(problems, records_with_merging_probl)
+        #the parsed records have been removed from the document
+        self.assertEqual(doc.xpathEval('/collections/collection'), [])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,77 @@
+# coding=UTF-8
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+File containing the conformance tests of the direct converter of the ADS XML
+with the transformation done with the stylesheet
+'''
+
+import sys
+sys.path.append('../')
+import unittest
+import libxml2, libxslt
+import glob
+
+import pipeline_settings
+
+import logging
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_WORKER_NAME)
+logger.setLevel(logging.ERROR)
+
+import misclibs.xml_transformer as x
+import misclibs.ads_xml_converter as c
+
+def get_results(xmlstring):
+    """returns the records of the stylesheet transformation and the ones of the converter"""
+    xmlobj = libxml2.parseDoc(xmlstring)
+    stylesheet = libxslt.parseStylesheetDoc(libxml2.parseFile('../misc/AdsXML2MarcXML_v2.xsl'))
+    result_xslt = x.create_record_from_libxml_obj(stylesheet.applyStylesheet(xmlobj, None), logger)
+    result_converter = c.create_records_from_ads_xml(xmlobj, logger)
+    return (result_xslt, result_converter)
+
+
+class TestAdsXmlConverter(unittest.TestCase):
+    """ All tests"""
+    def test_1_all_xmlfiles(self):
+        for filename in sorted(glob.glob('xmlfiles/*.xml')):
+            result_xslt, result_converter = get_results(open(filename, 'r').read())
+            self.assertNotEqual(result_xslt, {})
+            self.assertEqual(result_converter, result_xslt, 'Different records for "%s"' % filename)
+
+    def test_2_title_languages(self):
+        titles = ['<title>Single title</title>',
+                  '<title lang="fr">Un titre</title><title lang="en">A title</title><title lang="de">Ein Titel</title>',
+                  '<title>A title</title><title lang="">Another title</title>',
+                  '<title lang="en">A title</title><title>Another title</title><language>en</language>']
+        for title in titles:
+            xmlstring = '<records><record bibcode="2000Test..001..001A"><metadata origin="ADS" lang="en">%s</metadata></record></records>' % title
+            result_xslt, result_converter = get_results(xmlstring)
+            self.assertEqual(result_converter, result_xslt)
+
+    def test_3_empty_records(self):
+        xmlstring = '<records><record bibcode="2000Test..001..001A"/></records>'
+        self.assertEqual(get_results(xmlstring), ({}, {}))
+        self.assertEqual(get_results('<collections/>'), ({}, {}))
+
+    def test_4_free_nodes(self):
+        doc = libxml2.parseDoc(open('xmlfiles/test_3_create_record_from_libxml_obj.xml', 'r').read())
+        expected = c.create_records_from_ads_xml(doc, logger)
+        self.assertEqual(list(c.iter_records_from_ads_xml(doc, logger, free_nodes=True)), expected)
+        self.assertEqual(c.create_records_from_ads_xml(doc, logger), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+# coding=UTF-8
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+File containing tests for the bibcode_set
+'''
+
+import sys
+sys.path.append('../')
+import unittest
+import os
+import tempfile
+
+from misclibs.bibcode_set import BibcodeSet, iter_bibcode_blocks, read_bibcodes
+from merger.merger_errors import GenericError
+
+import pipeline_settings
+
+import logging
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_GLOBAL_NAME)
+logger.setLevel(logging.ERROR)
+
+LEFT = ['1999A&A...3..1A', '1999A&A...1..1A', '1999A&A...2..1A', '1999A&A...1..1A']
+RIGHT = ['1999A&A...2..1A', '1999A&A...4..1A', '1999A&A...0..1A']
+
+class TestBibcodeSet(unittest.TestCase):
+
+    def test_sorted_unique(self):
+        bibcodes = BibcodeSet(LEFT)
+        self.assertEqual(list(bibcodes), sorted(set(LEFT)))
+        self.assertEqual(len(bibcodes), 3)
+        self.assertEqual(bibcodes[0], '1999A&A...1..1A')
+        self.assertEqual(bibcodes[-1], '1999A&A...3..1A')
+        self.assertTrue('1999A&A...2..1A' in bibcodes)
+        self.assertFalse('1999A&A...4..1A' in bibcodes)
+        self.assertFalse('' in bibcodes)
+        self.assertFalse(BibcodeSet())
+
+    def test_set_operations(self):
+        left, right = BibcodeSet(LEFT), BibcodeSet(RIGHT)
+        self.assertEqual(list(left | right), sorted(set(LEFT) | set(RIGHT)))
+        self.assertEqual(list(left - right), sorted(set(LEFT) - set(RIGHT)))
+        self.assertEqual(list(left & right), sorted(set(LEFT) & set(RIGHT)))
+        self.assertEqual(list(left - RIGHT), sorted(set(LEFT) - set(RIGHT)))
+        self.assertEqual(list(left - BibcodeSet()), list(left))
+
+    def test_different_widths(self):
+        #shorter and longer identifiers than a bibcode keep the string order
+        short, long = ['1999A&A', '1999A&A...1..1A'], ['1999A&A...1..1A.extra', '1999A&A...1..1A']
+        self.assertEqual(list(BibcodeSet(short) | BibcodeSet(long)), sorted(set(short + long)))
+        self.assertEqual(list(BibcodeSet(long) - BibcodeSet(short)), ['1999A&A...1..1A.extra'])
+        self.assertEqual(BibcodeSet(short) & BibcodeSet(long), BibcodeSet(['1999A&A...1..1A']))
+
+    def test_from_sorted(self):
+        self.assertEqual(BibcodeSet.from_sorted(sorted(LEFT)), BibcodeSet(LEFT))
+        self.assertRaises(GenericError, BibcodeSet.from_sorted, LEFT)
+
+    def test_from_file(self):
+        fd, filepath = tempfile.mkstemp()
+        os.write(fd, '1999A&A...2..1A\t2\n 1999A&A...9..1A\n\n1999A&A...1..1A\n')
+        os.close(fd)
+        try:
+            self.assertEqual(list(BibcodeSet.from_file(filepath)), ['1999A&A...1..1A', '1999A&A...2..1A'])
+        finally:
+            os.remove(filepath)
+        self.assertRaises(GenericError, BibcodeSet.from_file, filepath)
+
+    def test_union_all(self):
+        sets = [BibcodeSet(LEFT), BibcodeSet(RIGHT), BibcodeSet()]
+        self.assertEqual(list(BibcodeSet.union_all(sets)), sorted(set(LEFT) | set(RIGHT)))
+        sets = [BibcodeSet(['1999A&A...1..1A']), BibcodeSet(['1999A&A...2..1A', '1999A&A...3..1A.extra'])]
+        self.assertEqual(list(BibcodeSet.union_all(sets)), ['1999A&A...1..1A', '1999A&A...2..1A', '1999A&A...3..1A.extra'])
+
+class TestReadBibcodes(unittest.TestCase):
+
+    def setUp(self):
+        self.lines = ['1999A&A...2..1A\t2\n', ' 1999A&A...9..1A\n', '\n', '\tcomment\n', '1999A&A...1..1A\r\n',
+                      '1999A&A...5..1A\n', '1999A&A...2..1A\t2\n', '1999A&A...4..1A']
+        fd, self.filepath = tempfile.mkstemp()
+        os.write(fd, ''.join(self.lines))
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filepath)
+
+    def test_read_bibcodes(self):
+        out = ['1999A&A...2..1A', '1999A&A...1..1A', '1999A&A...5..1A', '1999A&A...2..1A', '1999A&A...4..1A']
+        self.assertEqual(read_bibcodes(self.filepath), out)
+        #the blocks always end at the end of a line
+        for block_size in range(1, 40):
+            blocks = list(iter_bibcode_blocks(self.filepath, block_size))
+            self.assertEqual(sum(blocks, []), out)
+        self.assertEqual(list(BibcodeSet.from_file(self.filepath)), sorted(set(out)))
+
+    def test_read_empty_file(self):
+        open(self.filepath, 'w').close()
+        self.assertEqual(read_bibcodes(self.filepath), [])
+        self.assertEqual(BibcodeSet.from_file(self.filepath), BibcodeSet())
+
+if __name__ == '__main__':
+    unittest.main()
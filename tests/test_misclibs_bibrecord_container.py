@@ -0,0 +1,83 @@
+# coding=UTF-8
+# Copyright (C) 2011, The SAO/NASA Astrophysics Data System
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+File containing the tests of the binary container of bibrecords
+'''
+
+import sys
+sys.path.append('../')
+import unittest
+import cPickle
+from cStringIO import StringIO
+
+from merger.basic_functions import SubfieldList
+from merger.merger_errors import GenericError
+import misclibs.bibrecord_container as c
+
+def make_record(number):
+    """returns a record with control fields, unicode values and a SubfieldList"""
+    return {
+        '001': [([], ' ', ' ', str(number), 1)],
+        '100': [(SubfieldList([('a', 'Author, A.'), ('b', u'Fran\xe7ois %d' % number)]), ' ', ' ', '', 2)],
+        '999': [([('s', 'reference %d' % i), ('8', 'ADS')], 'C', '5', '', 3 + i) for i in range(number % 5)],
+        '980': [([('a', '')], '', '', u'', 10)],
+    }
+
+class TestBibrecordContainer(unittest.TestCase):
+
+    def setUp(self):
+        self.records = [make_record(number) for number in range(200)]
+        #the records read back are like the unpickled ones
+        self.expected = cPickle.loads(cPickle.dumps(self.records, 2))
+
+    def test_round_trip(self):
+        data = c.dumps(self.records)
+        self.assertTrue(c.is_container(data))
+        self.assertEqual(c.loads(data), self.expected)
+        self.assertEqual(c.loads(c.dumps([])), [])
+        #the values keep their types
+        record = c.loads(data)[7]
+        self.assertEqual(type(record['100'][0][0][0][1]), str)
+        self.assertEqual(type(record['100'][0][0][1][1]), unicode)
+        self.assertEqual(type(record['980'][0][3]), unicode)
+        #the repeated tags and codes are stored once per block: the container is smaller than the pickle
+        self.assertTrue(len(data) < len(cPickle.dumps(self.records, 2)))
+
+    def test_streaming_and_seek(self):
+        output = StringIO()
+        writer = c.BibrecordContainerWriter(output, records_per_block=16)
+        for record in self.records:
+            writer.write(record)
+        #the records of the blocks already written can be read before the end of the container
+        partial = c.iter_records(StringIO(output.getvalue()))
+        self.assertEqual([partial.next() for i in range(16)], self.expected[:16])
+        writer.close()
+        reader = c.BibrecordContainerReader(StringIO(output.getvalue()))
+        self.assertEqual(len(reader), 200)
+        for number in (199, 0, 15, 16, 17, 100):
+            self.assertEqual(reader.get_record(number), self.expected[number])
+        self.assertRaises(IndexError, reader.get_record, 200)
+
+    def test_errors(self):
+        self.assertRaises(GenericError, c.dumps, [{'100': [([('a', 1)], ' ', ' ', '', 1)]}])
+        self.assertRaises(GenericError, c.dumps, [{100: [([], ' ', ' ', '', 1)]}])
+        self.assertRaises(GenericError, c.dumps, [{'100': [([], ' ', ' ', '')]}])
+        self.assertRaises(GenericError, c.loads, cPickle.dumps(self.records))
+        #truncated container
+        self.assertRaises(GenericError, c.loads, c.dumps(self.records)[:1000])
+
+if __name__ == '__main__':
+    unittest.main()
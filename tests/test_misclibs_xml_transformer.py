@@ -23,6 +23,10 @@ sys.path.append('../')
 import unittest
 import libxml2, libxslt
 import re
+import glob
+import os
+import shutil
+import tempfile
 
 import pipeline_settings
 
@@ -73,6 +77,65 @@ class TestXMLTransformer(unittest.TestCase):
         result_xml_transformer, result_invenio = get_result_invenio_xmltransformer(xmlstring)
         self.assertEqual(result_xml_transformer, result_invenio)
 
+    def test_4_all_xmlfiles(self):
+        for filename in sorted(glob.glob('xmlfiles/*.xml')):
+            result_xml_transformer, result_invenio = get_result_invenio_xmltransformer(open(filename, 'r').read())
+            self.assertEqual(result_xml_transformer, result_invenio, filename)
+
+    def test_5_incomplete_fields(self):
+        marcxml = """<collections>
+<collection>
+  <record>
+    <datafield tag="100" ind1="1">
+      <subfield code="a">No second indicator</subfield>
+    </datafield>
+    <datafield tag="245" ind1="" ind2="0">
+      <!-- comment -->
+      <subfield>No code</subfield>
+      <subfield code="a">A <i>nested</i> title</subfield>
+    </datafield>
+    <datafield tag="300" ind1=" " ind2=" "/>
+    <controlfield tag="001">1</controlfield>
+    <datafield tag="500" ind1=" " ind2=" ">
+      <subfield>No code</subfield>
+    </datafield>
+  </record>
+  <record/>
+</collection>
+<collection/>
+</collections>"""
+        expected = [[{'245': [([('a', 'A nested title')], ' ', '0', '', 1)], '500': [([], ' ', ' ', '', 2)]}]]
+        self.assertEqual(x.create_record_from_libxml_obj(libxml2.parseDoc(marcxml), logger), expected)
+        self.assertEqual(x.create_record_from_libxml_obj(libxml2.parseDoc('<collections/>'), logger), {})
+
+    def test_6_free_nodes(self):
+        xmlstring = open('xmlfiles/test_3_create_record_from_libxml_obj.xml', 'r').read()
+        stylesheet = libxslt.parseStylesheetDoc(libxml2.parseFile('../misc/AdsXML2MarcXML_v2.xsl'))
+        doc = stylesheet.applyStylesheet(libxml2.parseDoc(xmlstring), None)
+        expected = x.create_record_from_libxml_obj(doc, logger)
+        self.assertEqual(list(x.iter_records_from_libxml_obj(doc, logger, free_nodes=True)), expected)
+        self.assertEqual(x.create_record_from_libxml_obj(doc, logger), {})
+
+    def test_7_stylesheet_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            xslt = os.path.join(tmpdir, 'stylesheet.xsl')
+            shutil.copy('../misc/AdsXML2MarcXML_v2.xsl', xslt)
+            style_obj = x.get_stylesheet(xslt)
+            self.assertTrue(x.get_stylesheet(xslt) is style_obj)
+            #a modified file is compiled again
+            mtime = int(os.path.getmtime(xslt))
+            os.utime(xslt, (mtime + 10, mtime + 10))
+            self.assertFalse(x.get_stylesheet(xslt) is style_obj)
+            self.assertEqual(x._STYLESHEETS[xslt][0], mtime + 10)
+            x.free_stylesheets()
+            self.assertEqual(x._STYLESHEETS, {})
+            os.remove(xslt)
+            self.assertRaises(x.GenericError, x.get_stylesheet, xslt)
+        finally:
+            x.free_stylesheets()
+            shutil.rmtree(tmpdir)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,94 @@
+# -*- encoding: utf-8 -*-
+import sys
+sys.path.append('../')
+import unittest
+import os
+import shutil
+import tempfile
+
+import pipeline_group_scheduler as s
+
+import pipeline_settings
+
+import logging
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_GLOBAL_NAME)
+logger.setLevel(logging.CRITICAL)
+
+def make_bibcodes(year, journal, number):
+    return ['%s%s.%04d...A' % (year, journal, i) for i in range(number)]
+
+class TestCostModel(unittest.TestCase):
+
+    def test_default_cost(self):
+        model = s.CostModel()
+        self.assertEqual(model.estimate('1850AN.....1....1A'), 0.01)
+        self.assertEqual(model.estimate('1999ApJ...500..1A'), 0.02)
+        self.assertEqual(model.estimate('2011ApJ...741...91C'), 0.06)
+        self.assertEqual(model.estimate('bad bibcode'), 0.06)
+
+    def test_timings(self):
+        model = s.CostModel()
+        bibcodes = make_bibcodes('1850', 'AN...', 1) + make_bibcodes('2011', 'ApJ..', 2)
+        #the time is split according to the estimated costs
+        timings = model.get_group_timings(bibcodes, 13.0)
+        self.assertAlmostEqual(timings['1850AN...'][0], 1.0)
+        self.assertEqual(timings['1850AN...'][1], 1)
+        self.assertAlmostEqual(timings['2011'][0], 12.0)
+        self.assertEqual(timings['2011'][1], 2)
+        #the history is used only with enough samples
+        model.add_timings({'2011ApJ..': [1.0, pipeline_settings.BIBCODE_COST_MIN_SAMPLES - 1]})
+        self.assertEqual(model.estimate('2011ApJ...741...91C'), 0.06)
+        model.add_timings({'2011ApJ..': [1.0, 1]})
+        self.assertAlmostEqual(model.estimate('2011ApJ...741...91C'), 2.0 / pipeline_settings.BIBCODE_COST_MIN_SAMPLES)
+        self.assertEqual(model.estimate('2011MNRAS.741...91C'), 0.06)
+
+    def test_load_save(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filepath = os.path.join(tmpdir, 'history')
+            self.assertEqual(s.CostModel.load(filepath).timings, {})
+            self.assertEqual(s.CostModel.load(None).timings, {})
+            timings = {'2011ApJ..': [0.1, 3], '2011': [1.0 / 3, 7]}
+            s.CostModel(timings).save(filepath)
+            self.assertEqual(s.CostModel.load(filepath).timings, timings)
+            #a broken history is ignored
+            with open(filepath, 'a') as history_file:
+                history_file.write('broken line\n')
+            self.assertEqual(s.CostModel.load(filepath).timings, {})
+        finally:
+            shutil.rmtree(tmpdir)
+
+class TestMakeGroups(unittest.TestCase):
+
+    def test_same_cost(self):
+        bibcodes = make_bibcodes('2011', 'ApJ..', 1000)
+        groups = s.make_groups(bibcodes, s.CostModel(), 100, 2)
+        self.assertEqual(sum(groups, []), bibcodes)
+        #full groups and then smaller groups at the end
+        self.assertEqual([len(group) for group in groups[:6]], [100] * 6)
+        self.assertTrue(all(len(group) <= 100 for group in groups))
+        self.assertTrue(len(groups[-1]) < 100)
+        #(only the last group can be smaller than the minimum)
+        self.assertTrue(min(len(group) for group in groups[:-1]) >= 100 * pipeline_settings.GROUP_TAIL_MIN_FRACTION)
+        self.assertEqual(s.make_groups([], s.CostModel(), 100, 2), [])
+        #the groups are generated one at a time
+        groups_iterator = s.iter_groups(bibcodes, s.CostModel(), 100, 2)
+        self.assertEqual(groups_iterator.next(), bibcodes[:100])
+        self.assertEqual(list(groups_iterator), groups[1:])
+
+    def test_balanced_cost(self):
+        model = s.CostModel()
+        bibcodes = make_bibcodes('1850', 'AN...', 3000) + make_bibcodes('2011', 'ApJ..', 3000)
+        groups = s.make_groups(bibcodes, model, 1000, 1)
+        self.assertEqual(sum(groups, []), bibcodes)
+        costs = [sum(model.estimate(bibcode) for bibcode in group) for group in groups]
+        #the groups of the expensive bibcodes are smaller, but they cost as much as the others
+        self.assertEqual(len(groups[0]), 1000)
+        self.assertEqual(len(groups[3]), 583)
+        self.assertAlmostEqual(costs[3], costs[4], 6)
+        #the groups at the end are smaller
+        self.assertTrue(costs[-2] < costs[3] / 2)
+
+if __name__ == '__main__':
+    unittest.main()
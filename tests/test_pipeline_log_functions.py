@@ -0,0 +1,109 @@
+# -*- encoding: utf-8 -*-
+import sys
+sys.path.append('../')
+import unittest
+import time
+
+from pipeline_log_functions import trace, trace_method, get_logger, get_resident_memory
+
+import pipeline_settings
+
+import logging
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_GLOBAL_NAME)
+logger.setLevel(logging.ERROR)
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+class Traced(object):
+    def __init__(self, logger):
+        self.logger = logger
+    @trace_method(enabled=True)
+    def method(self, value):
+        return value * 2
+
+class TestTrace(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('test_trace')
+        self.logger.propagate = False
+        self.handler = ListHandler()
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_trace_disabled(self):
+        def function():
+            return 1
+        self.assertTrue(trace(self.logger, enabled=False)(function) is function)
+        self.assertTrue(trace_method(function, enabled=False) is function)
+
+    def test_trace_enabled(self):
+        @trace(self.logger, enabled=True)
+        def function(value):
+            return value + 1
+        self.assertEqual(function.__name__, 'function')
+        self.assertEqual(function(1), 2)
+        self.assertEqual(self.handler.messages[0], 'In function function')
+        self.assertTrue(self.handler.messages[1].startswith('Out of function function'))
+        self.assertEqual(Traced(self.logger).method(2), 4)
+        self.assertEqual(self.handler.messages[2], 'In function Traced.method')
+        #nothing is logged if the level is higher than INFO
+        self.logger.setLevel(logging.WARNING)
+        self.assertEqual(function(1), 2)
+        self.assertEqual(len(self.handler.messages), 4)
+
+    def test_trace_generator(self):
+        @trace(self.logger, enabled=True)
+        def generator(values):
+            for value in values:
+                time.sleep(0.05)
+                yield value
+        iterator = generator([1, 2, 3])
+        #nothing is logged before the iteration starts
+        self.assertEqual(self.handler.messages, [])
+        self.assertEqual(list(iterator), [1, 2, 3])
+        self.assertEqual(self.handler.messages[0], 'In function generator')
+        #the time spent in the generator is logged when it is exhausted
+        self.assertTrue(self.handler.messages[1].startswith('Out of function generator'))
+        self.assertTrue(float(self.handler.messages[1].split('(')[1].split()[0]) >= 0.1)
+        #and when it is closed before the end
+        iterator = generator([1, 2, 3])
+        self.assertEqual(next(iterator), 1)
+        self.assertEqual(len(self.handler.messages), 3)
+        iterator.close()
+        self.assertTrue(self.handler.messages[3].startswith('Out of function generator'))
+        #nothing is logged if the level is higher than INFO
+        self.logger.setLevel(logging.WARNING)
+        self.assertEqual(list(generator([1])), [1])
+        self.assertEqual(len(self.handler.messages), 4)
+
+    def test_silent_logger(self):
+        silent_logger = get_logger('test_trace', silent=True)
+        silent_logger.info('info %s', 1)
+        silent_logger.debug('debug %s', 1)
+        silent_logger.warning('warning %s', 1)
+        self.assertEqual(self.handler.messages, ['warning 1'])
+        self.assertFalse(silent_logger.isEnabledFor(logging.INFO))
+        self.assertTrue(silent_logger.isEnabledFor(logging.WARNING))
+        self.assertTrue(get_logger('test_trace') is self.logger)
+
+    def test_get_resident_memory(self):
+        rss = get_resident_memory()
+        if rss is None:
+            self.skipTest('/proc/self/statm not available')
+        self.assertTrue(rss > 0)
+        #the memory grows with a big allocation
+        data = ' ' * (64 * 1024 * 1024)
+        self.assertTrue(get_resident_memory() > rss + 32 * 1024 * 1024)
+        del data
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,278 @@
+# -*- encoding: utf-8 -*-
+import sys
+sys.path.append('../')
+import unittest
+import os
+import shutil
+import tempfile
+import time
+import sqlite3
+
+import pipeline_timestamp_manager as t
+import pipeline_timestamp_snapshot as snapshot
+from merger.merger_errors import GenericError
+
+import pipeline_settings
+
+import logging
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_GLOBAL_NAME)
+logger.setLevel(logging.ERROR)
+
+class TestDiffTimestamps(unittest.TestCase):
+
+    def test_diff_timestamps(self):
+        ads_timestamps = [('1999A&A...1..1A', 'ts1'), ('1999A&A...2..1A', 'ts2'), ('1999A&A...4..1A', 'ts4')]
+        invenio_timestamps = [('1999A&A...2..1A', 'ts2'), ('1999A&A...3..1A', 'ts3'), ('1999A&A...4..1A', 'old')]
+        out = [(t.STATUS_ADDED, '1999A&A...1..1A'), (t.STATUS_DELETED, '1999A&A...3..1A'), (t.STATUS_MODIFIED, '1999A&A...4..1A')]
+        self.assertEqual(list(t.diff_timestamps(ads_timestamps, invenio_timestamps)), out)
+
+    def test_diff_timestamps_empty(self):
+        timestamps = [('1999A&A...1..1A', 'ts1'), ('1999A&A...2..1A', 'ts2')]
+        self.assertEqual(list(t.diff_timestamps([], [])), [])
+        self.assertEqual(list(t.diff_timestamps(timestamps, [])),
+                         [(t.STATUS_ADDED, '1999A&A...1..1A'), (t.STATUS_ADDED, '1999A&A...2..1A')])
+        self.assertEqual(list(t.diff_timestamps([], timestamps)),
+                         [(t.STATUS_DELETED, '1999A&A...1..1A'), (t.STATUS_DELETED, '1999A&A...2..1A')])
+
+    def test_diff_timestamps_duplicates(self):
+        #the last timestamp of a bibcode wins
+        ads_timestamps = [('1999A&A...1..1A', 'old'), ('1999A&A...1..1A', 'ts1')]
+        invenio_timestamps = [('1999A&A...1..1A', 'ts1')]
+        self.assertEqual(list(t.diff_timestamps(ads_timestamps, invenio_timestamps)), [])
+
+    def test_diff_timestamps_not_sorted(self):
+        ads_timestamps = [('1999A&A...2..1A', 'ts2'), ('1999A&A...1..1A', 'ts1')]
+        self.assertRaises(GenericError, list, t.diff_timestamps(ads_timestamps, []))
+
+class TestAdsTimestamps(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.old_settings = (t.TIMESTAMP_FILES_HIERARCHY, t.ads.pub2arx)
+        t.TIMESTAMP_FILES_HIERARCHY = [os.path.join(self.tmpdir, name) for name in ('GEN', 'PRE', 'PHY', 'AST')]
+        t.ads.pub2arx = os.path.join(self.tmpdir, 'pub2arx')
+
+    def tearDown(self):
+        t.TIMESTAMP_FILES_HIERARCHY, t.ads.pub2arx = self.old_settings
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, filename, lines):
+        fd = open(filename, 'w')
+        for line in lines:
+            fd.write('\t'.join(line) + '\n')
+        fd.close()
+
+    def test_hierarchy(self):
+        gen, pre, phy, ast = t.TIMESTAMP_FILES_HIERARCHY
+        self._write(gen, [('1999A&A...1..1A', 'gen'), ('1999A&A...2..1A', 'gen'), ('1999A&A...4..1A', 'gen'), ('1999A&A...5..1A', 'gen')])
+        self._write(pre, [('1999A&A...2..1A', 'pre'), ('1999A&A...3..1A', 'pre')])
+        self._write(phy, [('1999A&A...1..1A', 'phy'), ('1999A&A...3..1A', 'phy'), ('1999A&A...4..1A', 'phy')])
+        self._write(ast, [('1999A&A...1..1A', 'ast'), ('1999A&A...4..1A', 'ast')])
+        #the published eprints are not in Invenio
+        self._write(t.ads.pub2arx, [('1999A&A...5..1A', '1999A&A...5..1A')])
+        #for each bibcode the timestamp of the most important database wins
+        self.assertEqual(list(t._iter_ads_timestamps()),
+                         [('1999A&A...1..1A', 'ast'), ('1999A&A...2..1A', 'pre'),
+                          ('1999A&A...3..1A', 'phy'), ('1999A&A...4..1A', 'ast')])
+
+    def test_use_snapshot(self):
+        for filename in t.TIMESTAMP_FILES_HIERARCHY:
+            self._write(filename, [])
+        self._write(t.TIMESTAMP_FILES_HIERARCHY[0], [('1999A&A...1..1A', 'ts1')])
+        self._write(t.ads.pub2arx, [])
+        old_settings = (t.TIMESTAMP_SNAPSHOT_DIR, snapshot.settings.TIMESTAMP_SNAPSHOT_DIR, t._iter_invenio_timestamps)
+        t.TIMESTAMP_SNAPSHOT_DIR = snapshot.settings.TIMESTAMP_SNAPSHOT_DIR = os.path.join(self.tmpdir, 'snapshot')
+        #the record is not in Invenio (e.g. its upload failed)
+        t._iter_invenio_timestamps = lambda: iter([])
+        try:
+            t.write_snapshot()
+            t.commit_snapshot([])
+            self.assertEqual(list(t.iter_records_status()), [])
+            self.assertEqual(list(t.iter_records_status(use_snapshot=False)), [(t.STATUS_ADDED, '1999A&A...1..1A')])
+        finally:
+            t.TIMESTAMP_SNAPSHOT_DIR, snapshot.settings.TIMESTAMP_SNAPSHOT_DIR, t._iter_invenio_timestamps = old_settings
+
+class TestTimestampSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.old_settings = (snapshot.settings.TIMESTAMP_SNAPSHOT_DIR, snapshot.settings.TIMESTAMP_SNAPSHOT_BLOCK_LINES)
+        snapshot.settings.TIMESTAMP_SNAPSHOT_DIR = os.path.join(self.tmpdir, 'snapshot')
+        snapshot.settings.TIMESTAMP_SNAPSHOT_BLOCK_LINES = 2
+        self.files = [os.path.join(self.tmpdir, 'ADS'), os.path.join(self.tmpdir, 'ARXIV')]
+
+    def tearDown(self):
+        snapshot.settings.TIMESTAMP_SNAPSHOT_DIR, snapshot.settings.TIMESTAMP_SNAPSHOT_BLOCK_LINES = self.old_settings
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, filename, bibcodes):
+        fd = open(filename, 'w')
+        for bibcode, timestamp in bibcodes:
+            fd.write('%s\t%s\n' % (bibcode, timestamp))
+        fd.close()
+
+    def test_iter_changes(self):
+        self._write(self.files[0], [('1999A&A...1..1A', 'ts1'), ('1999A&A...2..1A', 'ts2'),
+                                    ('1999A&A...3..1A', 'ts3'), ('1999A&A...4..1A', 'ts4'), ('1999A&A...5..1A', 'ts5')])
+        self._write(self.files[1], [('1999A&A...6..1A', 'ts6')])
+        self.assertFalse(snapshot.snapshot_exists(self.files))
+        snapshot.write_snapshot(self.files, set())
+        snapshot.commit_snapshot(['1999A&A...5..1A'])
+        self.assertTrue(snapshot.snapshot_exists(self.files))
+        #the first file changes, the second one is untouched
+        self._write(self.files[0], [('1999A&A...0..1A', 'ts0'), ('1999A&A...1..1A', 'ts1'),
+                                    ('1999A&A...3..1A', 'new'), ('1999A&A...4..1A', 'ts4'), ('1999A&A...5..1A', 'ts5')])
+        changes = [(bibcode, old is None, new is None) for bibcode, old, new in snapshot.iter_changes(self.files, set(['1999A&A...6..1A']))]
+        self.assertEqual(changes, [('1999A&A...0..1A', True, False), ('1999A&A...2..1A', False, True),
+                                   ('1999A&A...3..1A', False, False), ('1999A&A...5..1A', False, False),
+                                   ('1999A&A...6..1A', False, True)])
+        snapshot.commit_snapshot([])
+        self.assertEqual(list(snapshot.iter_changes(self.files, set(['1999A&A...6..1A']))), [])
+
+    def test_invenio_check(self):
+        self._write(self.files[0], [('1999A&A...1..1A', 'ts1')])
+        self._write(self.files[1], [])
+        old_max_age = snapshot.settings.TIMESTAMP_SNAPSHOT_MAX_AGE_DAYS
+        snapshot.settings.TIMESTAMP_SNAPSHOT_MAX_AGE_DAYS = 7
+        try:
+            snapshot.write_snapshot(self.files, set())
+            snapshot.commit_snapshot([])
+            self.assertFalse(snapshot.invenio_check_needed())
+            #the time of the comparison with Invenio is kept by the incremental updates
+            check_file = os.path.join(snapshot.settings.TIMESTAMP_SNAPSHOT_DIR, snapshot.CURRENT_DIR, snapshot.INVENIO_CHECK_FILE)
+            snapshot._write_lines(check_file, [repr(time.time() - 8 * 24 * 3600)])
+            list(snapshot.iter_changes(self.files, set()))
+            snapshot.commit_snapshot([])
+            self.assertTrue(snapshot.invenio_check_needed())
+            snapshot.settings.TIMESTAMP_SNAPSHOT_MAX_AGE_DAYS = None
+            self.assertFalse(snapshot.invenio_check_needed())
+        finally:
+            snapshot.settings.TIMESTAMP_SNAPSHOT_MAX_AGE_DAYS = old_max_age
+
+    def test_add_retry_bibcodes(self):
+        self._write(self.files[0], [('1999A&A...1..1A', 'ts1'), ('1999A&A...2..1A', 'ts2')])
+        self._write(self.files[1], [])
+        #without a current snapshot there is nothing to retry
+        self.assertFalse(snapshot.add_retry_bibcodes(['1999A&A...1..1A']))
+        snapshot.write_snapshot(self.files, set())
+        snapshot.commit_snapshot(['1999A&A...1..1A'])
+        #the recovery of an extraction adds its bibcodes to the current snapshot
+        self.assertTrue(snapshot.add_retry_bibcodes(['1999A&A...2..1A']))
+        changes = [bibcode for bibcode, old, new in snapshot.iter_changes(self.files, set())]
+        self.assertEqual(changes, ['1999A&A...1..1A', '1999A&A...2..1A'])
+
+    def test_commit_or_add_retry(self):
+        self._write(self.files[0], [('1999A&A...1..1A', 'ts1'), ('1999A&A...2..1A', 'ts2')])
+        self._write(self.files[1], [])
+        old_dir = t.TIMESTAMP_SNAPSHOT_DIR
+        t.TIMESTAMP_SNAPSHOT_DIR = snapshot.settings.TIMESTAMP_SNAPSHOT_DIR
+        try:
+            snapshot.write_snapshot(self.files, set())
+            t.commit_snapshot(['1999A&A...1..1A'])
+            self.assertFalse(snapshot.pending_snapshot_exists())
+            #no pending snapshot: the bibcodes are added to the current one
+            t.commit_snapshot(['1999A&A...2..1A'])
+            self.assertTrue(snapshot.snapshot_exists(self.files))
+            retry_file = os.path.join(snapshot.settings.TIMESTAMP_SNAPSHOT_DIR, snapshot.CURRENT_DIR, snapshot.RETRY_FILE)
+            self.assertEqual(snapshot._read_lines(retry_file), ['1999A&A...1..1A', '1999A&A...2..1A'])
+        finally:
+            t.TIMESTAMP_SNAPSHOT_DIR = old_dir
+
+    def test_find_line(self):
+        bibcodes = ['1999A&A...1..1A', '1999A&A...2..1A', '1999A&A...2..1A', '1999A&A...22.1A', '1999A&A...3..1A']
+        content = ''.join('%s\tts%d\n' % (bibcode, i) for i, bibcode in enumerate(bibcodes))
+        line_starts = [0]
+        for bibcode in bibcodes:
+            line_starts.append(content.index('\n', line_starts[-1]) + 1)
+        for start in range(len(content) + 1):
+            for bibcode in bibcodes + ['1999A&A...0..1A', '1999A&A...25.1A', '1999A&A...9..1A']:
+                #the first line at or after start with the bibcode
+                expected = [line_start for line_start, line_bibcode in zip(line_starts, bibcodes)
+                            if line_start >= start and line_bibcode == bibcode]
+                self.assertEqual(snapshot._find_line(content, bibcode, start), (expected + [-1])[0])
+
+    def test_not_sorted_after_copied_block(self):
+        self._write(self.files[0], [('1999A&A...1..1A', 'ts1'), ('1999A&A...3..1A', 'ts3')])
+        snapshot.write_snapshot(self.files[:1], set())
+        snapshot.commit_snapshot([])
+        old_dir = os.path.join(snapshot.settings.TIMESTAMP_SNAPSHOT_DIR, snapshot.CURRENT_DIR)
+        new_dir = os.path.join(self.tmpdir, 'new')
+        os.mkdir(new_dir)
+        old_data = snapshot._SnapshotData(old_dir, 0)
+        writer = snapshot._SnapshotWriter(new_dir, 0)
+        try:
+            writer.copy_block(old_data, snapshot._read_block_index(old_dir, 0)[0])
+            #a line between the first and the last bibcode of the copied block is out of order
+            self.assertRaises(GenericError, writer.add_lines, ['1999A&A...2..1A\tts2\n'])
+        finally:
+            writer.close()
+            old_data.close()
+
+class TestInvenioTimestamps(unittest.TestCase):
+
+    def setUp(self):
+        #I build a minimal copy of the bibxxx tables in SQLite
+        self.connection = sqlite3.connect(':memory:')
+        for table in ('97', '98', '99'):
+            self.connection.execute('CREATE TABLE bib%sx (id INTEGER PRIMARY KEY, tag TEXT, value TEXT)' % table)
+            self.connection.execute('CREATE TABLE bibrec_bib%sx (id_bibrec INTEGER, id_bibxxx INTEGER)' % table)
+        records = [(1, '1999A&A...3..1A', ['ts3'], False),
+                   (2, '1999A&A...1..1A', ['ts1'], False),
+                   (3, '1999A&A...2..1A', ['ts2'], True),
+                   (4, '1999a&A...1..1A', ['ts1a'], False),
+                   (5, '1999A&A...4..1A', ['ts4a', 'ts4b'], False),
+                   (6, '1999A&A...1..1A', ['ts1b'], False)]
+        for recid, bibcode, timestamps, deleted in records:
+            self._add_field(recid, '97', '970__a', bibcode)
+            for timestamp in timestamps:
+                self._add_field(recid, '99', '995__a', timestamp)
+            if deleted:
+                self._add_field(recid, '98', '980__c', 'DELETED')
+        self.queries = 0
+
+    def tearDown(self):
+        self.connection.close()
+
+    def _add_field(self, recid, table, tag, value):
+        cursor = self.connection.execute('INSERT INTO bib%sx (tag, value) VALUES (?, ?)' % table, (tag, value))
+        self.connection.execute('INSERT INTO bibrec_bib%sx VALUES (?, ?)' % table, (recid, cursor.lastrowid))
+
+    def _run_sql(self, query, params=()):
+        self.queries += 1
+        return self.connection.execute(query.replace('%s', '?'), params).fetchall()
+
+    def test_iter_invenio_timestamps(self):
+        out = [('1999A&A...1..1A', 'ts1'), ('1999A&A...1..1A', 'ts1b'), ('1999A&A...3..1A', 'ts3'),
+               ('1999A&A...4..1A', 'ts4a'), ('1999A&A...4..1A', 'ts4b'), ('1999a&A...1..1A', 'ts1a')]
+        #the record ids go from 1 to 6: one query for the range, then two queries per chunk of record ids
+        for chunk_size, chunks in ((1, 6), (2, 3), (4, 2), (5, 2), (6, 1), (100, 1)):
+            self.queries = 0
+            timestamps = list(t._iter_invenio_timestamps(self._run_sql, chunk_size))
+            self.assertEqual(timestamps, out)
+            self.assertEqual(self.queries, 1 + 2 * chunks)
+
+    def test_record_without_bibcode(self):
+        self._add_field(7, '99', '995__a', 'ts7')
+        messages = []
+        handler = logging.Handler()
+        handler.emit = lambda record: messages.append(record.getMessage())
+        level = t.logger.level
+        t.logger.addHandler(handler)
+        t.logger.setLevel(logging.ERROR)
+        try:
+            timestamps = list(t._iter_invenio_timestamps(self._run_sql, 4))
+        finally:
+            t.logger.removeHandler(handler)
+            t.logger.setLevel(level)
+        self.assertEqual(len(timestamps), 6)
+        self.assertEqual(messages, ['ERROR: Record 7 has no bibcode.'])
+
+    def test_iter_invenio_timestamps_empty(self):
+        self.connection.execute('DELETE FROM bibrec_bib99x')
+        self.queries = 0
+        self.assertEqual(list(t._iter_invenio_timestamps(self._run_sql, 2)), [])
+        self.assertEqual(self.queries, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# -*- encoding: utf-8 -*-
+import sys
+sys.path.append('../')
+import unittest
+import os
+import shutil
+import tempfile
+import pickle
+
+import pipeline_upload_spool as spool
+
+import pipeline_settings
+
+import logging
+logging.basicConfig(format=pipeline_settings.LOGGING_FORMAT)
+logger = logging.getLogger(pipeline_settings.LOGGING_GLOBAL_NAME)
+logger.setLevel(logging.CRITICAL)
+
+RECORDS = [{'001': [([], ' ', ' ', '1999PASP..111..438F', 1)], '100': [([('a', u'Fran\xe7ois')], ' ', ' ', '', 2)]}]
+
+class TestUploadSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.spool_dir = pipeline_settings.UPLOAD_SPOOL_DIR
+        self.min_free = pipeline_settings.UPLOAD_SPOOL_MIN_FREE_MB
+        pipeline_settings.UPLOAD_SPOOL_DIR = self.tmpdir
+        pipeline_settings.UPLOAD_SPOOL_MIN_FREE_MB = 0
+
+    def tearDown(self):
+        pipeline_settings.UPLOAD_SPOOL_DIR = self.spool_dir
+        pipeline_settings.UPLOAD_SPOOL_MIN_FREE_MB = self.min_free
+        shutil.rmtree(self.tmpdir)
+
+    def test_write_read(self):
+        spool_directory = spool.create_spool_directory('name')
+        self.assertTrue(os.path.isdir(spool_directory))
+        data = spool.serialize_records(RECORDS)
+        #the serialized records can be read by pickle (that is used by bibupload)
+        self.assertEqual(pickle.loads(data), RECORDS)
+        spool_path = spool.write_spool(spool_directory, 'group', data)
+        self.assertEqual(list(spool.read_spool(spool_path)), RECORDS)
+        #the spool file is removed once read
+        self.assertFalse(os.path.exists(spool_path))
+        spool.write_spool(spool_directory, 'group', data)
+        spool.remove_spool_directory('name')
+        self.assertFalse(os.path.exists(spool_directory))
+
+    def test_container(self):
+        data = spool.serialize_records(RECORDS, 'container')
+        self.assertNotEqual(data, spool.serialize_records(RECORDS))
+        filepath = os.path.join(self.tmpdir, 'group')
+        with open(filepath, 'wb') as file_obj:
+            file_obj.write(data)
+        self.assertEqual(spool.load_records(filepath), RECORDS)
+        #bibupload reads only the pickled files
+        self.assertTrue(spool.convert_to_pickle(filepath))
+        with open(filepath, 'rb') as file_obj:
+            self.assertEqual(pickle.load(file_obj), RECORDS)
+        self.assertFalse(spool.convert_to_pickle(filepath))
+        #the records not supported by the container are pickled
+        data = spool.serialize_records([{'001': [([], ' ', ' ', 1, 1)]}], 'container')
+        self.assertEqual(pickle.loads(data), [{'001': [([], ' ', ' ', 1, 1)]}])
+
+    def test_file_bibcodes(self):
+        records = RECORDS + [{'970': [([('a', '2011ApJ...741...91C'), ('2', 'ADS')], ' ', ' ', '', 1)]}]
+        filepath = os.path.join(self.tmpdir, 'group')
+        with open(filepath, 'wb') as file_obj:
+            file_obj.write(spool.serialize_records(records, 'container'))
+        self.assertEqual(spool.get_file_bibcodes(filepath), ['2011ApJ...741...91C'])
+
+    def test_no_spool(self):
+        data = spool.serialize_records(RECORDS)
+        #without enough free space the spool is not used
+        pipeline_settings.UPLOAD_SPOOL_MIN_FREE_MB = 10 ** 12
+        spool_directory = spool.create_spool_directory('name')
+        self.assertEqual(spool.write_spool(spool_directory, 'group', data), None)
+        self.assertEqual(os.listdir(spool_directory), [])
+        #with the spool disabled
+        pipeline_settings.UPLOAD_SPOOL_DIR = None
+        self.assertEqual(spool.create_spool_directory('name'), None)
+        self.assertEqual(spool.write_spool(None, 'group', data), None)
+
+if __name__ == '__main__':
+    unittest.main()